@@ -0,0 +1,104 @@
+"""Admission control for the Sigfox ingest endpoints.
+
+At most INGEST_MAX_CONCURRENCY ingest requests touch the database at once and
+at most INGEST_MAX_WAITING more wait (up to INGEST_WAIT_TIMEOUT seconds) for a
+slot. Anything beyond that is shed according to INGEST_SHED_POLICY:
+
+    reject  answer with INGEST_REJECT_STATUS (503 or 429) and Retry-After, so
+            the Sigfox backend retries later
+    spill   decode the uplink and append it to the local spool (spool.py)
+            without touching the database; the replayer loads it later
+
+The concurrency cap defaults to the DB pool size minus SGS_DB_READ_RESERVE, so
+a burst of uplinks can never take the connections the /api/user/* dashboard
+reads need.
+
+Settings (environment):
+    SGS_INGEST_MAX_CONCURRENCY, SGS_INGEST_MAX_WAITING, SGS_INGEST_WAIT_TIMEOUT,
+    SGS_INGEST_SHED_POLICY, SGS_INGEST_REJECT_STATUS, SGS_DB_READ_RESERVE
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from db import POOL_MAX_SIZE
+
+DB_READ_RESERVE = int(os.environ.get("SGS_DB_READ_RESERVE", 5))
+INGEST_MAX_CONCURRENCY = int(os.environ.get("SGS_INGEST_MAX_CONCURRENCY", max(1, POOL_MAX_SIZE - DB_READ_RESERVE)))
+INGEST_MAX_WAITING = int(os.environ.get("SGS_INGEST_MAX_WAITING", 32))
+INGEST_WAIT_TIMEOUT = float(os.environ.get("SGS_INGEST_WAIT_TIMEOUT", 0.5))
+INGEST_SHED_POLICY = os.environ.get("SGS_INGEST_SHED_POLICY", "reject")
+INGEST_REJECT_STATUS = int(os.environ.get("SGS_INGEST_REJECT_STATUS", 503))
+RETRY_AFTER_SECONDS = 5
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency=INGEST_MAX_CONCURRENCY, max_waiting=INGEST_MAX_WAITING,
+                 wait_timeout=INGEST_WAIT_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._stats = {'admitted': 0, 'shed_queue_full': 0, 'shed_timeout': 0, 'waited': 0, 'peak_active': 0}
+
+    def acquire(self):
+        """Take a slot; returns False if the request should be shed."""
+        with self._cond:
+            if self._active >= self.max_concurrency:
+                if self._waiting >= self.max_waiting:
+                    self._stats['shed_queue_full'] += 1
+                    return False
+
+                self._waiting += 1
+                self._stats['waited'] += 1
+                deadline = time.monotonic() + self.wait_timeout
+                try:
+                    while self._active >= self.max_concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['shed_timeout'] += 1
+                            return False
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._active += 1
+            self._stats['admitted'] += 1
+            self._stats['peak_active'] = max(self._stats['peak_active'], self._active)
+            return True
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        """`with controller.admit() as admitted:` - the slot is released on exit."""
+        admitted = self.acquire()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'active': self._active,
+                'waiting': self._waiting,
+                'depth': self._active + self._waiting,
+                'max_concurrency': self.max_concurrency,
+                'max_waiting': self.max_waiting,
+                'policy': INGEST_SHED_POLICY,
+            })
+        stats['shed'] = stats['shed_queue_full'] + stats['shed_timeout']
+        return stats
+
+
+ingest_admission = AdmissionController()
@@ -1,11 +1,29 @@
 from flask import Flask, request, jsonify, render_template, redirect, url_for
 import struct
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 import json
+import threading
+import time
 from pages import app_pages
 from auth import auth
 from functools import wraps
-from db import get_db_connection, save_useful_data, save_to_db
+from db import get_db_connection, pool_stats, warm_known_devices, add_write_listener
+from known_devices import known_devices
+from dedup import uplink_dedup
+from ingest import ingest_entry, ingest_batch, ingest_stats, resume_spool, spool_entries
+from admission import ingest_admission, INGEST_SHED_POLICY, INGEST_REJECT_STATUS, RETRY_AFTER_SECONDS
+from schema import migrate
+from partitioning import maintain as maintain_partitions
+from decoders import (
+    decode_PowerTemp, decode_pulsemeter, decode_water_sensor, decode_magnetic_sensor, decode_tank_level,
+    decode_cache_stats
+)
+from decoder_registry import decoder_registry
+from latest_state import fetch_latest_state
+from charts import temperature_charts, temperature_history
+from response_cache import response_cache, cached_view
+from data_versions import data_versions, user_devices, conditional_view, etag_stats
+from live_updates import live_hub
 
 app = Flask(__name__)
 app.secret_key = 'your-super-secret-key'
@@ -15,14 +33,10 @@ app.secret_key = 'your-super-secret-key'
 app.register_blueprint(app_pages)
 app.register_blueprint(auth)
 
-# ----------------------------
-# Sensor Group Configuration
-# ----------------------------
-POWER_TEMP_DEVICES = {"1fc5622", "1fc57ca", "1fc56c3"}
-PULSE_METER_DEVICES = {"1fc74ab","1fa5f9c"}
-WATER_DETECT_DEVICES = {"c6e542", "c53d89", "c6d3a6", "c6da55"}
-MAGNETIC_DEVICES = {"1f7f022","c52fce"}
-TANK_LEVEL_DEVICES = {"1fc74ac","1fc74ad"}
+# Drop cached chart/history responses once new data for their devices is committed
+add_write_listener(response_cache.invalidate_entries)
+add_write_listener(data_versions.bump_entries)
+add_write_listener(live_hub.publish_entries)
 
 # ----------------------------
 # Home Redirect
@@ -32,329 +46,195 @@ TANK_LEVEL_DEVICES = {"1fc74ac","1fc74ad"}
 def root():
     return redirect(url_for('pages.user_dashboard'))
 
-# ----------------------------
-# Decoders
-# ----------------------------
-
-from datetime import datetime, timedelta
-
-def convert_to_signed(byte_str):
-    val = int(byte_str, 16)
-    return val - 256 if val > 127 else val
-
-def decode_PowerTemp(payload_hex, base_unix_time=1748265008):
-    try:
-        tx_flag = int(payload_hex[0:2], 16)
-        is_periodic = (tx_flag & 0x10) == 0x10
-
-        battery_voltage = round(int(payload_hex[2:4], 16) * 0.02, 2)
-        status_mask = int(payload_hex[4:6], 16)
-        temp_current = convert_to_signed(payload_hex[6:8])
-
-        result = {
-            'tx_flag': tx_flag,
-            'is_periodic': is_periodic,
-            'battery_volts': battery_voltage,
-            'status_mask': status_mask,
-            'temp_celsius': temp_current,
-            'timestamp': datetime.utcfromtimestamp(base_unix_time).isoformat(),
-            'temp_history': [],
-            'alerts': []
-        }
-
-        if is_periodic:
-            # Determine periodic interval in hours from tx_flag (bits 5,6,7)
-            device_interval = (tx_flag >> 5) & 0x07
-            interval_map = {
-                0: -0.25,
-                1: -0.5,
-                2: -1,
-                3: -2,
-                4: -3,
-                5: -4,
-                6: -5,
-                7: -6
-            }
-            time_period = interval_map.get(device_interval, -1)
-
-            base_time = datetime.utcfromtimestamp(base_unix_time)
-            history = []
-
-            # Extract and timestamp the 4 historical temperature min/max pairs
-            for i in range(4):
-                offset = 8 + i * 4
-                t_min = convert_to_signed(payload_hex[offset:offset+2])
-                t_max = convert_to_signed(payload_hex[offset+2:offset+4])
-                timestamp = base_time + timedelta(hours=time_period * i)
-                history.append({
-                    'min_temp': t_min,
-                    'max_temp': t_max,
-                    'timestamp': timestamp.isoformat()
-                })
-            result['temp_history'] = history
-
-        else:
-            # It's an alert payload
-            tx_info_mask = int(payload_hex[8:10], 16)
-            if (tx_flag & 0x08):
-                result['alerts'].append('Temperature Alert')
-            if (tx_flag & 0x04):
-                result['alerts'].append('Power Alert')
-            if tx_info_mask & 0x40:
-                result['alerts'].append('Temperature Low Alert')
-
-        return result
-
-    except Exception as e:
-        return {
-            'battery_volts': None,
-            'temp_celsius': None,
-            'status_flags': [],
-            'error': f'Decode error: {str(e)}'
-        }
-
-
-def decode_pulsemeter(payload_hex, timestamp_unix=1748265008):
-    """
-    Decodes PulseMeter data (12-byte periodic or 8-byte alert payload).
-    Returns structured data for storage or logging.
-    """
-    try:
-        data = bytes.fromhex(payload_hex)
-        length = len(data)
-
-        if length not in [8, 9, 12]:
-            return {'error': f'Unknown PulseMeter payload length: {length} bytes', 'raw_hex': payload_hex, 'raw_bytes': data.hex()}
-
-        txflags = data[0]
-        battery_raw = data[1]
-        battery_volts = round(battery_raw * 0.02, 2)
-
-        # Decode flags into human-readable strings
-        active_flags = []
-        if txflags & 0b00000001: active_flags.append("Periodic Update")
-        if txflags & 0b00000010: active_flags.append("Forced Transmit / Power Up")
-        if txflags & 0b00000100: active_flags.append("Leak/Tamper Alert")
-        if txflags & 0b00001000: active_flags.append("Leak Detected")
-        if txflags & 0b00010000: active_flags.append("Tamper Detected")
-
-        result = {
-            'battery_volts': battery_volts,
-            'leak_detected': "Leak Detected" in active_flags,
-            'status_flags': active_flags,
-            'debug_info': {
-                'payload_length': length,
-                'raw_hex': payload_hex,
-                'txflags_binary': f'{txflags:08b}',
-                'battery_raw': battery_raw
-            }
-        }
-
-        if length == 12:
-            # Periodic payload
-            device_interval = (txflags >> 5) & 0b111
-            interval_map = {
-                0: -0.25,
-                1: -0.5,
-                2: -1,
-                3: -2,
-                4: -3,
-                5: -4,
-                6: -5,
-                7: -6
-            }
-            timer_period = interval_map.get(device_interval, 0)
-
-            counter0 = int.from_bytes(data[2:6], byteorder='big')
-            offset1 = int.from_bytes(data[6:8], byteorder='big')
-            offset2 = int.from_bytes(data[8:10], byteorder='big')
-            offset3 = int.from_bytes(data[10:12], byteorder='big')
-
-            # Use the modern datetime approach with timezone awareness
-            counter0_time = datetime.fromtimestamp(timestamp_unix, tz=timezone.utc)
-            counter1_time = counter0_time + timedelta(hours=timer_period * 1)
-            counter2_time = counter0_time + timedelta(hours=timer_period * 2)
-            counter3_time = counter0_time + timedelta(hours=timer_period * 3)
-
-            result.update({
-                'pulse_count': counter0,
-                'history': [
-                    {'timestamp': counter0_time.isoformat(), 'value': counter0},
-                    {'timestamp': counter1_time.isoformat(), 'value': counter0 - offset1},
-                    {'timestamp': counter2_time.isoformat(), 'value': counter0 - offset2},
-                    {'timestamp': counter3_time.isoformat(), 'value': counter0 - offset3}
-                ]
-            })
-
-        elif length == 8:
-            # Alert payload
-            pulse_count = int.from_bytes(data[2:6], byteorder='big')
-            result.update({
-                'pulse_count': pulse_count
-            })
-
-        elif length == 9:
-            # 9-byte payload - need to determine structure
-            # For now, treat similar to 8-byte but capture extra byte
-            pulse_count = int.from_bytes(data[2:6], byteorder='big')
-            extra_data = data[6:9].hex()  # Last 3 bytes as hex string
-            result.update({
-                'pulse_count': pulse_count,
-                'extra_data': extra_data,
-                'payload_type': '9-byte_variant'
-            })
-
-        return result
-
-    except Exception as e:
-        return {'error': f"PulseMeter decode failed: {str(e)}"}
-
-
-
-
-def decode_water_sensor(payload_hex, timestamp=None, water_threshold=150):
-    try:
-        # Convert payload to usable hex segments
-        tx_flag = int(payload_hex[0:2], 16)
-        water_detected = int(payload_hex[2:4], 16) == 1
-        water_raw = int(payload_hex[4:6], 16)
-        battery_hex = int(payload_hex[6:8], 16)
-        battery_volts = battery_hex * 0.02
-        counter_value = int(payload_hex[8:16], 16)
-
-        # Determine if this was a state change (bit 1 = 0x02)
-        is_state_change = (tx_flag & 0x02) == 0x02
-
-        alerts = []
-        if water_detected and water_raw <= water_threshold:
-            alerts.append("Water detected below threshold")
-        if battery_volts < 2.5:
-            alerts.append("Low battery")
-
-        return {
-            'tx_flag': tx_flag,
-            'is_state_change': is_state_change,
-            'water_detected': water_detected,
-            'water_raw_value': water_raw,
-            'battery_volts': round(battery_volts, 2),
-            'counter_value': counter_value,
-            'alerts': alerts,
-            'raw_payload': payload_hex,
-            'timestamp': timestamp or datetime.now().isoformat()
-        }
-
-    except Exception as e:
-        return {'error': f"Decode error: {str(e)}"}    
-
-def decode_magnetic_sensor(payload_hex):
-    try:
-        data = bytes.fromhex(payload_hex)
-        if len(data) < 2:
-            return {'error': 'Invalid magnetic sensor payload length'}
-        status = "open" if data[1] == 0x00 else "closed" if data[1] == 0x01 else f"Unknown ({data[1]})"
-        return {
-            "sensor_type": "magnetic",
-            "status": status,
-            "raw_payload": payload_hex
-        }
-    except Exception as e:
-        return {'error': f"Magnetic sensor decode failed: {str(e)}"}
-
-def decode_tank_level(payload_hex):
-    """
-    Decodes tank level sensor data
-    Expected payload format: 2 bytes for level percentage, 1 byte for battery
-    """
-    try:
-        data = bytes.fromhex(payload_hex)
-        if len(data) < 3:
-            return {'error': 'Invalid tank level payload length'}
-        
-        level_percentage = data[0]  # First byte is level percentage (0-100)
-        battery_raw = data[1]
-        battery_volts = round(battery_raw * 0.02, 2)
-        status_flags = data[2] if len(data) > 2 else 0
-        
-        alerts = []
-        if level_percentage < 20:
-            alerts.append("Low tank level")
-        if battery_volts < 2.5:
-            alerts.append("Low battery")
-            
-        return {
-            'sensor_type': 'tank_level',
-            'level_percentage': level_percentage,
-            'battery_volts': battery_volts,
-            'status_flags': status_flags,
-            'alerts': alerts,
-            'raw_payload': payload_hex
-        }
-    except Exception as e:
-        return {'error': f'Tank level decode failed: {str(e)}'}
-    
 # ----------------------------
 # Decoder Dispatcher
 # ----------------------------
 
 def get_decoder_by_device(device_id):
-    device_id = device_id.lower()
-    if device_id in POWER_TEMP_DEVICES:
-        return decode_PowerTemp
-    elif device_id in PULSE_METER_DEVICES:
-        return decode_pulsemeter
-    elif device_id in WATER_DETECT_DEVICES:
-        return decode_water_sensor
-    elif device_id in MAGNETIC_DEVICES:
-        return decode_magnetic_sensor
-    elif device_id in TANK_LEVEL_DEVICES:
-        return decode_tank_level
-    return None
+    return decoder_registry.lookup(device_id.lower())
 
 # ----------------------------
 # Sigfox API Receiver
 # ----------------------------
 
+def build_entry(data):
+    """Decode one Sigfox callback message into the entry stored by the ingest path"""
+    hex_data = data.get("data", "")
+    device_id = data.get("device", "").lower()
+    decoder = get_decoder_by_device(device_id)
+
+    decoded = decoder(hex_data) if decoder else {
+        'ascii': bytes.fromhex(hex_data).decode('ascii', errors='replace'),
+        'hex': hex_data,
+        'note': 'No decoder assigned to this device ID'
+    }
+
+    return {
+        "timestamp": data.get("time", datetime.utcnow().isoformat()),
+        "device_id": device_id,
+        "device_type": data.get("deviceTypeId", "unknown"),
+        "sequence": data.get("seqNumber"),
+        "raw_payload": hex_data,
+        "decoded": decoded,
+        "sensor_group": decoder.__name__ if decoder else "unassigned",
+        "received_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def shed_response():
+    """Tell the sender to back off while ingestion is saturated"""
+    response = jsonify({"status": "error", "message": "Ingestion saturated, retry later"})
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response, INGEST_REJECT_STATUS
+
 @app.route('/sigfox', methods=['POST'])
 def sigfox_callback():
+    device_id = sequence = None
     try:
         data = request.get_json(force=True)
-        hex_data = data.get("data", "")
         device_id = data.get("device", "").lower()
-        decoder = get_decoder_by_device(device_id)
+        sequence = data.get("seqNumber")
 
-        decoded = decoder(hex_data) if decoder else {
-            'ascii': bytes.fromhex(hex_data).decode('ascii', errors='replace'),
-            'hex': hex_data,
-            'note': 'No decoder assigned to this device ID'
-        }
+        # Sigfox retries and multi-station reception deliver the same uplink repeatedly
+        if uplink_dedup.seen(device_id, sequence):
+            return jsonify({"status": "success", "message": "Duplicate ignored"}), 200
 
-        entry = {
-            "timestamp": data.get("time", datetime.utcnow().isoformat()),
-            "device_id": device_id,
-            "device_type": data.get("deviceTypeId", "unknown"),
-            "sequence": data.get("seqNumber"),
-            "raw_payload": hex_data,
-            "decoded": decoded,
-            "sensor_group": decoder.__name__ if decoder else "unassigned",
-            "received_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
+        with ingest_admission.admit() as admitted:
+            if not admitted and INGEST_SHED_POLICY != "spill":
+                uplink_dedup.forget(device_id, sequence)
+                return shed_response()
 
-        save_to_db(entry)
-        save_useful_data(entry)
+            entry = build_entry(data)
+            # A shed uplink under the "spill" policy skips the database entirely
+            outcome = ingest_entry(entry) if admitted else spool_entries([entry])
 
-        print(f"📦 Saved entry:\n{json.dumps(entry, indent=2)}")
-        return jsonify({"status": "success", "message": "Data saved"}), 200
+        print(f"📦 {outcome.capitalize()} entry:\n{json.dumps(entry, indent=2)}")
+        if outcome == "rejected":
+            # Dead-lettered: a retry of the same uplink would be rejected again
+            return jsonify({"status": "error", "message": "Data rejected by the database"}), 422
+        return jsonify({"status": "success", "message": f"Data {outcome}"}), 200
 
     except Exception as e:
+        # Let Sigfox's retry of this uplink through
+        uplink_dedup.forget(device_id, sequence)
         return jsonify({
             "status": "error",
             "message": f"Processing error: {str(e)}"
         }), 500
 
+MAX_BATCH_MESSAGES = 5000
+
+def parse_batch_body(body):
+    """
+    Split a batch request body into messages. Accepts a JSON array (or a single
+    object) and NDJSON; a bad NDJSON line becomes a ValueError in its own slot.
+    """
+    try:
+        parsed = json.loads(body)
+        return parsed if isinstance(parsed, list) else [parsed]
+    except ValueError:
+        pass
+
+    messages = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            messages.append(json.loads(line))
+        except ValueError as e:
+            messages.append(ValueError(f"Invalid JSON: {e}"))
+    return messages
+
+@app.route('/sigfox/batch', methods=['POST'])
+def sigfox_batch_callback():
+    """Ingest many Sigfox messages in one request and one transaction (or one spool append), with a status per message"""
+    messages = parse_batch_body(request.get_data(as_text=True))
+    if not messages:
+        return jsonify({"status": "error", "message": "Empty batch"}), 400
+    if len(messages) > MAX_BATCH_MESSAGES:
+        return jsonify({
+            "status": "error",
+            "message": f"Batch too large ({len(messages)} > {MAX_BATCH_MESSAGES} messages)"
+        }), 413
+
+    with ingest_admission.admit() as admitted:
+        if not admitted and INGEST_SHED_POLICY != "spill":
+            return shed_response()
+        return _ingest_messages(messages, spill=not admitted)
+
+def _ingest_messages(messages, spill=False):
+    results = []
+    entries = []
+    pending = []  # (result, device_id, sequence) for entries awaiting the batch commit
+
+    for index, data in enumerate(messages):
+        result = {"index": index}
+        results.append(result)
+        try:
+            if isinstance(data, Exception):
+                raise data
+            if not isinstance(data, dict):
+                raise ValueError("Message must be a JSON object")
+
+            device_id = data.get("device", "").lower()
+            sequence = data.get("seqNumber")
+            result.update({"device": device_id, "seqNumber": sequence})
+
+            if uplink_dedup.seen(device_id, sequence):
+                result["status"] = "duplicate"
+                continue
+
+            try:
+                entries.append(build_entry(data))
+            except Exception:
+                uplink_dedup.forget(device_id, sequence)
+                raise
+            pending.append((result, device_id, sequence))
+
+        except Exception as e:
+            result.update({"status": "error", "message": f"Processing error: {str(e)}"})
+
+    saved = True
+    outcomes = []
+    try:
+        if not entries:
+            pass
+        elif spill:
+            spool_entries(entries)
+            outcomes = [("spooled", None)] * len(entries)
+        else:
+            # One transaction for the batch; an entry the database rejects is reported on its own
+            outcomes = ingest_batch(entries)
+    except Exception as e:
+        saved = False
+        print(f"❌ Batch ingest failed: {e}")
+
+    for index, (result, device_id, sequence) in enumerate(pending):
+        if saved:
+            outcome, error = outcomes[index]
+            result["status"] = outcome
+            if error:
+                result["message"] = f"Rejected by the database: {error}"
+        else:
+            uplink_dedup.forget(device_id, sequence)
+            result.update({"status": "error", "message": "Persisting the batch failed"})
+
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+
+    print(f"📦 Batch of {len(messages)} messages: {counts}")
+    return jsonify({
+        "status": "success" if saved else "error",
+        "counts": counts,
+        "results": results
+    }), 200 if saved else 500
+
 # ----------------------------
 # Data API
 # ----------------------------
 @app.route('/api/user/temperature')
+@conditional_view('decode_PowerTemp')
+@cached_view('get_temperature_charts', 'decode_PowerTemp')
 def get_temperature_charts():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id')
@@ -368,70 +248,29 @@ def get_temperature_charts():
 
     interval = period_map.get(period, "7 days")
 
-    # Modify query based on device_id
-    if device_id:
-        query = """
-        SELECT
-            device_id,
-            DATE(received_at) AS day,
-            AVG(temp_celsius) AS avg_temp,
-            MAX(temp_celsius) AS max_temp,
-            MIN(temp_celsius) AS min_temp
-        FROM PWR_TEMP
-        WHERE received_at >= NOW() - INTERVAL %s
-            AND device_id = %s
-        GROUP BY device_id, day
-        ORDER BY day;
-        """
-        params = (interval, device_id)
-
-    else:
-          query = """
-        SELECT
-            device_id,
-            DATE(received_at) AS day,
-            AVG(temp_celsius) AS avg_temp,
-            MAX(temp_celsius) AS max_temp,
-            MIN(temp_celsius) AS min_temp
-        FROM PWR_TEMP
-        WHERE received_at >= NOW() - INTERVAL %s
-        GROUP BY device_id, day
-        ORDER BY day;
-        """
-    params = (interval,)
-
     charts = {}
 
+    # Daily series and window stats for every device in one query over the rollup
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(query, (params))
-            rows = cur.fetchall()
-
-            for device_id, day, avg_t, max_t, min_t in rows:
-                charts.setdefault(device_id, {
-                    "labels": [],
-                    "avg_temperatures": [],
-                    "max_temperatures": [],
-                    "min_temperatures": [],
-                    "avg": None,
-                    "max": None,
-                    "min": None
-                })
-
-                charts[device_id]["labels"].append(day.strftime("%m-%d"))
-                charts[device_id]["avg_temperatures"].append(round(avg_t, 1))
-                charts[device_id]["max_temperatures"].append(round(max_t, 1))
-                charts[device_id]["min_temperatures"].append(round(min_t, 1))
-
-            for device_id, data in charts.items():
-                data["avg"] = round(sum(data["avg_temperatures"]) / len(data["avg_temperatures"]), 1)
-                data["max"] = max(data["max_temperatures"])
-                data["min"] = min(data["min_temperatures"])
+            for device_id, chart in temperature_charts(cur, 'day', interval, device_id=device_id).items():
+                avg_t, max_t, min_t = chart.stats
+                charts[device_id] = {
+                    "labels": [day.strftime("%m-%d") for day in chart.buckets],
+                    "avg_temperatures": [round(value, 1) for value in chart.avg],
+                    "max_temperatures": [round(value, 1) for value in chart.max],
+                    "min_temperatures": [round(value, 1) for value in chart.min],
+                    "avg": round(avg_t, 1),
+                    "max": round(max_t, 1),
+                    "min": round(min_t, 1)
+                }
 
     return jsonify({"charts": charts})
 
 
 @app.route('/api/user/usage')
+@conditional_view('decode_pulsemeter')
+@cached_view('get_water_usage', 'decode_pulsemeter')
 def get_water_usage():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id', 'all')
@@ -449,11 +288,12 @@ def get_water_usage():
     if device_id != 'all':
         query = """
         SELECT
-            DATE(received_at) AS day,
-            MAX(pulse_count) - MIN(pulse_count) AS daily_usage
-        FROM PULSE_DETECTOR
-        WHERE received_at >= NOW() - INTERVAL %s
+            bucket AS day,
+            MAX(pulse_max) - MIN(pulse_min) AS daily_usage
+        FROM sensor_rollup_daily
+        WHERE bucket >= DATE_TRUNC('day', NOW() - INTERVAL %s)
             AND device_id = %s
+            AND pulse_max IS NOT NULL
         GROUP BY day
         ORDER BY day;
         """
@@ -461,10 +301,11 @@ def get_water_usage():
     else:
         query = """
         SELECT
-            DATE(received_at) AS day,
-            MAX(pulse_count) - MIN(pulse_count) AS daily_usage
-        FROM PULSE_DETECTOR
-        WHERE received_at >= NOW() - INTERVAL %s
+            bucket AS day,
+            MAX(pulse_max) - MIN(pulse_min) AS daily_usage
+        FROM sensor_rollup_daily
+        WHERE bucket >= DATE_TRUNC('day', NOW() - INTERVAL %s)
+            AND pulse_max IS NOT NULL
         GROUP BY day
         ORDER BY day;
         """
@@ -486,6 +327,8 @@ def get_water_usage():
     })
 
 @app.route('/api/user/flow-history')
+@conditional_view('decode_pulsemeter')
+@cached_view('get_flow_history', 'decode_pulsemeter')
 def get_flow_history():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id', 'all')
@@ -569,6 +412,8 @@ def get_flow_history():
 
     # Add this new route to app.py in the Data API section
 @app.route('/api/user/temperature-history')
+@conditional_view('decode_PowerTemp')
+@cached_view('get_temperature_history', 'decode_PowerTemp')
 def get_temperature_history():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id')  # Optional: filter by specific device
@@ -581,52 +426,18 @@ def get_temperature_history():
     }
 
     interval = period_map.get(period, "7 days")
-    
-    # Build the query based on whether device_id is provided
-    if device_id:
-        query = """
-        SELECT
-            device_id,
-            DATE(received_at) AS day,
-            DATE_TRUNC('hour', received_at) AS hour,
-            AVG(temp_celsius) AS avg_temp,
-            MAX(temp_celsius) AS max_temp,
-            MIN(temp_celsius) AS min_temp
-        FROM PWR_TEMP
-        WHERE received_at >= NOW() - INTERVAL %s
-            AND device_id = %s
-        GROUP BY device_id, day, DATE_TRUNC('hour', received_at)
-        ORDER BY hour;
-        """
-        params = (interval, device_id)
-    else:
-        query = """
-        SELECT
-            device_id,
-            DATE(received_at) AS day,
-            DATE_TRUNC('hour', received_at) AS hour,
-            AVG(temp_celsius) AS avg_temp,
-            MAX(temp_celsius) AS max_temp,
-            MIN(temp_celsius) AS min_temp
-        FROM PWR_TEMP
-        WHERE received_at >= NOW() - INTERVAL %s
-        GROUP BY device_id, day, DATE_TRUNC('hour', received_at)
-        ORDER BY hour;
-        """
-        params = (interval,)
 
     history_data = []
 
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(query, params)
-            rows = cur.fetchall()
+            rows = temperature_history(cur, interval, device_id)
 
             for row in rows:
-                device_id, day, hour, avg_temp, max_temp, min_temp = row
+                device_id, hour, avg_temp, max_temp, min_temp = row
                 history_data.append({
                     "device_id": device_id,
-                    "day": day.strftime("%Y-%m-%d"),
+                    "day": hour.strftime("%Y-%m-%d"),
                     "hour": hour.strftime("%H:%M"),
                     "avg_temp": round(avg_temp, 1),
                     "max_temp": round(max_temp, 1),
@@ -641,6 +452,8 @@ def get_temperature_history():
 
 
 @app.route('/api/user/water-detection-history')
+@conditional_view('decode_water_sensor')
+@cached_view('get_water_detection_history', 'decode_water_sensor')
 def get_water_detection_history():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id', 'all')
@@ -725,89 +538,28 @@ def get_user_devices():
         # For now, return all devices from your device sets
         devices = []
         
-        # Add temperature devices
-        for device_id in POWER_TEMP_DEVICES:
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT temp_celsius, received_at 
-                        FROM PWR_TEMP 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    
-                    devices.append({
-                        'device_id': device_id,
-                        'sensor_type': 'decode_PowerTemp',
-                        'last_value': f"{row[0]}°C" if row else None,
-                        'last_reading': row[0] if row else None,
-                        'last_updated': row[1].isoformat() if row and row[1] else None
-                    })
-        
-        # Add pulse meter devices
-        for device_id in PULSE_METER_DEVICES:
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT pulse_count, received_at 
-                        FROM PULSE_DETECTOR 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    
-                    devices.append({
-                        'device_id': device_id,
-                        'sensor_type': 'decode_pulsemeter',
-                        'last_value': str(row[0]) if row else None,
-                        'last_reading': row[0] if row else None,
-                        'last_updated': row[1].isoformat() if row and row[1] else None
-                    })
-        
-        # Add water sensor devices
-        for device_id in WATER_DETECT_DEVICES:
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT water_detected, received_at 
-                        FROM WATER_DETECTOR 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    
-                    devices.append({
-                        'device_id': device_id,
-                        'sensor_type': 'decode_water_sensor',
-                        'last_value': str(row[0]) if row else None,
-                        'last_reading': row[0] if row else None,
-                        'last_updated': row[1].isoformat() if row and row[1] else None
-                    })
-        
-        # Add magnetic sensor devices
-        for device_id in MAGNETIC_DEVICES:
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT status, received_at 
-                        FROM magnetic 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    
-                    devices.append({
-                        'device_id': device_id,
-                        'sensor_type': 'decode_magnetic_sensor',
-                        'last_value': row[0] if row else None,
-                        'last_reading': row[0] if row else None,
-                        'last_updated': row[1].isoformat() if row and row[1] else None
-                    })
+        # (decoder, column, how last_value is shown)
+        groups = [
+            (decode_PowerTemp, 'temp_celsius', lambda value: f"{value}°C"),
+            (decode_pulsemeter, 'pulse_count', str),
+            (decode_water_sensor, 'water_detected', str),
+            (decode_magnetic_sensor, 'status', lambda value: value),
+        ]
+        assigned = [(decoder, column, show, decoder_registry.devices_for(decoder)) for decoder, column, show in groups]
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                latest = fetch_latest_state(cur, [d for *_, group in assigned for d in group])
+
+        for decoder, column, show, group in assigned:
+            for device_id in group:
+                row = latest.get(device_id)
+                devices.append({
+                    'device_id': device_id,
+                    'sensor_type': decoder.__name__,
+                    'last_value': show(row[column]) if row else None,
+                    'last_reading': row[column] if row else None,
+                    'last_updated': row['received_at'].isoformat() if row and row['received_at'] else None
+                })
         
         return jsonify(devices)
         
@@ -816,6 +568,8 @@ def get_user_devices():
         return jsonify([]), 500
     
 @app.route('/api/user/door-history')
+@conditional_view('decode_magnetic_sensor')
+@cached_view('get_door_history', 'decode_magnetic_sensor')
 def get_door_history():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id', 'all')
@@ -885,36 +639,33 @@ def get_door_history():
         "history": history_data
     })
 @app.route('/api/user/tank-level')
+@conditional_view('decode_tank_level')
 def get_tank_level_data():
     """Get current tank level data"""
     try:
         tank_data = []
+        devices = decoder_registry.devices_for(decode_tank_level)
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                for device_id in TANK_LEVEL_DEVICES:
-                    cur.execute("""
-                        SELECT level_percentage, battery_volts, received_at
-                        FROM TANK_LEVEL
-                        WHERE device_id = %s
-                        ORDER BY received_at DESC
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    
-                    if row:
-                        level, battery, timestamp = row
-                        tank_data.append({
-                            'device_id': device_id,
-                            'level_percentage': level,
-                            'battery_volts': battery,
-                            'last_updated': timestamp.isoformat() if timestamp else None,
-                            'alert': level < 20
-                        })
+                latest = fetch_latest_state(cur, devices)
+        for device_id in devices:
+            row = latest.get(device_id)
+            if row:
+                level, timestamp = row['level_percentage'], row['received_at']
+                tank_data.append({
+                    'device_id': device_id,
+                    'level_percentage': level,
+                    'battery_volts': row['battery_volts'],
+                    'last_updated': timestamp.isoformat() if timestamp else None,
+                    'alert': level < 20
+                })
         return jsonify(tank_data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/user/tank-level-history')
+@conditional_view('decode_tank_level')
+@cached_view('get_tank_level_history', 'decode_tank_level')
 def get_tank_level_history():
     period = request.args.get('period', 'Weekly')
     device_id = request.args.get('device_id', 'all')
@@ -989,101 +740,58 @@ def get_sensor_data():
             'tank_levels': []
         }
         
-        # Get temperature data
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                for device_id in POWER_TEMP_DEVICES:
-                    cur.execute("""
-                        SELECT temp_celsius, received_at 
-                        FROM PWR_TEMP 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    if row:
-                        data['temperature_sensors'].append({
-                            'device_id': device_id,
-                            'temp_celsius': row[0],
-                            'timestamp': row[1].isoformat() if row[1] else None
-                        })
-        
-        # Get pulse meter data
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                for device_id in PULSE_METER_DEVICES:
-                    cur.execute("""
-                        SELECT pulse_count, leak_detected, received_at 
-                        FROM PULSE_DETECTOR 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    if row:
-                        data['pulse_meters'].append({
-                            'device_id': device_id,
-                            'pulse_count': row[0],
-                            'leak_detected': row[1],
-                            'timestamp': row[2].isoformat() if row[2] else None
-                        })
-        
-        # Get water sensor data
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                for device_id in WATER_DETECT_DEVICES:
-                    cur.execute("""
-                        SELECT water_detected, received_at 
-                        FROM WATER_DETECTOR 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    if row:
-                        data['water_sensors'].append({
-                            'device_id': device_id,
-                            'water_detected': 'True' if row[0] else 'False',
-                            'timestamp': row[1].isoformat() if row[1] else None
-                        })
-        
-        # Get door sensor data
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                for device_id in MAGNETIC_DEVICES:
-                    cur.execute("""
-                        SELECT status, received_at 
-                        FROM magnetic 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    if row:
-                        data['door_sensors'].append({
-                            'device_id': device_id,
-                            'status': row[0],
-                            'timestamp': row[1].isoformat() if row[1] else None
-                        })
-        
-        # Get tank level data
+        # One lookup in device_latest_state for every known device
+        groups = [decode_PowerTemp, decode_pulsemeter, decode_water_sensor, decode_magnetic_sensor, decode_tank_level]
+        devices = {decoder: decoder_registry.devices_for(decoder) for decoder in groups}
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                for device_id in TANK_LEVEL_DEVICES:
-                    cur.execute("""
-                        SELECT level_percentage, received_at 
-                        FROM TANK_LEVEL 
-                        WHERE device_id = %s 
-                        ORDER BY received_at DESC 
-                        LIMIT 1
-                    """, (device_id,))
-                    row = cur.fetchone()
-                    if row:
-                        data['tank_levels'].append({
-                            'device_id': device_id,
-                            'level_percentage': row[0],
-                            'timestamp': row[1].isoformat() if row[1] else None
-                        })
+                latest = fetch_latest_state(cur, [d for group in devices.values() for d in group])
+
+        for device_id in devices[decode_PowerTemp]:
+            row = latest.get(device_id)
+            if row:
+                data['temperature_sensors'].append({
+                    'device_id': device_id,
+                    'temp_celsius': row['temp_celsius'],
+                    'timestamp': row['received_at'].isoformat() if row['received_at'] else None
+                })
+
+        for device_id in devices[decode_pulsemeter]:
+            row = latest.get(device_id)
+            if row:
+                data['pulse_meters'].append({
+                    'device_id': device_id,
+                    'pulse_count': row['pulse_count'],
+                    'leak_detected': row['leak_detected'],
+                    'timestamp': row['received_at'].isoformat() if row['received_at'] else None
+                })
+
+        for device_id in devices[decode_water_sensor]:
+            row = latest.get(device_id)
+            if row:
+                data['water_sensors'].append({
+                    'device_id': device_id,
+                    'water_detected': 'True' if row['water_detected'] == 'True' else 'False',
+                    'timestamp': row['received_at'].isoformat() if row['received_at'] else None
+                })
+
+        for device_id in devices[decode_magnetic_sensor]:
+            row = latest.get(device_id)
+            if row:
+                data['door_sensors'].append({
+                    'device_id': device_id,
+                    'status': row['status'],
+                    'timestamp': row['received_at'].isoformat() if row['received_at'] else None
+                })
+
+        for device_id in devices[decode_tank_level]:
+            row = latest.get(device_id)
+            if row:
+                data['tank_levels'].append({
+                    'device_id': device_id,
+                    'level_percentage': row['level_percentage'],
+                    'timestamp': row['received_at'].isoformat() if row['received_at'] else None
+                })
         
         return jsonify(data)
         
@@ -1091,9 +799,81 @@ def get_sensor_data():
         print(f"Error fetching sensor data: {e}")
         return jsonify({'error': str(e)}), 500
 
+# ----------------------------
+# Runtime Stats
+# ----------------------------
+
+@app.route('/api/stats')
+def runtime_stats():
+    """Counters from the in-process ingest/DB machinery"""
+    return jsonify({
+        "db_pool": pool_stats(),
+        "ingest": ingest_stats(),
+        "known_devices": known_devices.stats(),
+        "dedup": uplink_dedup.stats(),
+        "admission": ingest_admission.stats(),
+        "decoder_registry": decoder_registry.stats(),
+        "decode_cache": decode_cache_stats(),
+        "response_cache": response_cache.stats(),
+        "conditional_get": etag_stats(),
+        "live_updates": live_hub.stats()
+    })
+
+# ----------------------------
+# Process Startup
+# ----------------------------
+
+# Seconds between attempts when the database isn't reachable at startup
+INIT_RETRY_SECONDS = 30
+
+_runtime = {'started': False, 'next_attempt': 0.0}
+_runtime_lock = threading.Lock()
+
+def init_runtime():
+    """
+    Once per serving process, from its first request whatever the entry
+    point (python app.py, flask run, gunicorn app:app): resume spool replay, apply migrations, maintain
+    partitions, warm the known-device and user-device maps and start the
+    decoder registry poller. If the database is down, requests are still
+    served (ingest spools) and the database part is retried every
+    INIT_RETRY_SECONDS. Returns True once everything is up.
+
+    Each process spools into its own directory (spool.claim_directory).
+    """
+    if _runtime['started'] or time.monotonic() < _runtime['next_attempt']:
+        return _runtime['started']
+    with _runtime_lock:
+        if _runtime['started']:
+            return True
+        resume_spool()
+        try:
+            migrate()
+            maintain_partitions()
+            warm_known_devices()
+            user_devices.load()
+            decoder_registry.load()
+            decoder_registry.start()
+        except Exception as e:
+            _runtime['next_attempt'] = time.monotonic() + INIT_RETRY_SECONDS
+            print(f"❌ Startup against the database failed, retrying in {INIT_RETRY_SECONDS}s: {e}")
+            return False
+        _runtime['started'] = True
+        return True
+
+@app.before_request
+def ensure_runtime():
+    init_runtime()
+
 # ----------------------------
 # Entry Point
 # ----------------------------
 
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations (flask --app app migrate)"""
+    migrate()
+
 if __name__ == '__main__':
+    # No init_runtime() here: with debug=True the reloader parent runs this
+    # too, and would replay the spool alongside the serving child
     app.run(host='0.0.0.0', port=5000, debug=True)
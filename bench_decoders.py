@@ -0,0 +1,239 @@
+"""Decoder micro-benchmark and golden-output regression check.
+
+Fixtures are the real payloads in sigfox_data.json (one per distinct device
+and payload) plus the synthetic edge cases in SYNTHETIC_FIXTURES. For every
+decoder the memoized (cache hit), uncached fast and reference
+implementations are timed (ns/message) and
+traced with tracemalloc (blocks and bytes allocated per message, counted on
+the decoded results), and get_decoder_by_device dispatch is timed over the
+fixture device ids. Outputs are compared with decoder_golden.json.
+
+    python bench_decoders.py                        benchmark + golden check
+    python bench_decoders.py --check                golden check only (exit 1 on a difference)
+    python bench_decoders.py --update-golden        rewrite the golden file after an intended change
+    python bench_decoders.py --save before.json     keep the numbers ...
+    python bench_decoders.py --compare before.json  ... and compare a later run against them
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from decoder_registry import STATIC_DEVICE_DECODERS, decoder_registry
+from decoders import REFERENCE_DECODERS, decode_water_sensor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_PATH = os.path.join(HERE, "sigfox_data.json")
+GOLDEN_PATH = os.path.join(HERE, "decoder_golden.json")
+
+# The water decoder stamps results with "now" unless given a timestamp
+FIXED_TIMESTAMP = "2025-05-26T13:10:08"
+
+# (name, decoder name, payload hex)
+SYNTHETIC_FIXTURES = [
+    ("power_temp_periodic", "decode_PowerTemp", "b0961a17161a151a14191418"),
+    ("power_temp_periodic_6h", "decode_PowerTemp", "f09600190a1409140a130b12"),
+    ("power_temp_periodic_negative", "decode_PowerTemp", "3096c0f6eef8f2fbf0f9f1fa"),
+    ("power_temp_alert_all_bits", "decode_PowerTemp", "0c96fdf940"),
+    ("power_temp_alert_no_bits", "decode_PowerTemp", "0096001400"),
+    ("power_temp_alert_min_temp", "decode_PowerTemp", "08968080ff"),
+    ("power_temp_periodic_truncated", "decode_PowerTemp", "b0961a1716"),
+    ("power_temp_empty", "decode_PowerTemp", ""),
+    ("pulse_periodic_12", "decode_pulsemeter", "21a0000186a0001000200030"),
+    ("pulse_periodic_wraparound", "decode_pulsemeter", "e1a000000005000a00140028"),
+    ("pulse_alert_8", "decode_pulsemeter", "0ca0000000ff0000"),
+    ("pulse_variant_9", "decode_pulsemeter", "1ba00001e2400abcde"),
+    ("pulse_all_flags", "decode_pulsemeter", "1fffffffffff0000"),
+    ("pulse_bad_length", "decode_pulsemeter", "01a00000"),
+    ("pulse_not_hex", "decode_pulsemeter", "zz"),
+    ("water_detected_low", "decode_water_sensor", "020164700000002a"),
+    ("water_dry_low_battery", "decode_water_sensor", "0000c87cffffffff"),
+    ("water_short_counter", "decode_water_sensor", "0201969612"),
+    ("water_too_short", "decode_water_sensor", "02019696"),
+    ("magnetic_open", "decode_magnetic_sensor", "0000"),
+    ("magnetic_closed", "decode_magnetic_sensor", "0001"),
+    ("magnetic_unknown", "decode_magnetic_sensor", "00ff"),
+    ("magnetic_short", "decode_magnetic_sensor", "00"),
+    ("tank_low_level_low_battery", "decode_tank_level", "107c00"),
+    ("tank_full", "decode_tank_level", "64a001"),
+    ("tank_short", "decode_tank_level", "64a0"),
+]
+
+# name -> (memoized, uncached fast, reference)
+DECODERS = {
+    decoder.__name__: (decoder, getattr(decoder, '__wrapped__', decoder), reference)
+    for decoder, reference in REFERENCE_DECODERS.items()
+}
+WATER_DECODERS = DECODERS[decode_water_sensor.__name__]
+VARIANTS = ("memoized", "fast", "reference")
+
+
+def call(decoder, payload):
+    if decoder in WATER_DECODERS:
+        return decoder(payload, FIXED_TIMESTAMP)
+    return decoder(payload)
+
+
+def load_fixtures(archive_path=ARCHIVE_PATH):
+    """Return {fixture name: (decoder name, payload)} and the archive's device ids."""
+    fixtures = {}
+    device_ids = []
+    if os.path.exists(archive_path):
+        with open(archive_path, encoding="utf-8") as f:
+            archive = json.load(f)
+        for item in archive:
+            device_id = (item.get("device_id") or item.get("device") or "").lower()
+            payload = item.get("raw_payload") or item.get("data") or ""
+            device_ids.append(device_id)
+            decoder = STATIC_DEVICE_DECODERS.get(device_id)
+            if decoder is not None:
+                fixtures.setdefault(f"archive:{device_id}:{payload}", (decoder.__name__, payload))
+    for name, decoder_name, payload in SYNTHETIC_FIXTURES:
+        fixtures[f"synthetic:{name}"] = (decoder_name, payload)
+    return fixtures, device_ids
+
+
+def decode_all(fixtures, variant="reference"):
+    index = VARIANTS.index(variant)
+    results = {}
+    for name, (decoder_name, payload) in fixtures.items():
+        results[name] = call(DECODERS[decoder_name][index], payload)
+    return results
+
+
+def check_golden(fixtures, golden_path=GOLDEN_PATH):
+    """Compare every variant's outputs with the golden file; returns a list of problems."""
+    with open(golden_path, encoding="utf-8") as f:
+        golden = json.load(f)
+    problems = [f"missing golden output for {name}" for name in fixtures if name not in golden]
+    # Twice for the memoized variant, so cache hits are checked as well as misses
+    for variant in ("memoized",) + VARIANTS:
+        for name, output in decode_all(fixtures, variant).items():
+            if name in golden and json.loads(json.dumps(output)) != golden[name]:
+                problems.append(f"{variant} {fixtures[name][0]} differs for {name}")
+    return problems
+
+
+def update_golden(fixtures, golden_path=GOLDEN_PATH):
+    with open(golden_path, "w", encoding="utf-8") as f:
+        json.dump(decode_all(fixtures), f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"✅ Wrote {len(fixtures)} golden outputs to {golden_path}")
+
+
+def time_per_call(fn, args_list, min_time=0.2):
+    """Best-of-5 ns per call of fn over args_list, repeating the list for at least min_time."""
+    loops = 1
+    while True:
+        started = time.perf_counter_ns()
+        for _ in range(loops):
+            for args in args_list:
+                fn(*args)
+        elapsed = time.perf_counter_ns() - started
+        if elapsed >= min_time * 1e9 / 5:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in range(4):
+        started = time.perf_counter_ns()
+        for _ in range(loops):
+            for args in args_list:
+                fn(*args)
+        best = min(best, time.perf_counter_ns() - started)
+    return best / (loops * len(args_list))
+
+
+def allocations_per_call(fn, args_list):
+    """(blocks, bytes) allocated per call and still referenced by the results."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        results = [fn(*args) for args in args_list]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    del results
+    return blocks / len(args_list), size / len(args_list)
+
+
+def benchmark(fixtures, device_ids, min_time=0.2):
+    report = {}
+    for decoder_name, decoders in DECODERS.items():
+        payloads = [payload for name, (group, payload) in fixtures.items() if group == decoder_name]
+        if not payloads:
+            continue
+        for label, decoder in zip(VARIANTS, decoders):
+            args_list = [(decoder, payload) for payload in payloads]
+            blocks, size = allocations_per_call(call, args_list)
+            report[f"{decoder_name}/{label}"] = {
+                'fixtures': len(payloads),
+                'ns_per_msg': round(time_per_call(call, args_list, min_time), 1),
+                'blocks_per_msg': round(blocks, 2),
+                'bytes_per_msg': round(size, 1),
+            }
+
+    from app import get_decoder_by_device
+
+    decoder_registry.load_static()
+    args_list = [(device_id,) for device_id in device_ids or list(STATIC_DEVICE_DECODERS)]
+    report["get_decoder_by_device"] = {
+        'fixtures': len(args_list),
+        'ns_per_msg': round(time_per_call(get_decoder_by_device, args_list, min_time), 1),
+        'blocks_per_msg': 0,
+        'bytes_per_msg': 0,
+    }
+    return report
+
+
+def print_report(report, baseline=None):
+    header = f"{'benchmark':<36} {'n':>5} {'ns/msg':>10} {'blocks/msg':>11} {'bytes/msg':>10}"
+    if baseline:
+        header += f" {'vs base':>9}"
+    print(header)
+    for name, row in report.items():
+        line = (f"{name:<36} {row['fixtures']:>5} {row['ns_per_msg']:>10,.1f} "
+                f"{row['blocks_per_msg']:>11.2f} {row['bytes_per_msg']:>10,.1f}")
+        base = (baseline or {}).get(name)
+        if base and row['ns_per_msg']:
+            line += f" {base['ns_per_msg'] / row['ns_per_msg']:>8.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Sigfox decoders and check them against golden outputs")
+    parser.add_argument("--check", action="store_true", help="only run the golden check")
+    parser.add_argument("--update-golden", action="store_true", help="rewrite the golden file from the reference decoders")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds of timing per benchmark")
+    parser.add_argument("--save", help="write the benchmark numbers to this JSON file")
+    parser.add_argument("--compare", help="show speedups against numbers saved with --save")
+    args = parser.parse_args()
+
+    fixtures, device_ids = load_fixtures()
+
+    if args.update_golden:
+        update_golden(fixtures)
+        sys.exit(0)
+
+    problems = check_golden(fixtures)
+    for problem in problems:
+        print(f"❌ {problem}")
+    print(f"{'❌' if problems else '✅'} Golden check: {len(fixtures)} fixtures, {len(problems)} problems")
+    if args.check:
+        sys.exit(1 if problems else 0)
+
+    report = benchmark(fixtures, device_ids, args.min_time)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,263 @@
+"""Bulk loader for Sigfox JSON archives (sigfox_data.json style exports).
+
+Streams the archive instead of loading it into memory, re-decodes every
+entry with the decoders from app.py (get_decoder_by_device) and loads
+sigfox_raw plus the typed sensor tables with COPY, one transaction per batch.
+
+Progress is stored in bulk_load_progress inside the same transaction as each
+batch, so an interrupted load resumes after the last committed batch:
+
+    python bulk_load.py sigfox_data.json
+    python bulk_load.py export.ndjson --batch-size 20000
+    python bulk_load.py sigfox_data.json --restart      # ignore saved progress
+
+Both a JSON array of entries and newline-delimited JSON are accepted.
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+from app import get_decoder_by_device
+from db import get_db_connection, sensor_rows
+from known_devices import known_devices
+from psycopg2.extras import execute_values
+
+DEFAULT_BATCH_SIZE = 5000
+READ_CHUNK_SIZE = 1 << 20
+
+RAW_COLUMNS = ("timestamp", "device_id", "device_type", "sequence", "raw_payload", "decoded", "sensor_group", "received_at")
+
+
+def iter_archive(path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Yield entries one at a time from a JSON array or NDJSON file, keeping at most
+    one read chunk plus one partial entry in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    with open(path, "r", encoding="utf-8") as f:
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        while True:
+            # Skip whitespace and the array punctuation between entries
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,[]":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                fill()
+
+            if pos >= len(buffer):
+                return
+
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+
+            # A number or literal cut off at the chunk boundary would still parse
+            if end == len(buffer) and not eof:
+                fill()
+                continue
+
+            pos = end
+            yield obj
+
+
+def to_timestamp(value):
+    """Archive timestamps are Unix seconds as strings; sigfox_raw wants a TIMESTAMP."""
+    if value is None or value == "":
+        return None
+    text = str(value)
+    if text.isdigit():
+        return datetime.utcfromtimestamp(int(text)).strftime('%Y-%m-%d %H:%M:%S')
+    return text
+
+
+def build_entry(item):
+    """Turn one archived uplink into the entry shape used by the /sigfox ingest path."""
+    device_id = (item.get("device_id") or item.get("device") or "").lower()
+    hex_data = item.get("raw_payload") or item.get("data") or ""
+    decoder = get_decoder_by_device(device_id)
+
+    if decoder:
+        decoded = decoder(hex_data)
+    else:
+        try:
+            ascii_text = bytes.fromhex(hex_data).decode('ascii', errors='replace')
+        except ValueError:
+            ascii_text = None
+        decoded = {
+            'ascii': ascii_text,
+            'hex': hex_data,
+            'note': 'No decoder assigned to this device ID'
+        }
+
+    return {
+        "timestamp": to_timestamp(item.get("timestamp", item.get("time"))),
+        "device_id": device_id,
+        "device_type": item.get("device_type", item.get("deviceTypeId", "unknown")),
+        "sequence": item.get("sequence", item.get("seqNumber")),
+        "raw_payload": hex_data,
+        "decoded": decoded,
+        "sensor_group": decoder.__name__ if decoder else "unassigned",
+        "received_at": item.get("received_at") or to_timestamp(item.get("timestamp", item.get("time")))
+    }
+
+
+def _copy_rows(cur, table, columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def load_batch(cur, entries):
+    """COPY one batch into sigfox_raw and the sensor tables. Returns (rows written, newly registered devices)."""
+    raw_rows = []
+    devices = {}
+    typed_rows = {}
+
+    for entry in entries:
+        sensor_type = entry["sensor_group"]
+        decoded = entry["decoded"]
+        raw_rows.append((
+            entry["timestamp"], entry["device_id"], entry["device_type"], entry["sequence"],
+            entry["raw_payload"], json.dumps(decoded), sensor_type, entry["received_at"]
+        ))
+        devices.setdefault(entry["device_id"], sensor_type)
+        spec = sensor_rows.get(sensor_type)
+        if spec:
+            typed_rows.setdefault(sensor_type, []).append(
+                (entry["device_id"], entry["sequence"]) + spec[2](decoded) + (entry["received_at"],)
+            )
+
+    _copy_rows(cur, "sigfox_raw", RAW_COLUMNS, raw_rows)
+    written = len(raw_rows)
+
+    new_devices = [pair for pair in devices.items() if not known_devices.is_known(*pair)]
+    if new_devices:
+        execute_values(cur, """
+            INSERT INTO USER_DEVICE (device_id, sensor_type, user_id)
+            VALUES %s
+            ON CONFLICT (device_id) DO NOTHING
+        """, [(device_id, sensor_type, None) for device_id, sensor_type in new_devices])
+
+    # Typed tables are unique on (device_id, sequence, received_at): COPY into a
+    # staging table and let INSERT ... ON CONFLICT drop replays and duplicates.
+    for sensor_type, rows in typed_rows.items():
+        table, value_columns, _ = sensor_rows[sensor_type]
+        columns = ("device_id", "sequence") + value_columns + ("received_at",)
+        stage = f"stage_{table.lower()}"
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {stage} ON COMMIT DELETE ROWS
+            AS SELECT {', '.join(columns)} FROM {table} WITH NO DATA
+        """)
+        _copy_rows(cur, stage, columns, rows)
+        cur.execute(f"""
+            INSERT INTO {table} ({', '.join(columns)})
+            SELECT {', '.join(columns)} FROM {stage}
+            ON CONFLICT (device_id, sequence, received_at) DO NOTHING
+        """)
+        written += cur.rowcount
+
+    return written, new_devices
+
+
+def get_progress(source):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT entries_loaded FROM bulk_load_progress WHERE source = %s", (source,))
+            row = cur.fetchone()
+            return row[0] if row else 0
+
+
+def reset_progress(source):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM bulk_load_progress WHERE source = %s", (source,))
+            conn.commit()
+
+
+def bulk_load(path, batch_size=DEFAULT_BATCH_SIZE, source=None, restart=False):
+    source = source or os.path.abspath(path)
+    if restart:
+        reset_progress(source)
+
+    skip = get_progress(source)
+    if skip:
+        print(f"ℹ️ Resuming {source} after {skip} entries")
+
+    started = time.monotonic()
+    entries_done = skip
+    rows_total = 0
+    batch = []
+
+    def flush():
+        nonlocal entries_done, rows_total
+        batch_started = time.monotonic()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                rows, new_devices = load_batch(cur, batch)
+                cur.execute("""
+                    INSERT INTO bulk_load_progress (source, entries_loaded, rows_loaded, updated_at)
+                    VALUES (%s, %s, %s, NOW())
+                    ON CONFLICT (source) DO UPDATE
+                    SET entries_loaded = EXCLUDED.entries_loaded,
+                        rows_loaded = bulk_load_progress.rows_loaded + EXCLUDED.rows_loaded,
+                        updated_at = NOW()
+                """, (source, entries_done + len(batch), rows))
+                conn.commit()
+        known_devices.add_many(new_devices)
+
+        entries_done += len(batch)
+        rows_total += rows
+        elapsed = time.monotonic() - batch_started
+        overall = time.monotonic() - started
+        print(f"📦 {entries_done} entries loaded | batch {len(batch)} in {elapsed:.2f}s "
+              f"({len(batch) / elapsed if elapsed else 0:,.0f} entries/s) | "
+              f"overall {rows_total / overall if overall else 0:,.0f} rows/s")
+        batch.clear()
+
+    for index, item in enumerate(iter_archive(path)):
+        if index < skip:
+            continue
+        batch.append(build_entry(item))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Loaded {entries_done - skip} entries ({rows_total} rows) from {path} in {elapsed:.1f}s "
+          f"({rows_total / elapsed if elapsed else 0:,.0f} rows/s)")
+    return entries_done - skip, rows_total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk load a Sigfox JSON archive into SGS_Database")
+    parser.add_argument("path", help="JSON array or NDJSON file of uplinks")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="entries per COPY transaction")
+    parser.add_argument("--source", help="progress key (defaults to the absolute file path)")
+    parser.add_argument("--restart", action="store_true", help="ignore saved progress and load from the start")
+    args = parser.parse_args()
+
+    bulk_load(args.path, batch_size=args.batch_size, source=args.source, restart=args.restart)
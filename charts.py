@@ -0,0 +1,120 @@
+"""Chart reads of the hourly/daily rollups, shared by the endpoints and index_advisor.py.
+
+temperature_charts() reads the hourly or daily rollup once with
+GROUPING SETS ((device, bucket), (device)): the first set gives every
+device's bucketed series, the second its statistics over the whole window
+(averaged over readings, not over buckets). Rows arrive ordered by device
+with the window row last, so they are split per device with groupby and
+transposed with zip instead of building a dict per row.
+
+temperature_history(), pulse_usage_stats() and pulse_usage() run the
+single statements behind /api/user/temperature-history and /api/user/usage.
+"""
+
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
+
+from rollups import ROLLUP_TABLES
+
+# Parallel lists per bucket, plus (avg, max, min) over the window
+TemperatureChart = namedtuple("TemperatureChart", "buckets avg max min stats")
+
+
+def temperature_charts(cur, unit, interval=None, device_id=None, user_id=None):
+    """
+    {device_id: TemperatureChart} from the `unit` ('hour' or 'day') rollup,
+    for buckets since NOW() - `interval` (all of them when None).
+
+    With `user_id`, covers that user's decode_PowerTemp devices, including
+    those without data in the window (empty series, stats of None).
+    Otherwise covers `device_id`, or every device with temperature data.
+    """
+    table = ROLLUP_TABLES[unit]
+    conditions = ["r.temp_count > 0"]
+    params = []
+    if interval:
+        conditions.append(f"r.bucket >= DATE_TRUNC('{unit}', NOW() - INTERVAL %s)")
+        params.append(interval)
+
+    if user_id is not None:
+        device = "d.device_id"
+        source = f"USER_DEVICE d LEFT JOIN {table} r ON r.device_id = d.device_id AND {' AND '.join(conditions)}"
+        where = "d.user_id = %s AND d.sensor_type = 'decode_PowerTemp'"
+        params.append(user_id)
+    else:
+        device = "r.device_id"
+        source = f"{table} r"
+        if device_id:
+            conditions.append("r.device_id = %s")
+            params.append(device_id)
+        where = " AND ".join(conditions)
+
+    cur.execute(f"""
+        SELECT {device}, r.bucket,
+               SUM(r.temp_sum) / NULLIF(SUM(r.temp_count), 0),
+               MAX(r.temp_max),
+               MIN(r.temp_min)
+        FROM {source}
+        WHERE {where}
+        GROUP BY GROUPING SETS (({device}, r.bucket), ({device}))
+        ORDER BY {device}, GROUPING(r.bucket), r.bucket
+    """, params)
+
+    charts = {}
+    for device_key, rows in groupby(cur.fetchall(), key=itemgetter(0)):
+        *series, window = rows
+        # A device without buckets in the window still has its (NULL) detail row
+        series = [row for row in series if row[1] is not None]
+        _, buckets, avg, max_, min_ = zip(*series) if series else ((), (), (), (), ())
+        charts[device_key] = TemperatureChart(list(buckets), list(avg), list(max_), list(min_), window[2:])
+    return charts
+
+
+def temperature_history(cur, interval, device_id=None):
+    """
+    [(device_id, bucket, avg, max, min)] for the hourly buckets with
+    temperature readings since NOW() - `interval`, of `device_id` or of
+    every device, ordered by bucket.
+    """
+    conditions = ["bucket >= DATE_TRUNC('hour', NOW() - INTERVAL %s)", "temp_count > 0"]
+    params = [interval]
+    if device_id:
+        conditions.append("device_id = %s")
+        params.append(device_id)
+    cur.execute(f"""
+        SELECT device_id, bucket, temp_sum / temp_count, temp_max, temp_min
+        FROM {ROLLUP_TABLES['hour']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bucket
+    """, params)
+    return cur.fetchall()
+
+
+def pulse_usage_stats(cur, device_id):
+    """(pulse readings, first day, last day) of a device, from the daily rollup."""
+    cur.execute(f"""
+        SELECT COALESCE(SUM(pulse_readings), 0), MIN(bucket), MAX(bucket)
+        FROM {ROLLUP_TABLES['day']}
+        WHERE device_id = %s AND pulse_readings > 0
+    """, (device_id,))
+    return cur.fetchone()
+
+
+def pulse_usage(cur, device_id, unit, interval=None):
+    """
+    [(bucket, pulse_sum)] of a device from the `unit` ('hour' or 'day')
+    rollup, for buckets since NOW() - `interval` (all of them when None).
+    """
+    conditions = ["device_id = %s", "pulse_max IS NOT NULL"]
+    params = [device_id]
+    if interval:
+        conditions.append(f"bucket >= DATE_TRUNC('{unit}', NOW() - INTERVAL %s)")
+        params.append(interval)
+    cur.execute(f"""
+        SELECT bucket, pulse_sum
+        FROM {ROLLUP_TABLES[unit]}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bucket
+    """, params)
+    return cur.fetchall()
@@ -0,0 +1,177 @@
+"""Per-device data versions and conditional GET for the /api/user/* endpoints.
+
+Every committed write (db.add_write_listener) gives the devices it touched,
+and their sensor groups, a new version from one process-wide counter. A
+response's ETag is a digest of the request (endpoint, arguments, session
+device), the versions of the devices it covers, the USER_DEVICE assignment
+version and the process epoch, so a dashboard poll that finds nothing new
+is answered 304 before the view or any SQL runs.
+
+The user -> devices map needed for that is kept in memory: loaded from
+USER_DEVICE on first use (or at startup) and reloaded after the admin
+assign/unassign paths invalidate it.
+
+Versions only see this process's writes. ETags also change every
+SGS_ETAG_MAX_AGE seconds (default 60), which bounds how long a client can be
+told "not modified" after a write made by another process.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request, session
+
+from db import get_db_connection
+
+ETAG_MAX_AGE = float(os.environ.get("SGS_ETAG_MAX_AGE", 60))
+
+# Versions restart at 0 with the process; the epoch keeps old ETags from matching
+PROCESS_EPOCH = f"{os.getpid():x}.{int(time.time()):x}"
+
+
+class DataVersions:
+    def __init__(self):
+        self._clock = 0
+        self._versions = {}   # device_id or sensor group -> version of its last write
+        self._lock = threading.Lock()
+
+    def bump(self, pairs):
+        """Record a write to the (device_id, sensor_group) pairs."""
+        with self._lock:
+            self._clock += 1
+            for device_id, group in pairs:
+                self._versions[device_id] = self._versions[group] = self._clock
+
+    def bump_entries(self, entries):
+        """db write listener."""
+        self.bump((entry.get("device_id"), entry.get("sensor_group")) for entry in entries)
+
+    def version(self, name):
+        return self._versions.get(name, 0)
+
+    def stats(self):
+        return {'version': self._clock, 'tracked': len(self._versions), 'epoch': PROCESS_EPOCH}
+
+
+class UserDevices:
+    """In-memory copy of USER_DEVICE as user_id -> frozenset of device ids."""
+
+    def __init__(self):
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.version = 0   # bumped on every reload, i.e. every assignment change
+
+    def load(self):
+        with self._lock:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT user_id, device_id FROM USER_DEVICE WHERE user_id IS NOT NULL")
+                    rows = cur.fetchall()
+            devices = {}
+            for user_id, device_id in rows:
+                devices.setdefault(user_id, set()).add(device_id)
+            self._devices = {user_id: frozenset(ids) for user_id, ids in devices.items()}
+            self.version += 1
+            self.loaded = True
+
+    def invalidate(self):
+        """Reload on next use; call after changing USER_DEVICE."""
+        with self._lock:
+            self.version += 1
+            self.loaded = False
+
+    def devices_of(self, user_id):
+        """The user's devices, or None if the map can't be loaded."""
+        if not self.loaded:
+            try:
+                self.load()
+            except Exception as e:
+                print(f"❌ Could not load user devices: {e}")
+                return None
+        return self._devices.get(user_id, frozenset())
+
+    def stats(self):
+        return {'loaded': self.loaded, 'users': len(self._devices), 'version': self.version}
+
+
+data_versions = DataVersions()
+user_devices = UserDevices()
+
+_etag_stats = {'not_modified': 0, 'tagged': 0, 'untagged': 0}
+
+
+def current_etag(group=None, per_user=False):
+    """ETag for the current request, or None when its devices aren't known."""
+    if per_user:
+        if session.get('logged_in') is not True or session.get('role') != 'user' or not session.get('user_id'):
+            return None
+        devices = user_devices.devices_of(session['user_id'])
+        if devices is None:
+            return None
+        names = sorted(devices)
+    else:
+        device_id = request.args.get('device_id')
+        if device_id and device_id != 'all':
+            names = [device_id]
+        elif group:
+            names = [group]
+        else:
+            return None
+
+    parts = [
+        PROCESS_EPOCH,
+        str(int(time.time() // ETAG_MAX_AGE)),
+        request.endpoint or request.path,
+        request.query_string.decode("latin-1"),
+        str(session.get('user_id')) if per_user else "",
+        str(session.get('device_id')) if per_user else "",
+        str(user_devices.version),
+        *(f"{name}={data_versions.version(name)}" for name in names),
+    ]
+    return hashlib.blake2b("\n".join(parts).encode(), digest_size=12).hexdigest()
+
+
+def _tagged(response, tag, per_user):
+    response.set_etag(tag, weak=True)
+    # Stored by the browser, but revalidated with If-None-Match on every poll
+    response.cache_control.no_cache = True
+    response.cache_control.private = per_user or None
+    return response
+
+
+def conditional_view(group=None, per_user=False):
+    """
+    Tag a view's 200 responses with an ETag built from the data versions of
+    the devices involved and answer a matching If-None-Match with 304
+    without calling the view.
+
+    group:     sensor group of the devices a device_id=all request covers
+    per_user:  the view covers the logged-in user's assigned devices
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = current_etag(group, per_user)
+            if tag is None:
+                _etag_stats['untagged'] += 1
+                return view(*args, **kwargs)
+            if request.if_none_match.contains_weak(tag):
+                _etag_stats['not_modified'] += 1
+                return _tagged(current_app.response_class(status=304), tag, per_user)
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                _tagged(response, tag, per_user)
+                _etag_stats['tagged'] += 1
+            return response
+        return wrapper
+    return decorate
+
+
+def etag_stats():
+    stats = dict(_etag_stats)
+    stats.update({'data_versions': data_versions.stats(), 'user_devices': user_devices.stats()})
+    return stats
@@ -0,0 +1,265 @@
+"""Process-wide PostgreSQL connection pool.
+
+Every module gets its connections through ``db.get_db_connection()``, which
+leases one from the shared pool below instead of opening a new psycopg2
+connection (TCP + auth handshake) per call.
+
+A leased connection behaves like the psycopg2 connection it wraps, so the
+existing ``with get_db_connection() as conn:`` blocks keep working: on exit
+the transaction is committed (or rolled back on error) and the connection
+goes back to the pool instead of staying open.  ``conn.close()`` also
+returns it to the pool.
+"""
+
+import threading
+import time
+
+import psycopg2
+from psycopg2.pool import PoolError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class PoolTimeoutError(PoolError):
+    """Raised when no connection became free within the wait timeout."""
+
+
+class PooledConnection:
+    """A connection leased from a ConnectionPool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_pool', '_conn'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        conn = self._conn
+        if conn is not None and not conn.closed:
+            try:
+                if exc_type is None:
+                    conn.commit()
+                else:
+                    conn.rollback()
+            finally:
+                self.close()
+        else:
+            self.close()
+        return False
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # A lease that is garbage collected without close() would otherwise
+        # leak one slot of the pool forever.
+        if self.__dict__.get('_conn') is not None:
+            try:
+                self.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """Thread-safe pool with bounded size, checkout health checks and stats.
+
+    - ``min_size`` connections are opened eagerly and kept around.
+    - At most ``max_size`` connections exist at any time; a caller that finds
+      the pool exhausted waits up to ``timeout`` seconds and then gets a
+      ``PoolTimeoutError``.
+    - On checkout a connection that is closed, or that has sat idle for longer
+      than ``check_idle_after`` seconds and fails ``SELECT 1``, is discarded and
+      replaced.
+    """
+
+    def __init__(self, min_size=1, max_size=10, timeout=5.0, check_idle_after=30.0, **connect_kwargs):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("invalid pool size: min_size=%r max_size=%r" % (min_size, max_size))
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle_after = check_idle_after
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, last_used_monotonic)], most recent last
+        self._in_use = set()
+        self._opening = 0
+        self._closed = False
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+        }
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._cond:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._stats['connections_discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.check_idle_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a raw connection. Pair with putconn()."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None
+        waited_since = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    self._in_use.add(conn)
+                    break
+
+                if len(self._in_use) + self._opening < self.max_size:
+                    self._opening += 1
+                    conn = None
+                    break
+
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    deadline = waited_since + timeout
+                    self._stats['waits'] += 1
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self._stats['wait_time_total'] += time.monotonic() - waited_since
+                    raise PoolTimeoutError(
+                        "no database connection available within %.1fs (max_size=%d)" % (timeout, self.max_size)
+                    )
+                self._cond.wait(remaining)
+
+            if waited_since is not None:
+                self._stats['wait_time_total'] += time.monotonic() - waited_since
+            self._stats['checkouts'] += 1
+
+        # Health checks and new connections happen outside the lock so a slow
+        # server doesn't block every other caller.
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._in_use.add(conn)
+            return conn
+
+        if self._is_healthy(conn, last_used):
+            return conn
+
+        with self._cond:
+            self._in_use.discard(conn)
+            self._opening += 1
+        self._discard(conn)
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._in_use.add(conn)
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection obtained from getconn()."""
+        reusable = not conn.closed
+        if reusable and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            # Never hand out a connection with a half-finished transaction.
+            try:
+                conn.rollback()
+            except Exception:
+                reusable = False
+        if reusable and conn.autocommit:
+            # Leases may switch to autocommit; the next borrower expects the default.
+            conn.autocommit = False
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if reusable and not self._closed:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+
+        if conn is not None:
+            self._discard(conn)
+
+    def connection(self, timeout=None):
+        """Lease a connection wrapped so that close()/with-exit returns it."""
+        return PooledConnection(self, self.getconn(timeout))
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'opening': self._opening,
+            })
+        stats['wait_time_total'] = round(stats['wait_time_total'], 4)
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
@@ -0,0 +1,242 @@
+"""Device -> decoder mapping, stored in the device_decoders table.
+
+The registry keeps the whole mapping in a dict so get_decoder_by_device is a
+single hash lookup. Every insert or update of device_decoders gets a new
+value from a sequence (see migration 4 in schema.py); a background thread
+polls for rows with a version above the last one it has seen and applies
+just those, so onboarding a device is an INSERT, not a deploy:
+
+    INSERT INTO device_decoders (device_id, decoder) VALUES ('1fc74ae', 'decode_pulsemeter')
+    ON CONFLICT (device_id) DO UPDATE SET decoder = EXCLUDED.decoder, active = TRUE;
+
+Retire a device with `UPDATE device_decoders SET active = FALSE ...` rather
+than DELETE, so the change has a version the pollers can see.
+
+Versions are handed out when a row is written, not when it commits, so a
+poll can miss a row whose transaction commits after newer versions have
+been seen (a bulk onboarding INSERT takes one version per row). The table
+is small, so every SGS_DECODER_FULL_RELOAD_INTERVAL seconds the poller
+reloads all of it instead, which bounds how long such a row goes unseen.
+
+Until the table has been loaded once (e.g. database down at startup) lookups
+fall back to the static device sets below, which also seed the table.
+
+Settings (environment):
+    SGS_DECODER_REFRESH_INTERVAL      seconds between polls (default 5)
+    SGS_DECODER_FULL_RELOAD_INTERVAL  seconds between full reloads (default 300)
+"""
+
+import os
+import threading
+import time
+
+from db import get_db_connection
+from decoders import (
+    decode_PowerTemp, decode_pulsemeter, decode_water_sensor, decode_magnetic_sensor, decode_tank_level
+)
+
+DECODER_REFRESH_INTERVAL = float(os.environ.get("SGS_DECODER_REFRESH_INTERVAL", 5))
+DECODER_FULL_RELOAD_INTERVAL = float(os.environ.get("SGS_DECODER_FULL_RELOAD_INTERVAL", 300))
+
+# Versions come from a sequence, so a slow transaction can commit a version
+# below one a poller has already seen. Re-reading a trailing window of
+# versions (applying a row twice is harmless) catches most of those late
+# commits quickly; the periodic full reload catches the rest.
+VERSION_OVERLAP = 64
+
+# ----------------------------
+# Sensor Group Configuration
+# ----------------------------
+POWER_TEMP_DEVICES = {"1fc5622", "1fc57ca", "1fc56c3"}
+PULSE_METER_DEVICES = {"1fc74ab","1fa5f9c"}
+WATER_DETECT_DEVICES = {"c6e542", "c53d89", "c6d3a6", "c6da55"}
+MAGNETIC_DEVICES = {"1f7f022","c52fce"}
+TANK_LEVEL_DEVICES = {"1fc74ac","1fc74ad"}
+
+DECODERS_BY_NAME = {
+    decoder.__name__: decoder
+    for decoder in (decode_PowerTemp, decode_pulsemeter, decode_water_sensor, decode_magnetic_sensor, decode_tank_level)
+}
+
+STATIC_DEVICE_DECODERS = {
+    **{device_id: decode_PowerTemp for device_id in POWER_TEMP_DEVICES},
+    **{device_id: decode_pulsemeter for device_id in PULSE_METER_DEVICES},
+    **{device_id: decode_water_sensor for device_id in WATER_DETECT_DEVICES},
+    **{device_id: decode_magnetic_sensor for device_id in MAGNETIC_DEVICES},
+    **{device_id: decode_tank_level for device_id in TANK_LEVEL_DEVICES},
+}
+
+
+class DecoderRegistry:
+    def __init__(self, refresh_interval=DECODER_REFRESH_INTERVAL, retry_interval=30.0,
+                 full_reload_interval=DECODER_FULL_RELOAD_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.retry_interval = retry_interval
+        self._decoders = dict(STATIC_DEVICE_DECODERS)
+        self._version = 0
+        self.loaded = False
+        self._last_attempt = None
+        self._last_load = None
+        self._lock = threading.Lock()   # serializes loads; readers never take it
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'lookups': 0, 'refreshes': 0, 'changes_applied': 0, 'refresh_failures': 0, 'unknown_decoders': 0,
+                       'full_reloads': 0}
+
+    def lookup(self, device_id):
+        """Decoder function for a (lower-case) device id, or None."""
+        self._stats['lookups'] += 1
+        if not self.loaded:
+            self._try_initial_load()
+        return self._decoders.get(device_id)
+
+    def devices_for(self, decoder):
+        """Sorted device ids currently mapped to `decoder`."""
+        if not self.loaded:
+            self._try_initial_load()
+        return sorted(device_id for device_id, mapped in list(self._decoders.items()) if mapped is decoder)
+
+    def _try_initial_load(self):
+        # Processes that never call load() (CLI tools) load lazily; after a
+        # failure keep serving the static sets and retry now and then
+        now = time.monotonic()
+        if self._last_attempt is not None and now - self._last_attempt < self.retry_interval:
+            return
+        self._last_attempt = now
+        try:
+            self.load()
+        except Exception as e:
+            print(f"⚠️ Decoder registry unavailable, using static device sets: {e}")
+
+    def _apply(self, rows, decoders):
+        """
+        Apply (device_id, decoder name, active, version) rows to `decoders`.
+        Returns (highest version, number of rows that changed the mapping).
+        """
+        version = self._version
+        changed = 0
+        for device_id, name, active, row_version in rows:
+            version = max(version, row_version)
+            decoder = DECODERS_BY_NAME.get(name) if active else None
+            if active and decoder is None:
+                self._stats['unknown_decoders'] += 1
+                print(f"⚠️ Device {device_id}: unknown decoder {name!r}, ignoring")
+            if decoders.get(device_id) is decoder:
+                continue
+            if decoder is None:
+                decoders.pop(device_id, None)
+            else:
+                decoders[device_id] = decoder
+            changed += 1
+        return version, changed
+
+    def load(self):
+        """Replace the in-memory mapping with the full table. Returns the number of devices whose decoder changed."""
+        with self._lock:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT device_id, decoder, active, version FROM device_decoders")
+                    rows = cur.fetchall()
+            first = not self.loaded
+            self._version = 0
+            decoders = {}
+            self._version, _ = self._apply(rows, decoders)
+            previous = self._decoders
+            changes = sum(1 for device_id in previous.keys() | decoders.keys()
+                          if previous.get(device_id) is not decoders.get(device_id))
+            self._decoders = decoders   # swap in one assignment: readers see old or new, never half
+            self._last_load = time.monotonic()
+            self.loaded = True
+        if first:
+            print(f"✅ Decoder registry loaded {len(self._decoders)} devices (version {self._version})")
+        return changes
+
+    def load_static(self):
+        """Serve only the static device sets, without touching the database (benchmarks, offline tools)."""
+        with self._lock:
+            self._decoders = dict(STATIC_DEVICE_DECODERS)
+            self._version = 0
+            self.loaded = True
+
+    def refresh(self):
+        """Apply rows changed since the last load/refresh. Returns the number of changes."""
+        if not self.loaded:
+            self.load()
+            return len(self._decoders)
+        with self._lock:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT device_id, decoder, active, version
+                        FROM device_decoders
+                        WHERE version > %s
+                        ORDER BY version
+                    """, (self._version - VERSION_OVERLAP,))
+                    rows = cur.fetchall()
+            # Single dict operations are atomic, so the live mapping is updated in place
+            self._version, changes = self._apply(rows, self._decoders)
+            self._stats['changes_applied'] += changes
+            self._stats['refreshes'] += 1
+        return changes
+
+    def set_decoder(self, device_id, decoder_name):
+        """Map a device to a decoder (by function name) in the table and locally."""
+        if decoder_name not in DECODERS_BY_NAME:
+            raise ValueError(f"Unknown decoder {decoder_name!r}")
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO device_decoders (device_id, decoder)
+                    VALUES (%s, %s)
+                    ON CONFLICT (device_id) DO UPDATE SET decoder = EXCLUDED.decoder, active = TRUE
+                """, (device_id.lower(), decoder_name))
+                conn.commit()
+        self.refresh()
+
+    def retire(self, device_id):
+        """Stop decoding a device (its uplinks are stored as unassigned)."""
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE device_decoders SET active = FALSE WHERE device_id = %s", (device_id.lower(),))
+                conn.commit()
+        self.refresh()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="decoder-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                if self._last_load is not None and time.monotonic() - self._last_load >= self.full_reload_interval:
+                    changes = self.load()
+                    self._stats['full_reloads'] += 1
+                    self._stats['changes_applied'] += changes
+                else:
+                    changes = self.refresh()
+                if changes:
+                    print(f"🔄 Decoder registry applied {changes} changes (version {self._version})")
+            except Exception as e:
+                self._stats['refresh_failures'] += 1
+                print(f"⚠️ Decoder registry refresh failed: {e}")
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            'devices': len(self._decoders),
+            'version': self._version,
+            'loaded': self.loaded,
+            'polling': self._thread is not None,
+        })
+        return stats
+
+
+decoder_registry = DecoderRegistry()
@@ -0,0 +1,639 @@
+"""Sigfox payload decoders.
+
+Each payload layout is declared once (LAYOUTS / flag tables below) and compiled
+at import time into struct.Struct formats and lookup tables, so decoding a
+message is one bytes.fromhex, one unpack_from and a few tuple indexes.
+
+The reference_* functions are the original field-by-field decoders. The fast
+decoders fall back to them for anything outside the well-formed layouts
+(short or odd payloads, non-hex input, non-default timestamps), so their
+output is identical for every input. The fast decoders keep the original
+function names because __name__ is stored as the sensor_group.
+
+The exported decoders are additionally memoized per payload (see
+memoize_decoder): door sensors and idle meters repeat the same payload all
+day. Set SGS_DECODE_CACHE_SIZE=0 to turn the caches off.
+"""
+
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+
+DEFAULT_BASE_UNIX_TIME = 1748265008
+DECODE_CACHE_SIZE = int(os.environ.get("SGS_DECODE_CACHE_SIZE", 4096))
+
+# Periodic report interval in hours, indexed by bits 5-7 of the tx flag
+INTERVAL_HOURS = (-0.25, -0.5, -1, -2, -3, -4, -5, -6)
+
+
+# ----------------------------
+# Reference decoders
+# ----------------------------
+
+def convert_to_signed(byte_str):
+    val = int(byte_str, 16)
+    return val - 256 if val > 127 else val
+
+def reference_decode_PowerTemp(payload_hex, base_unix_time=DEFAULT_BASE_UNIX_TIME):
+    try:
+        tx_flag = int(payload_hex[0:2], 16)
+        is_periodic = (tx_flag & 0x10) == 0x10
+
+        battery_voltage = round(int(payload_hex[2:4], 16) * 0.02, 2)
+        status_mask = int(payload_hex[4:6], 16)
+        temp_current = convert_to_signed(payload_hex[6:8])
+
+        result = {
+            'tx_flag': tx_flag,
+            'is_periodic': is_periodic,
+            'battery_volts': battery_voltage,
+            'status_mask': status_mask,
+            'temp_celsius': temp_current,
+            'timestamp': datetime.utcfromtimestamp(base_unix_time).isoformat(),
+            'temp_history': [],
+            'alerts': []
+        }
+
+        if is_periodic:
+            # Determine periodic interval in hours from tx_flag (bits 5,6,7)
+            device_interval = (tx_flag >> 5) & 0x07
+            interval_map = {
+                0: -0.25,
+                1: -0.5,
+                2: -1,
+                3: -2,
+                4: -3,
+                5: -4,
+                6: -5,
+                7: -6
+            }
+            time_period = interval_map.get(device_interval, -1)
+
+            base_time = datetime.utcfromtimestamp(base_unix_time)
+            history = []
+
+            # Extract and timestamp the 4 historical temperature min/max pairs
+            for i in range(4):
+                offset = 8 + i * 4
+                t_min = convert_to_signed(payload_hex[offset:offset+2])
+                t_max = convert_to_signed(payload_hex[offset+2:offset+4])
+                timestamp = base_time + timedelta(hours=time_period * i)
+                history.append({
+                    'min_temp': t_min,
+                    'max_temp': t_max,
+                    'timestamp': timestamp.isoformat()
+                })
+            result['temp_history'] = history
+
+        else:
+            # It's an alert payload
+            tx_info_mask = int(payload_hex[8:10], 16)
+            if (tx_flag & 0x08):
+                result['alerts'].append('Temperature Alert')
+            if (tx_flag & 0x04):
+                result['alerts'].append('Power Alert')
+            if tx_info_mask & 0x40:
+                result['alerts'].append('Temperature Low Alert')
+
+        return result
+
+    except Exception as e:
+        return {
+            'battery_volts': None,
+            'temp_celsius': None,
+            'status_flags': [],
+            'error': f'Decode error: {str(e)}'
+        }
+
+
+def reference_decode_pulsemeter(payload_hex, timestamp_unix=DEFAULT_BASE_UNIX_TIME):
+    """
+    Decodes PulseMeter data (12-byte periodic or 8-byte alert payload).
+    Returns structured data for storage or logging.
+    """
+    try:
+        data = bytes.fromhex(payload_hex)
+        length = len(data)
+
+        if length not in [8, 9, 12]:
+            return {'error': f'Unknown PulseMeter payload length: {length} bytes', 'raw_hex': payload_hex, 'raw_bytes': data.hex()}
+
+        txflags = data[0]
+        battery_raw = data[1]
+        battery_volts = round(battery_raw * 0.02, 2)
+
+        # Decode flags into human-readable strings
+        active_flags = []
+        if txflags & 0b00000001: active_flags.append("Periodic Update")
+        if txflags & 0b00000010: active_flags.append("Forced Transmit / Power Up")
+        if txflags & 0b00000100: active_flags.append("Leak/Tamper Alert")
+        if txflags & 0b00001000: active_flags.append("Leak Detected")
+        if txflags & 0b00010000: active_flags.append("Tamper Detected")
+
+        result = {
+            'battery_volts': battery_volts,
+            'leak_detected': "Leak Detected" in active_flags,
+            'status_flags': active_flags,
+            'debug_info': {
+                'payload_length': length,
+                'raw_hex': payload_hex,
+                'txflags_binary': f'{txflags:08b}',
+                'battery_raw': battery_raw
+            }
+        }
+
+        if length == 12:
+            # Periodic payload
+            device_interval = (txflags >> 5) & 0b111
+            interval_map = {
+                0: -0.25,
+                1: -0.5,
+                2: -1,
+                3: -2,
+                4: -3,
+                5: -4,
+                6: -5,
+                7: -6
+            }
+            timer_period = interval_map.get(device_interval, 0)
+
+            counter0 = int.from_bytes(data[2:6], byteorder='big')
+            offset1 = int.from_bytes(data[6:8], byteorder='big')
+            offset2 = int.from_bytes(data[8:10], byteorder='big')
+            offset3 = int.from_bytes(data[10:12], byteorder='big')
+
+            # Use the modern datetime approach with timezone awareness
+            counter0_time = datetime.fromtimestamp(timestamp_unix, tz=timezone.utc)
+            counter1_time = counter0_time + timedelta(hours=timer_period * 1)
+            counter2_time = counter0_time + timedelta(hours=timer_period * 2)
+            counter3_time = counter0_time + timedelta(hours=timer_period * 3)
+
+            result.update({
+                'pulse_count': counter0,
+                'history': [
+                    {'timestamp': counter0_time.isoformat(), 'value': counter0},
+                    {'timestamp': counter1_time.isoformat(), 'value': counter0 - offset1},
+                    {'timestamp': counter2_time.isoformat(), 'value': counter0 - offset2},
+                    {'timestamp': counter3_time.isoformat(), 'value': counter0 - offset3}
+                ]
+            })
+
+        elif length == 8:
+            # Alert payload
+            pulse_count = int.from_bytes(data[2:6], byteorder='big')
+            result.update({
+                'pulse_count': pulse_count
+            })
+
+        elif length == 9:
+            # 9-byte payload - need to determine structure
+            # For now, treat similar to 8-byte but capture extra byte
+            pulse_count = int.from_bytes(data[2:6], byteorder='big')
+            extra_data = data[6:9].hex()  # Last 3 bytes as hex string
+            result.update({
+                'pulse_count': pulse_count,
+                'extra_data': extra_data,
+                'payload_type': '9-byte_variant'
+            })
+
+        return result
+
+    except Exception as e:
+        return {'error': f"PulseMeter decode failed: {str(e)}"}
+
+
+def reference_decode_water_sensor(payload_hex, timestamp=None, water_threshold=150):
+    try:
+        # Convert payload to usable hex segments
+        tx_flag = int(payload_hex[0:2], 16)
+        water_detected = int(payload_hex[2:4], 16) == 1
+        water_raw = int(payload_hex[4:6], 16)
+        battery_hex = int(payload_hex[6:8], 16)
+        battery_volts = battery_hex * 0.02
+        counter_value = int(payload_hex[8:16], 16)
+
+        # Determine if this was a state change (bit 1 = 0x02)
+        is_state_change = (tx_flag & 0x02) == 0x02
+
+        alerts = []
+        if water_detected and water_raw <= water_threshold:
+            alerts.append("Water detected below threshold")
+        if battery_volts < 2.5:
+            alerts.append("Low battery")
+
+        return {
+            'tx_flag': tx_flag,
+            'is_state_change': is_state_change,
+            'water_detected': water_detected,
+            'water_raw_value': water_raw,
+            'battery_volts': round(battery_volts, 2),
+            'counter_value': counter_value,
+            'alerts': alerts,
+            'raw_payload': payload_hex,
+            'timestamp': timestamp or datetime.now().isoformat()
+        }
+
+    except Exception as e:
+        return {'error': f"Decode error: {str(e)}"}
+
+def reference_decode_magnetic_sensor(payload_hex):
+    try:
+        data = bytes.fromhex(payload_hex)
+        if len(data) < 2:
+            return {'error': 'Invalid magnetic sensor payload length'}
+        status = "open" if data[1] == 0x00 else "closed" if data[1] == 0x01 else f"Unknown ({data[1]})"
+        return {
+            "sensor_type": "magnetic",
+            "status": status,
+            "raw_payload": payload_hex
+        }
+    except Exception as e:
+        return {'error': f"Magnetic sensor decode failed: {str(e)}"}
+
+def reference_decode_tank_level(payload_hex):
+    """
+    Decodes tank level sensor data
+    Expected payload format: 2 bytes for level percentage, 1 byte for battery
+    """
+    try:
+        data = bytes.fromhex(payload_hex)
+        if len(data) < 3:
+            return {'error': 'Invalid tank level payload length'}
+
+        level_percentage = data[0]  # First byte is level percentage (0-100)
+        battery_raw = data[1]
+        battery_volts = round(battery_raw * 0.02, 2)
+        status_flags = data[2] if len(data) > 2 else 0
+
+        alerts = []
+        if level_percentage < 20:
+            alerts.append("Low tank level")
+        if battery_volts < 2.5:
+            alerts.append("Low battery")
+
+        return {
+            'sensor_type': 'tank_level',
+            'level_percentage': level_percentage,
+            'battery_volts': battery_volts,
+            'status_flags': status_flags,
+            'alerts': alerts,
+            'raw_payload': payload_hex
+        }
+    except Exception as e:
+        return {'error': f'Tank level decode failed: {str(e)}'}
+
+
+# ----------------------------
+# Layouts
+# ----------------------------
+
+def compile_layout(*fields):
+    """
+    Compile (name, struct code) pairs, in payload order, into a big-endian
+    struct.Struct. The names only document the layout; unpack_from returns a
+    tuple in the same order.
+    """
+    return struct.Struct(">" + "".join(code for _, code in fields))
+
+
+def compile_flags(flags):
+    """
+    Precompute the labels set for every value of the bits in `flags`
+    ((bit, label) pairs, in output order). Returns (mask, table) where
+    table[value & mask] is the tuple of labels.
+    """
+    mask = 0
+    for bit, _ in flags:
+        mask |= bit
+    table = tuple(tuple(label for bit, label in flags if value & bit) for value in range(mask + 1))
+    return mask, table
+
+
+LAYOUTS = {
+    'power_temp_header': compile_layout(
+        ('tx_flag', 'B'), ('battery_raw', 'B'), ('status_mask', 'B'), ('temp_celsius', 'b'),
+    ),
+    'power_temp_periodic': compile_layout(
+        ('tx_flag', 'B'), ('battery_raw', 'B'), ('status_mask', 'B'), ('temp_celsius', 'b'),
+        ('min_0', 'b'), ('max_0', 'b'), ('min_1', 'b'), ('max_1', 'b'),
+        ('min_2', 'b'), ('max_2', 'b'), ('min_3', 'b'), ('max_3', 'b'),
+    ),
+    'power_temp_alert': compile_layout(
+        ('tx_flag', 'B'), ('battery_raw', 'B'), ('status_mask', 'B'), ('temp_celsius', 'b'),
+        ('tx_info_mask', 'B'),
+    ),
+    'pulse_periodic': compile_layout(
+        ('txflags', 'B'), ('battery_raw', 'B'), ('counter0', 'I'),
+        ('offset1', 'H'), ('offset2', 'H'), ('offset3', 'H'),
+    ),
+    'pulse_alert': compile_layout(
+        ('txflags', 'B'), ('battery_raw', 'B'), ('pulse_count', 'I'), ('reserved', '2x'),
+    ),
+    'pulse_variant': compile_layout(
+        ('txflags', 'B'), ('battery_raw', 'B'), ('pulse_count', 'I'), ('extra_data', '3s'),
+    ),
+    'water': compile_layout(
+        ('tx_flag', 'B'), ('water_detected', 'B'), ('water_raw', 'B'), ('battery_raw', 'B'),
+        ('counter_value', 'I'),
+    ),
+    'tank_level': compile_layout(
+        ('level_percentage', 'B'), ('battery_raw', 'B'), ('status_flags', 'B'),
+    ),
+}
+
+POWER_TEMP_PERIODIC = LAYOUTS['power_temp_periodic']
+POWER_TEMP_ALERT = LAYOUTS['power_temp_alert']
+PULSE_BY_LENGTH = {
+    LAYOUTS['pulse_periodic'].size: LAYOUTS['pulse_periodic'],
+    LAYOUTS['pulse_alert'].size: LAYOUTS['pulse_alert'],
+    LAYOUTS['pulse_variant'].size: LAYOUTS['pulse_variant'],
+}
+WATER = LAYOUTS['water']
+TANK_LEVEL = LAYOUTS['tank_level']
+
+POWER_TEMP_TX_ALERTS = compile_flags(((0x08, 'Temperature Alert'), (0x04, 'Power Alert')))
+POWER_TEMP_INFO_ALERTS = compile_flags(((0x40, 'Temperature Low Alert'),))
+PULSE_FLAGS = compile_flags((
+    (0b00000001, "Periodic Update"),
+    (0b00000010, "Forced Transmit / Power Up"),
+    (0b00000100, "Leak/Tamper Alert"),
+    (0b00001000, "Leak Detected"),
+    (0b00010000, "Tamper Detected"),
+))
+
+# Per-byte tables, computed with the same expressions as the reference decoders
+BATTERY_VOLTS = tuple(round(raw * 0.02, 2) for raw in range(256))
+WATER_LOW_BATTERY = tuple(raw * 0.02 < 2.5 for raw in range(256))
+TANK_LOW_BATTERY = tuple(volts < 2.5 for volts in BATTERY_VOLTS)
+TXFLAGS_BINARY = tuple(f'{value:08b}' for value in range(256))
+MAGNETIC_STATUS = tuple(
+    "open" if value == 0x00 else "closed" if value == 0x01 else f"Unknown ({value})" for value in range(256)
+)
+
+# Timestamps for the default base time: the reference decoders always use it
+# when called from the ingest path, so the isoformat strings are fixed.
+POWER_TEMP_TIMESTAMP = datetime.utcfromtimestamp(DEFAULT_BASE_UNIX_TIME).isoformat()
+POWER_TEMP_HISTORY_TIMES = tuple(
+    tuple((datetime.utcfromtimestamp(DEFAULT_BASE_UNIX_TIME) + timedelta(hours=hours * i)).isoformat() for i in range(4))
+    for hours in INTERVAL_HOURS
+)
+PULSE_HISTORY_TIMES = tuple(
+    tuple((datetime.fromtimestamp(DEFAULT_BASE_UNIX_TIME, tz=timezone.utc) + timedelta(hours=hours * i)).isoformat() for i in range(4))
+    for hours in INTERVAL_HOURS
+)
+
+
+def hex_prefix(payload_hex, size):
+    """The first `size` bytes of a strictly hex string, or None if it is shorter or not plain hex."""
+    if type(payload_hex) is not str or len(payload_hex) < 2 * size:
+        return None
+    try:
+        data = bytes.fromhex(payload_hex[:2 * size])
+    except ValueError:
+        return None
+    # bytes.fromhex skips whitespace, which the reference slicing would not
+    return data if len(data) == size else None
+
+
+# ----------------------------
+# Fast decoders
+# ----------------------------
+
+def decode_PowerTemp(payload_hex, base_unix_time=DEFAULT_BASE_UNIX_TIME):
+    header = hex_prefix(payload_hex, 1)
+    if header is None or base_unix_time != DEFAULT_BASE_UNIX_TIME:
+        return reference_decode_PowerTemp(payload_hex, base_unix_time)
+
+    is_periodic = (header[0] & 0x10) == 0x10
+    layout = POWER_TEMP_PERIODIC if is_periodic else POWER_TEMP_ALERT
+    data = hex_prefix(payload_hex, layout.size)
+    if data is None:
+        return reference_decode_PowerTemp(payload_hex, base_unix_time)
+
+    if is_periodic:
+        tx_flag, battery_raw, status_mask, temp_celsius, *pairs = layout.unpack_from(data)
+        times = POWER_TEMP_HISTORY_TIMES[(tx_flag >> 5) & 0x07]
+        history = [
+            {'min_temp': pairs[0], 'max_temp': pairs[1], 'timestamp': times[0]},
+            {'min_temp': pairs[2], 'max_temp': pairs[3], 'timestamp': times[1]},
+            {'min_temp': pairs[4], 'max_temp': pairs[5], 'timestamp': times[2]},
+            {'min_temp': pairs[6], 'max_temp': pairs[7], 'timestamp': times[3]},
+        ]
+        alerts = []
+    else:
+        tx_flag, battery_raw, status_mask, temp_celsius, tx_info_mask = layout.unpack_from(data)
+        history = []
+        alerts = list(POWER_TEMP_TX_ALERTS[1][tx_flag & POWER_TEMP_TX_ALERTS[0]]
+                      + POWER_TEMP_INFO_ALERTS[1][tx_info_mask & POWER_TEMP_INFO_ALERTS[0]])
+
+    return {
+        'tx_flag': tx_flag,
+        'is_periodic': is_periodic,
+        'battery_volts': BATTERY_VOLTS[battery_raw],
+        'status_mask': status_mask,
+        'temp_celsius': temp_celsius,
+        'timestamp': POWER_TEMP_TIMESTAMP,
+        'temp_history': history,
+        'alerts': alerts
+    }
+
+
+def decode_pulsemeter(payload_hex, timestamp_unix=DEFAULT_BASE_UNIX_TIME):
+    """
+    Decodes PulseMeter data (12-byte periodic, 8-byte alert or 9-byte variant payload).
+    Returns structured data for storage or logging.
+    """
+    if type(payload_hex) is not str or timestamp_unix != DEFAULT_BASE_UNIX_TIME:
+        return reference_decode_pulsemeter(payload_hex, timestamp_unix)
+    try:
+        data = bytes.fromhex(payload_hex)
+    except ValueError:
+        return reference_decode_pulsemeter(payload_hex, timestamp_unix)
+    layout = PULSE_BY_LENGTH.get(len(data))
+    if layout is None:
+        return reference_decode_pulsemeter(payload_hex, timestamp_unix)
+
+    fields = layout.unpack_from(data)
+    txflags, battery_raw, pulse_count = fields[0], fields[1], fields[2]
+    length = layout.size
+
+    result = {
+        'battery_volts': BATTERY_VOLTS[battery_raw],
+        'leak_detected': (txflags & 0b00001000) != 0,
+        'status_flags': list(PULSE_FLAGS[1][txflags & PULSE_FLAGS[0]]),
+        'debug_info': {
+            'payload_length': length,
+            'raw_hex': payload_hex,
+            'txflags_binary': TXFLAGS_BINARY[txflags],
+            'battery_raw': battery_raw
+        },
+        'pulse_count': pulse_count
+    }
+
+    if length == 12:
+        times = PULSE_HISTORY_TIMES[(txflags >> 5) & 0b111]
+        result['history'] = [
+            {'timestamp': times[0], 'value': pulse_count},
+            {'timestamp': times[1], 'value': pulse_count - fields[3]},
+            {'timestamp': times[2], 'value': pulse_count - fields[4]},
+            {'timestamp': times[3], 'value': pulse_count - fields[5]}
+        ]
+    elif length == 9:
+        result['extra_data'] = fields[3].hex()
+        result['payload_type'] = '9-byte_variant'
+
+    return result
+
+
+def decode_water_sensor(payload_hex, timestamp=None, water_threshold=150):
+    data = hex_prefix(payload_hex, WATER.size)
+    if data is None:
+        return reference_decode_water_sensor(payload_hex, timestamp, water_threshold)
+
+    tx_flag, detected_raw, water_raw, battery_raw, counter_value = WATER.unpack_from(data)
+    water_detected = detected_raw == 1
+
+    alerts = []
+    if water_detected and water_raw <= water_threshold:
+        alerts.append("Water detected below threshold")
+    if WATER_LOW_BATTERY[battery_raw]:
+        alerts.append("Low battery")
+
+    return {
+        'tx_flag': tx_flag,
+        'is_state_change': (tx_flag & 0x02) == 0x02,
+        'water_detected': water_detected,
+        'water_raw_value': water_raw,
+        'battery_volts': BATTERY_VOLTS[battery_raw],
+        'counter_value': counter_value,
+        'alerts': alerts,
+        'raw_payload': payload_hex,
+        'timestamp': timestamp or datetime.now().isoformat()
+    }
+
+
+def decode_magnetic_sensor(payload_hex):
+    if type(payload_hex) is not str:
+        return reference_decode_magnetic_sensor(payload_hex)
+    try:
+        data = bytes.fromhex(payload_hex)
+    except ValueError:
+        return reference_decode_magnetic_sensor(payload_hex)
+    if len(data) < 2:
+        return {'error': 'Invalid magnetic sensor payload length'}
+    return {
+        "sensor_type": "magnetic",
+        "status": MAGNETIC_STATUS[data[1]],
+        "raw_payload": payload_hex
+    }
+
+
+def decode_tank_level(payload_hex):
+    """
+    Decodes tank level sensor data
+    Expected payload format: 1 byte level percentage, 1 byte battery, 1 byte status flags
+    """
+    if type(payload_hex) is not str:
+        return reference_decode_tank_level(payload_hex)
+    try:
+        data = bytes.fromhex(payload_hex)
+    except ValueError:
+        return reference_decode_tank_level(payload_hex)
+    if len(data) < TANK_LEVEL.size:
+        return {'error': 'Invalid tank level payload length'}
+
+    level_percentage, battery_raw, status_flags = TANK_LEVEL.unpack_from(data)
+
+    alerts = []
+    if level_percentage < 20:
+        alerts.append("Low tank level")
+    if TANK_LOW_BATTERY[battery_raw]:
+        alerts.append("Low battery")
+
+    return {
+        'sensor_type': 'tank_level',
+        'level_percentage': level_percentage,
+        'battery_volts': BATTERY_VOLTS[battery_raw],
+        'status_flags': status_flags,
+        'alerts': alerts,
+        'raw_payload': payload_hex
+    }
+
+
+# ----------------------------
+# Memoization
+# ----------------------------
+
+# Stand-in arrival time for cached water results; replaced on every call
+_CACHED_TIMESTAMP = "cached"
+
+
+def memoize_decoder(decoder, maxsize=DECODE_CACHE_SIZE, attach_timestamp=False):
+    """
+    Wrap a decoder with an LRU cache keyed by payload. Calls passing any
+    argument besides the payload bypass the cache, except the `timestamp` of
+    an attach_timestamp decoder: that field depends on arrival time, so it is
+    filled in after the lookup instead of being cached.
+
+    Hits return a fresh top-level dict, but nested lists and dicts are shared
+    with the cache, so decoded results must be treated as read-only.
+    """
+    if maxsize <= 0:
+        return decoder
+    cached = lru_cache(maxsize=maxsize)(decoder)
+
+    if attach_timestamp:
+        @wraps(decoder)
+        def memoized(payload_hex, timestamp=None, *args, **kwargs):
+            if args or kwargs or type(payload_hex) is not str:
+                return decoder(payload_hex, timestamp, *args, **kwargs)
+            result = dict(cached(payload_hex, _CACHED_TIMESTAMP))
+            if 'timestamp' in result:
+                result['timestamp'] = timestamp or datetime.now().isoformat()
+            return result
+    else:
+        @wraps(decoder)
+        def memoized(payload_hex, *args, **kwargs):
+            if args or kwargs or type(payload_hex) is not str:
+                return decoder(payload_hex, *args, **kwargs)
+            return dict(cached(payload_hex))
+
+    memoized.cache_info = cached.cache_info
+    memoized.cache_clear = cached.cache_clear
+    return memoized
+
+
+decode_PowerTemp = memoize_decoder(decode_PowerTemp)
+decode_pulsemeter = memoize_decoder(decode_pulsemeter)
+decode_water_sensor = memoize_decoder(decode_water_sensor, attach_timestamp=True)
+decode_magnetic_sensor = memoize_decoder(decode_magnetic_sensor)
+decode_tank_level = memoize_decoder(decode_tank_level)
+
+
+def decode_cache_stats():
+    """Hit/miss counters of the decoder caches, keyed by sensor group."""
+    stats = {}
+    for decoder in REFERENCE_DECODERS:
+        if not hasattr(decoder, 'cache_info'):
+            continue
+        info = decoder.cache_info()
+        total = info.hits + info.misses
+        stats[decoder.__name__] = {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+            'hit_rate': round(info.hits / total, 4) if total else None,
+        }
+    return stats
+
+
+# Exported decoder -> reference decoder, for equivalence checks and benchmarks
+REFERENCE_DECODERS = {
+    decode_PowerTemp: reference_decode_PowerTemp,
+    decode_pulsemeter: reference_decode_pulsemeter,
+    decode_water_sensor: reference_decode_water_sensor,
+    decode_magnetic_sensor: reference_decode_magnetic_sensor,
+    decode_tank_level: reference_decode_tank_level,
+}
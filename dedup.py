@@ -0,0 +1,78 @@
+"""Duplicate-uplink filter for /sigfox.
+
+Sigfox retries callbacks and several base stations can forward the same
+message, so one (device, seqNumber) often arrives more than once. The filter
+remembers every key it has seen for `window_seconds` (Sigfox sequence numbers
+wrap, so keys must expire) and never holds more than `max_entries` keys; the
+oldest are evicted first.
+
+Settings (environment):
+    SGS_DEDUP_WINDOW       seconds a key is remembered (default 600)
+    SGS_DEDUP_MAX_ENTRIES  upper bound on remembered keys (default 100000)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEDUP_WINDOW = float(os.environ.get("SGS_DEDUP_WINDOW", 600))
+DEDUP_MAX_ENTRIES = int(os.environ.get("SGS_DEDUP_MAX_ENTRIES", 100000))
+
+
+class UplinkDeduplicator:
+    def __init__(self, window_seconds=DEDUP_WINDOW, max_entries=DEDUP_MAX_ENTRIES):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._seen = OrderedDict()   # key -> first-seen time, oldest first
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+    def seen(self, device_id, sequence):
+        """Record the uplink and return True if it was already seen inside the window."""
+        if sequence is None:
+            return False
+        key = (device_id, str(sequence))
+        now = time.monotonic()
+
+        with self._lock:
+            cutoff = now - self.window_seconds
+            while self._seen:
+                _, first_seen = next(iter(self._seen.items()))
+                if first_seen >= cutoff:
+                    break
+                self._seen.popitem(last=False)
+                self._stats['expired'] += 1
+
+            if key in self._seen:
+                self._stats['hits'] += 1
+                return True
+
+            self._seen[key] = now
+            self._stats['misses'] += 1
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+                self._stats['evicted'] += 1
+            return False
+
+    def forget(self, device_id, sequence):
+        """Drop a key again, e.g. when the first copy failed so a retry must get through."""
+        if sequence is None:
+            return
+        with self._lock:
+            self._seen.pop((device_id, str(sequence)), None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'size': len(self._seen),
+                'max_entries': self.max_entries,
+                'window_seconds': self.window_seconds,
+            })
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 4) if total else None
+        return stats
+
+
+uplink_dedup = UplinkDeduplicator()
@@ -0,0 +1,215 @@
+"""Check that the dashboard and API read queries are served by indexes.
+
+Runs EXPLAIN (FORMAT JSON) for the hot read queries of app.py / pages.py
+and flags every sequential scan on a sensor table, sigfox_raw or a rollup
+table. The rollup and latest-state statements are captured from the
+charts.py and latest_state.py functions the endpoints call, so they can't
+drift; the raw history windows are generated from sensor_rows in the shape
+the history endpoints in app.py use. By default the
+tables are first seeded with synthetic rows (the rollup and latest-state
+triggers fill theirs) and ANALYZEd inside a transaction that is rolled back
+afterwards, so the planner sees realistic sizes without leaving data behind:
+
+    python index_advisor.py                  seed 20000 rows per table, explain, roll back
+    python index_advisor.py --rows 200000
+    python index_advisor.py --no-seed        explain against the data already there
+
+Exits with status 1 when a sequential scan was flagged.
+"""
+
+import argparse
+import json
+import sys
+
+from charts import temperature_charts, temperature_history, pulse_usage_stats, pulse_usage
+from db import get_db_connection, sensor_rows
+from latest_state import fetch_latest_state, fetch_user_latest_state
+from rollups import ROLLUP_TABLES
+
+SEED_DEVICES = 50
+SEED_DEVICE_PREFIX = "advisor-"
+SEED_USER_EMAIL = "index-advisor@example.invalid"
+SAMPLE_DEVICE = SEED_DEVICE_PREFIX + "7"
+# Stands for the user the queries run as; replaced by a real user_id in advise()
+SAMPLE_USER = -1
+
+# SQL expression (of the generate_series value g) used to seed each value column
+SEED_VALUES = {
+    "temp_celsius": "(g % 40)::float",
+    "water_detected": "CASE WHEN g % 10 = 0 THEN 'True' ELSE 'False' END",
+    "pulse_count": "g",
+    "leak_detected": "'False'",
+    "status": "CASE WHEN g % 2 = 0 THEN 'open' ELSE 'closed' END",
+    "level_percentage": "g % 100",
+    "battery_volts": "3.0",
+}
+
+# Append-only tables that grow with every uplink. device_latest_state and
+# USER_DEVICE hold one row per device, where a sequential scan is fine.
+SCANNED_TABLES = ({table.lower() for table, _, _ in sensor_rows.values()} | {"sigfox_raw"}
+                  | set(ROLLUP_TABLES.values()))
+
+# Histories still read from the raw sensor tables
+HISTORY_ENDPOINTS = {
+    "PULSE_DETECTOR": "/api/user/flow-history",
+    "WATER_DETECTOR": "/api/user/water-detection-history",
+    "MAGNETIC": "/api/user/door-history",
+    "TANK_LEVEL": "/api/user/tank-level-history",
+}
+
+
+class _RecordingCursor:
+    """Stands in for a cursor to capture the statement a read helper runs."""
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append((query, params))
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+
+def captured(read, *args, **kwargs):
+    """(query, params) of the single statement `read(cur, *args, **kwargs)` executes."""
+    cur = _RecordingCursor()
+    read(cur, *args, **kwargs)
+    (query, params), = cur.statements
+    return query, params
+
+
+# (endpoint, description, query, params)
+QUERIES = [
+    ("/api/user/data", "user's devices and latest state", *captured(fetch_user_latest_state, SAMPLE_USER)),
+    ("/api/user/tank-level", "latest state of devices", *captured(fetch_latest_state, [SAMPLE_DEVICE])),
+    ("/api/user/temperature", "user's charts, daily rollup",
+     *captured(temperature_charts, "day", "7 days", user_id=SAMPLE_USER)),
+    ("/api/user/temperature", "user's charts, hourly rollup",
+     *captured(temperature_charts, "hour", "1 day", user_id=SAMPLE_USER)),
+    ("/api/user/usage", "pulse rollup stats", *captured(pulse_usage_stats, SAMPLE_DEVICE)),
+    ("/api/user/usage", "pulses per day", *captured(pulse_usage, SAMPLE_DEVICE, "day", "7 days")),
+    ("/api/user/usage", "pulses per hour", *captured(pulse_usage, SAMPLE_DEVICE, "hour", "1 day")),
+    ("/api/user/temperature-history", "hourly rollup device window",
+     *captured(temperature_history, "7 days", SAMPLE_DEVICE)),
+    ("/api/user/temperature-history", "hourly rollup fleet window", *captured(temperature_history, "1 day")),
+    *(
+        (endpoint, f"{table} device window", f"""
+            SELECT device_id, received_at, {', '.join(columns)} FROM {table}
+            WHERE received_at >= NOW() - INTERVAL %s AND device_id = %s
+            ORDER BY received_at DESC
+        """, ("7 days", SAMPLE_DEVICE))
+        for table, columns, _ in sensor_rows.values()
+        for endpoint in [HISTORY_ENDPOINTS.get(table)] if endpoint
+    ),
+    *(
+        (endpoint, f"{table} fleet window", f"""
+            SELECT device_id, received_at, {', '.join(columns)} FROM {table}
+            WHERE received_at >= NOW() - INTERVAL %s
+            ORDER BY received_at DESC
+        """, ("1 day",))
+        for table, columns, _ in sensor_rows.values()
+        for endpoint in [HISTORY_ENDPOINTS.get(table)] if endpoint
+    ),
+    ("batch_decode.py", "raw payloads of a sensor group", """
+        SELECT raw_payload FROM sigfox_raw WHERE sensor_group = %s ORDER BY id LIMIT 1000
+    """, ("decode_pulsemeter",)),
+]
+
+
+def seed(cur, rows):
+    """Insert synthetic rows spread over SEED_DEVICES devices and the last `rows` minutes."""
+    device = f"'{SEED_DEVICE_PREFIX}' || (g % {SEED_DEVICES})"
+    received = "NOW() - make_interval(mins => g)"
+    for sensor_group, (table, columns, _) in sensor_rows.items():
+        cur.execute(f"""
+            INSERT INTO {table} (device_id, sequence, {', '.join(columns)}, received_at)
+            SELECT {device}, g, {', '.join(SEED_VALUES[column] for column in columns)}, {received}
+            FROM generate_series(1, %s) AS g
+            ON CONFLICT DO NOTHING
+        """, (rows,))
+        cur.execute(f"""
+            INSERT INTO sigfox_raw (timestamp, device_id, device_type, sequence, raw_payload, decoded, sensor_group, received_at)
+            SELECT {received}, {device}, 'advisor', g, '00', '{{}}'::jsonb, %s, {received}
+            FROM generate_series(1, %s) AS g
+        """, (sensor_group, rows))
+
+    # An owner for the seeded devices, spread over the sensor groups
+    cur.execute("""
+        INSERT INTO Users (name, surname, email, location, password)
+        VALUES ('Index', 'Advisor', %s, 'nowhere', '-')
+        ON CONFLICT (email) DO UPDATE SET name = EXCLUDED.name
+        RETURNING user_ID
+    """, (SEED_USER_EMAIL,))
+    user_id = cur.fetchone()[0]
+    cur.execute(f"""
+        INSERT INTO USER_DEVICE (device_id, user_id, sensor_type)
+        SELECT '{SEED_DEVICE_PREFIX}' || g, %s, (%s::text[])[g % %s + 1]
+        FROM generate_series(0, {SEED_DEVICES - 1}) AS g
+        ON CONFLICT (device_id) DO UPDATE SET user_id = EXCLUDED.user_id, sensor_type = EXCLUDED.sensor_type
+    """, (user_id, list(sensor_rows), len(sensor_rows)))
+
+    for table in SCANNED_TABLES | {"device_latest_state", "user_device"}:
+        cur.execute(f"ANALYZE {table}")
+    return user_id
+
+
+def sample_user(cur):
+    """Some user with assigned devices, to explain the per-user queries against existing data."""
+    cur.execute("SELECT user_id FROM USER_DEVICE WHERE user_id IS NOT NULL LIMIT 1")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def explain(cur, query, params):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    document = cur.fetchone()[0]
+    if isinstance(document, str):
+        document = json.loads(document)
+    return document[0]["Plan"]
+
+
+def advise(rows=20000, seed_data=True):
+    """Explain every query in QUERIES; returns the list of (endpoint, description, table) seq scans."""
+    flagged = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                user_id = seed(cur, rows) if seed_data else sample_user(cur)
+                for endpoint, description, query, params in QUERIES:
+                    params = [user_id if value == SAMPLE_USER else value for value in params]
+                    plan = explain(cur, query, params)
+                    nodes = list(walk(plan))
+                    scans = sorted({
+                        node.get("Relation Name") for node in nodes
+                        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name") in SCANNED_TABLES
+                    })
+                    indexes = sorted({node["Index Name"] for node in nodes if "Index Name" in node})
+                    mark = "❌" if scans else "✅"
+                    print(f"{mark} {endpoint:<34} {description:<32} cost {plan['Total Cost']:>10,.1f}  "
+                          + (f"SEQ SCAN on {', '.join(scans)}" if scans else f"via {', '.join(indexes) or plan['Node Type']}"))
+                    flagged.extend((endpoint, description, table) for table in scans)
+            finally:
+                # Never keep the seeded rows
+                conn.rollback()
+    return flagged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN the hot read queries and flag sequential scans")
+    parser.add_argument("--rows", type=int, default=20000, help="synthetic rows seeded per table")
+    parser.add_argument("--no-seed", action="store_true", help="explain against the existing data only")
+    args = parser.parse_args()
+
+    flagged = advise(rows=args.rows, seed_data=not args.no_seed)
+    print(f"{'❌' if flagged else '✅'} {len(flagged)} sequential scans on indexed tables")
+    sys.exit(1 if flagged else 0)
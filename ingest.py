@@ -0,0 +1,267 @@
+"""Ingest path for decoded Sigfox uplinks.
+
+`ingest_entry()` is what `/sigfox` calls once a message has been decoded.
+In "sync" mode (the default) the entry is written before the request returns.
+In "batched" mode it is put on a bounded in-process queue and a background
+writer flushes it together with its neighbours, so the callback's latency no
+longer includes a database commit. In "spool" mode every entry is first
+appended to the local crash-safe spool (spool.py) and replayed into the
+database in bulk.
+
+Whatever the mode, an entry that can't be written because the database is
+unreachable (connection, pool) is spooled instead of lost, and while the
+spool still has a backlog new entries queue up behind it so each device's
+uplinks reach the database in order. An entry the database rejects for what
+it contains is moved to the dead-letter log (spool.DeadLetterLog) instead,
+so one bad reading can't hold up the ones after it.
+
+Settings (environment):
+    SGS_INGEST_MODE            sync | batched | spool
+    SGS_INGEST_FLUSH_SIZE      max entries per flush (default 200)
+    SGS_INGEST_FLUSH_INTERVAL  max seconds an entry waits for a flush (default 0.5)
+    SGS_INGEST_QUEUE_CAPACITY  queued entries before callers fall back to a sync write (default 10000)
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+from db import save_entries
+from spool import Spool, SpoolReplayer, DeadLetterLog
+
+INGEST_MODE = os.environ.get("SGS_INGEST_MODE", "sync")
+INGEST_FLUSH_SIZE = int(os.environ.get("SGS_INGEST_FLUSH_SIZE", 200))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("SGS_INGEST_FLUSH_INTERVAL", 0.5))
+INGEST_QUEUE_CAPACITY = int(os.environ.get("SGS_INGEST_QUEUE_CAPACITY", 10000))
+
+# How long a request may block on a full queue before writing synchronously
+ENQUEUE_TIMEOUT = 0.05
+# Attempts per batch before it is handed to the spool
+FLUSH_RETRIES = 3
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Background thread that drains a bounded queue into save_entries()."""
+
+    def __init__(self, flush_size=INGEST_FLUSH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                 capacity=INGEST_QUEUE_CAPACITY, write_batch=save_entries):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.write_batch = write_batch
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'queue_full': 0,
+            'batches_flushed': 0,
+            'rows_flushed': 0,
+            'batches_failed': 0,
+            'rows_rejected': 0,
+            'rows_spooled': 0,
+            'last_flush_seconds': None,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ingest-batch-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, entry, timeout=ENQUEUE_TIMEOUT):
+        """Queue an entry. Returns False if the queue stayed full for `timeout` seconds."""
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put(entry, timeout=timeout)
+        except queue.Full:
+            self._stats['queue_full'] += 1
+            return False
+        self._stats['enqueued'] += 1
+        return True
+
+    def stop(self, timeout=10):
+        """Flush whatever is queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        for attempt in range(FLUSH_RETRIES):
+            outcomes = self.write_batch(batch)
+            # A rejected entry is bisected out; only the ones that failed for database reasons are retried
+            self._stats['rows_flushed'] += sum(outcome == "saved" for outcome, _ in outcomes)
+            rejected = [(entry, error) for entry, (outcome, error) in zip(batch, outcomes) if outcome == "rejected"]
+            if rejected:
+                self._stats['rows_rejected'] += len(rejected)
+                dead_letter(rejected)
+            batch = [entry for entry, (outcome, _) in zip(batch, outcomes) if outcome == "failed"]
+            if not batch:
+                self._stats['batches_flushed'] += 1
+                self._stats['last_flush_seconds'] = round(time.monotonic() - started, 4)
+                return
+            time.sleep(0.5 * (attempt + 1))
+        self._stats['batches_failed'] += 1
+        self._stats['rows_spooled'] += len(batch)
+        print(f"❌ {len(batch)} entries failed {FLUSH_RETRIES} times; spooling them")
+        spool_entries(batch)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'flush_size': self.flush_size,
+            'flush_interval': self.flush_interval,
+            'running': self._thread is not None,
+        })
+        return stats
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """Return the process-wide batch writer, creating it on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = BatchWriter()
+                atexit.register(_writer.stop)
+    return _writer
+
+
+_spool = None
+_replayer = None
+_dead_letters = None
+_spool_lock = threading.Lock()
+
+def get_spool():
+    """Return the process-wide spool, starting its replayer on first use."""
+    global _spool, _replayer
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                spool = Spool()
+                _replayer = SpoolReplayer(spool, dead_letters=get_dead_letters())
+                _replayer.start()
+                atexit.register(_replayer.stop)
+                _spool = spool
+    return _spool
+
+
+def get_dead_letters():
+    """Return the process-wide dead-letter log, creating it on first use."""
+    global _dead_letters
+    if _dead_letters is None:
+        with _writer_lock:
+            if _dead_letters is None:
+                _dead_letters = DeadLetterLog()
+    return _dead_letters
+
+
+def dead_letter(rejected):
+    """Park [(entry, error)] the database rejected."""
+    get_dead_letters().append(rejected)
+    return "rejected"
+
+
+def resume_spool():
+    """At startup: start replaying if a previous run left spooled entries behind."""
+    if INGEST_MODE == "spool" or Spool.has_segments():
+        get_spool()
+
+
+def spool_backlog():
+    return _spool is not None and _spool.has_backlog()
+
+
+def spool_entries(entries):
+    get_spool().append_many(entries)
+    return "spooled"
+
+
+def write_entry(entry):
+    """Write one entry synchronously (one statement, one round trip). Returns (outcome, error) as save_entries."""
+    return save_entries([entry])[0]
+
+
+def ingest_entry(entry):
+    """
+    Persist a decoded uplink according to INGEST_MODE.
+    Returns "queued", "saved", "spooled" or "rejected".
+    """
+    if INGEST_MODE == "spool" or spool_backlog():
+        return spool_entries([entry])
+    if INGEST_MODE == "batched" and get_writer().submit(entry):
+        return "queued"
+    outcome, error = write_entry(entry)
+    if outcome == "rejected":
+        return dead_letter([(entry, error)])
+    if outcome == "saved":
+        return "saved"
+    return spool_entries([entry])
+
+
+def ingest_batch(entries):
+    """
+    Persist many entries in one transaction, leaving out any the database
+    rejects (see db.save_entries). Entries that couldn't be written for
+    database reasons are spooled, rejected ones dead-lettered. Returns one
+    (outcome, error) per entry: "saved", "spooled" or "rejected".
+    """
+    if INGEST_MODE == "spool" or spool_backlog():
+        spool_entries(entries)
+        return [("spooled", None)] * len(entries)
+    outcomes = save_entries(entries)
+    failed = [entry for entry, (outcome, _) in zip(entries, outcomes) if outcome == "failed"]
+    if failed:
+        spool_entries(failed)
+    rejected = [(entry, error) for entry, (outcome, error) in zip(entries, outcomes) if outcome == "rejected"]
+    if rejected:
+        dead_letter(rejected)
+    return [("spooled", None) if outcome == "failed" else (outcome, error) for outcome, error in outcomes]
+
+
+def ingest_stats():
+    return {
+        'mode': INGEST_MODE,
+        'batch_writer': _writer.stats() if _writer is not None else None,
+        'spool': _spool.stats() if _spool is not None else None,
+        'spool_replayer': _replayer.stats() if _replayer is not None else None,
+        'dead_letters': _dead_letters.stats() if _dead_letters is not None else None,
+    }
@@ -0,0 +1,55 @@
+"""Process-local registry of (device_id, sensor_type) pairs already in USER_DEVICE.
+
+The ingest path only needs to run its `INSERT INTO USER_DEVICE ... ON CONFLICT
+DO NOTHING` the first time a device is seen; after that the row exists and the
+statement is a wasted write plus index probe. db.warm_known_devices() fills the
+registry from USER_DEVICE at startup, writers add pairs once their insert has
+committed, and the admin assign/unassign paths invalidate a device so its next
+uplink re-checks the table.
+"""
+
+import threading
+
+
+class KnownDevices:
+    def __init__(self):
+        self._pairs = set()
+        self._lock = threading.Lock()
+        self.warmed = False
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def warm(self, pairs):
+        """Replace the registry contents with `pairs` (e.g. all USER_DEVICE rows)."""
+        with self._lock:
+            self._pairs = set(pairs)
+            self.warmed = True
+
+    def is_known(self, device_id, sensor_type):
+        known = (device_id, sensor_type) in self._pairs
+        self._stats['hits' if known else 'misses'] += 1
+        return known
+
+    def add(self, device_id, sensor_type):
+        with self._lock:
+            self._pairs.add((device_id, sensor_type))
+
+    def add_many(self, pairs):
+        with self._lock:
+            self._pairs.update(pairs)
+
+    def invalidate(self, device_id=None):
+        """Forget one device (every sensor type it was seen with), or everything."""
+        with self._lock:
+            if device_id is None:
+                self._pairs = set()
+            else:
+                self._pairs = {pair for pair in self._pairs if pair[0] != device_id}
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats.update({'size': len(self._pairs), 'warmed': self.warmed})
+        return stats
+
+
+known_devices = KnownDevices()
@@ -0,0 +1,121 @@
+"""Latest decoded state per device.
+
+device_latest_state holds one row per device: the newest successfully
+decoded uplink's values, battery, sequence and timestamp. Statement-level
+triggers on sigfox_raw upsert it from every insert (live ingest, batches,
+bulk loads, spool replay) and from reprocess.py's rewrites of `decoded`. A
+row only replaces the stored one if it is at least as new, so late and
+replayed uplinks don't roll a device back.
+
+The "current status" endpoints read it with one primary-key lookup instead
+of an ORDER BY received_at DESC LIMIT 1 query per device and sensor table.
+"""
+
+# column -> (type, expression over the sigfox_raw row)
+LATEST_STATE_COLUMNS = {
+    "temp_celsius": ("DOUBLE PRECISION", "(decoded->>'temp_celsius')::float"),
+    "pulse_count": ("BIGINT", "(decoded->>'pulse_count')::bigint"),
+    # Booleans as the sensor tables store them: str(True) / str(False)
+    "leak_detected": ("TEXT", "CASE decoded->>'leak_detected' WHEN 'true' THEN 'True' WHEN 'false' THEN 'False' "
+                              "ELSE decoded->>'leak_detected' END"),
+    "water_detected": ("TEXT", "CASE decoded->>'water_detected' WHEN 'true' THEN 'True' WHEN 'false' THEN 'False' "
+                               "ELSE decoded->>'water_detected' END"),
+    "status": ("TEXT", "decoded->>'status'"),
+    "level_percentage": ("INTEGER", "(decoded->>'level_percentage')::int"),
+    "battery_volts": ("DOUBLE PRECISION", "(decoded->>'battery_volts')::float"),
+}
+
+_state_columns = "".join(f"        {column} {sql_type},\n" for column, (sql_type, _) in LATEST_STATE_COLUMNS.items())
+
+latest_state_table = f"""
+    CREATE TABLE IF NOT EXISTS device_latest_state (
+        device_id TEXT PRIMARY KEY,
+        sensor_group TEXT NOT NULL,
+        sequence INTEGER,
+        received_at TIMESTAMP,
+        raw_id BIGINT,
+{_state_columns}        decoded JSONB,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+_COLUMNS = ["sensor_group", "sequence", "received_at", "raw_id", *LATEST_STATE_COLUMNS, "decoded"]
+
+
+def upsert_sql(source):
+    """Upsert the newest decoded row per device of `source` (shaped like sigfox_raw)."""
+    return f"""
+        INSERT INTO device_latest_state AS s (device_id, {', '.join(_COLUMNS)}, updated_at)
+        SELECT DISTINCT ON (device_id)
+            device_id, sensor_group, sequence, received_at, id,
+            {', '.join(expression for _, expression in LATEST_STATE_COLUMNS.values())},
+            decoded, NOW()
+        FROM {source}
+        WHERE device_id IS NOT NULL AND sensor_group IS NOT NULL
+            AND decoded IS NOT NULL AND NOT decoded ? 'error'
+        ORDER BY device_id, received_at DESC NULLS LAST, id DESC
+        ON CONFLICT (device_id) DO UPDATE
+        SET {', '.join(f"{column} = EXCLUDED.{column}" for column in _COLUMNS)}, updated_at = NOW()
+        WHERE s.received_at IS NULL OR EXCLUDED.received_at >= s.received_at
+    """
+
+
+trigger_function_sql = f"""
+    CREATE OR REPLACE FUNCTION device_latest_state_upsert() RETURNS trigger AS $$
+    BEGIN
+        {upsert_sql("new_rows")};
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+# (table, statement); a trigger with a transition table takes a single event, hence two
+LATEST_STATE_TRIGGERS = [
+    ("sigfox_raw", statement)
+    for event in ("insert", "update")
+    for statement in (
+        f"DROP TRIGGER IF EXISTS sigfox_raw_latest_state_{event} ON sigfox_raw",
+        f"""
+        CREATE TRIGGER sigfox_raw_latest_state_{event}
+        AFTER {event.upper()} ON sigfox_raw
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION device_latest_state_upsert()
+        """,
+    )
+]
+
+LATEST_STATE_DDL = [
+    latest_state_table,
+    trigger_function_sql,
+    *(statement for _, statement in LATEST_STATE_TRIGGERS),
+]
+
+
+def fetch_latest_state(cur, device_ids):
+    """{device_id: {column: value, ..., 'received_at': ...}} for the given devices, in one query."""
+    columns = ["sensor_group", "sequence", "received_at", *LATEST_STATE_COLUMNS]
+    cur.execute(f"""
+        SELECT device_id, {', '.join(columns)}
+        FROM device_latest_state
+        WHERE device_id = ANY(%s)
+    """, (list(device_ids),))
+    return {row[0]: dict(zip(columns, row[1:])) for row in cur.fetchall()}
+
+
+def fetch_user_latest_state(cur, user_id):
+    """
+    [(device_id, sensor_type, state or None)] for every device assigned to
+    the user, in one statement: USER_DEVICE joined to device_latest_state.
+    """
+    columns = ["sensor_group", "sequence", "received_at", *LATEST_STATE_COLUMNS]
+    cur.execute(f"""
+        SELECT d.device_id, d.sensor_type, s.device_id IS NOT NULL, {', '.join(f's.{column}' for column in columns)}
+        FROM USER_DEVICE d
+        LEFT JOIN device_latest_state s ON s.device_id = d.device_id
+        WHERE d.user_id = %s
+        ORDER BY d.sensor_type, d.device_id
+    """, (user_id,))
+    return [
+        (row[0], row[1], dict(zip(columns, row[3:])) if row[2] else None)
+        for row in cur.fetchall()
+    ]
@@ -0,0 +1,177 @@
+"""In-process fan-out of committed uplinks to dashboard streams.
+
+The ingest path's commits (db.add_write_listener: live callbacks, the batch
+writer and spool replay) are published to live_hub, which hands each entry
+only to the subscribers of its device: publishing costs one dict lookup
+plus one append per interested stream, whatever the number of other open
+dashboards. A subscriber is a bounded buffer and an Event its stream waits
+on, waking once per heartbeat when idle.
+
+Each open stream holds the WSGI worker that serves it for as long as the
+dashboard is open. Under a threaded server (app.run, gunicorn -k gthread)
+that is one OS thread per dashboard, so the default cap is small. Under
+gevent (gunicorn -k gevent, which monkey-patches threading) the wait is a
+greenlet costing a few KB, and the cap defaults to 1000: that is the
+deployment to use for many dashboards. A sync worker (gunicorn's default)
+would be taken over by a single stream, so streams are refused there and
+the dashboard keeps polling.
+
+A stream that can't keep up (its buffer fills because the client isn't
+reading) is evicted: it gets a final "resync" event and is closed, and the
+browser reconnects and refetches its state. Admin assign/unassign close
+every stream so reconnecting clients subscribe to their new device set.
+
+Settings (environment):
+    SGS_LIVE_MAX_CLIENTS   open streams before new ones get 503 (default 1000 under gevent, else 50)
+    SGS_LIVE_BUFFER        events buffered per stream before eviction (default 100)
+    SGS_LIVE_HEARTBEAT     seconds between keep-alive comments (default 25)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+def cooperative():
+    """True under gevent monkey-patching, where a waiting stream is a greenlet rather than a thread."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def can_stream(environ):
+    """Whether this server can park a worker on a stream without taking a whole process."""
+    return cooperative() or bool(environ.get("wsgi.multithread"))
+
+
+LIVE_MAX_CLIENTS = int(os.environ.get("SGS_LIVE_MAX_CLIENTS", 1000 if cooperative() else 50))
+LIVE_BUFFER = int(os.environ.get("SGS_LIVE_BUFFER", 100))
+LIVE_HEARTBEAT = float(os.environ.get("SGS_LIVE_HEARTBEAT", 25))
+
+# Entry fields sent to the browser
+EVENT_FIELDS = ("device_id", "sensor_group", "sequence", "timestamp", "received_at", "decoded")
+
+
+class Subscriber:
+    def __init__(self, devices, buffer):
+        self.devices = frozenset(devices)
+        self.events = deque()
+        self.buffer = buffer
+        self.wakeup = threading.Event()
+        self.closed = None   # reason, once evicted or disconnected
+
+
+class LiveHub:
+    def __init__(self, max_clients=LIVE_MAX_CLIENTS, buffer=LIVE_BUFFER):
+        self.max_clients = max_clients
+        self.buffer = buffer
+        self._by_device = {}   # device_id -> subscribers
+        self._subscribers = set()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stats = {'subscribed': 0, 'rejected': 0, 'published': 0, 'delivered': 0,
+                       'evicted': 0, 'disconnected': 0}
+
+    def subscribe(self, devices):
+        """A Subscriber for the devices, or None when max_clients streams are open."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                self._stats['rejected'] += 1
+                return None
+            subscriber = Subscriber(devices, self.buffer)
+            self._subscribers.add(subscriber)
+            for device_id in subscriber.devices:
+                self._by_device.setdefault(device_id, set()).add(subscriber)
+            self._stats['subscribed'] += 1
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._remove(subscriber)
+
+    def publish(self, entries):
+        with self._lock:
+            for entry in entries:
+                subscribers = self._by_device.get(entry.get("device_id"))
+                if not subscribers:
+                    continue
+                self._seq += 1
+                event = (self._seq, {field: entry.get(field) for field in EVENT_FIELDS})
+                self._stats['published'] += 1
+                for subscriber in list(subscribers):
+                    if len(subscriber.events) >= subscriber.buffer:
+                        self._close(subscriber, "evicted")
+                        self._stats['evicted'] += 1
+                        continue
+                    subscriber.events.append(event)
+                    subscriber.wakeup.set()
+                    self._stats['delivered'] += 1
+
+    def publish_entries(self, entries):
+        """db write listener."""
+        self.publish(entries)
+
+    def disconnect_all(self, reason="reassigned"):
+        with self._lock:
+            for subscriber in list(self._subscribers):
+                self._close(subscriber, reason)
+                self._stats['disconnected'] += 1
+
+    def wait(self, subscriber, timeout):
+        """Buffered events (possibly none after `timeout` seconds) and the close reason, if any."""
+        subscriber.wakeup.wait(timeout)
+        with self._lock:
+            subscriber.wakeup.clear()
+            events = list(subscriber.events)
+            subscriber.events.clear()
+        return events, subscriber.closed
+
+    def _close(self, subscriber, reason):
+        self._remove(subscriber)
+        # The client refetches everything when it reconnects
+        subscriber.events.clear()
+        subscriber.closed = reason
+        subscriber.wakeup.set()
+
+    def _remove(self, subscriber):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        for device_id in subscriber.devices:
+            subscribers = self._by_device.get(device_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._by_device[device_id]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'clients': len(self._subscribers), 'devices': len(self._by_device),
+                          'max_clients': self.max_clients, 'buffer': self.buffer,
+                          'cooperative': cooperative()})
+        return stats
+
+
+live_hub = LiveHub()
+
+
+def event_stream(subscriber, heartbeat=LIVE_HEARTBEAT):
+    """Server-sent events for a subscriber until it is closed or the client goes away."""
+    try:
+        yield f"retry: 3000\nevent: ready\ndata: {json.dumps(sorted(subscriber.devices))}\n\n"
+        while True:
+            events, closed = live_hub.wait(subscriber, heartbeat)
+            for seq, event in events:
+                yield f"id: {seq}\nevent: reading\ndata: {json.dumps(event, default=str)}\n\n"
+            if closed:
+                yield f"event: resync\ndata: {json.dumps(closed)}\n\n"
+                return
+            if not events:
+                yield f": {int(time.time())}\n\n"
+    finally:
+        live_hub.unsubscribe(subscriber)
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, redirect, url_for, session, jsonify, render_template, flash, get_flashed_messages
+from flask import Blueprint, Response, request, redirect, url_for, session, jsonify, render_template, flash, get_flashed_messages
 from datetime import datetime
 from db import (
     get_db_connection,
@@ -7,9 +7,13 @@ from db import (
     get_device_assignments
 )
 from werkzeug.security import generate_password_hash, check_password_hash
+from known_devices import known_devices
+from latest_state import fetch_user_latest_state
+from charts import temperature_charts, pulse_usage_stats, pulse_usage
+from response_cache import response_cache, cached_view
+from data_versions import user_devices, conditional_view
+from live_updates import live_hub, event_stream, can_stream
 import psycopg2
-from flask import Blueprint, jsonify
-from db import get_db_connection
 
 user_bp = Blueprint("user", __name__)
 app_pages = Blueprint('app_pages', __name__)
@@ -18,14 +22,6 @@ app_secret = "your_secret_key"
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "admin123"
 
-def get_db_connection():
-    return psycopg2.connect(
-        host="localhost",
-        database="SGS_Database",
-        user="postgres",
-        password="123"
-    )
-
 def is_logged_in():
     return session.get('logged_in') is True
 
@@ -218,6 +214,10 @@ def assign_device():
                     """, (device_id, user_id, sensor_type))
                     
                 conn.commit()
+                known_devices.invalidate(device_id)
+                response_cache.clear()
+                user_devices.invalidate()
+        live_hub.disconnect_all()
         flash("Device assigned successfully.", "success")
     except Exception as e:
         flash(f"Assignment failed: {e}", "error")
@@ -235,6 +235,10 @@ def unassign_device(device_id):
             with conn.cursor() as cur:
                 cur.execute("UPDATE USER_DEVICE SET user_id = NULL WHERE device_id = %s", (device_id,))
                 conn.commit()
+                known_devices.invalidate(device_id)
+                response_cache.clear()
+                user_devices.invalidate()
+        live_hub.disconnect_all()
         flash("Device unassigned.", "success")
     except Exception as e:
         flash(f"Unassignment failed: {e}", "error")
@@ -243,6 +247,7 @@ def unassign_device(device_id):
 
 # FIXED: Enhanced API endpoint with better error handling and null checks
 @app_pages.route('/api/user/data')
+@conditional_view(per_user=True)
 def api_user_data():
     print("🔍 API /api/user/data called")
     
@@ -260,13 +265,8 @@ def api_user_data():
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                # Get user device assignments with better error handling
-                cur.execute("""
-                    SELECT device_id, sensor_type
-                    FROM USER_DEVICE
-                    WHERE user_id = %s AND user_id IS NOT NULL
-                """, (user_id,))
-                assignments = cur.fetchall()
+                # Assignments and their latest state in one statement
+                assignments = fetch_user_latest_state(cur, user_id)
                 
                 print(f"📱 Found {len(assignments)} device assignments")
 
@@ -279,127 +279,64 @@ def api_user_data():
                     "last_updated": datetime.now().isoformat()
                 }
 
-                for device_id, sensor_type in assignments:
-                    print(f"🔍 Processing device {device_id} of type {sensor_type}")
-                    
-                    try:
-                        if sensor_type == "decode_PowerTemp":
-                            cur.execute("""
-                                SELECT device_id, temp_celsius, received_at
-                                FROM PWR_TEMP
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            temp_row = cur.fetchone()
-                            
-                            if temp_row and temp_row[1] is not None:
-                                data["temperature_sensors"].append({
-                                    "device_id": temp_row[0],
-                                    "temp_celsius": float(temp_row[1]),
-                                    "received_at": temp_row[2].isoformat() if temp_row[2] else None
-                                })
-                                print(f"✅ Added temperature sensor data: {temp_row[1]}°C")
-                            else:
-                                print(f"⚠️ No temperature data found for device {device_id}")
-
-                        elif sensor_type == "decode_pulsemeter":
-                            cur.execute("""
-                                SELECT device_id, pulse_count, leak_detected, received_at
-                                FROM PULSE_DETECTOR
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            pulse_row = cur.fetchone()
-                            
-                            if pulse_row:
-                                data["pulse_meters"].append({
-                                    "device_id": pulse_row[0],
-                                    "pulse_count": int(pulse_row[1]) if pulse_row[1] is not None else 0,
-                                    "leak_detected": str(pulse_row[2]) if pulse_row[2] is not None else "False",
-                                    "received_at": pulse_row[3].isoformat() if pulse_row[3] else None
-                                })
-                                print(f"✅ Added pulse meter data: {pulse_row[1]} pulses")
-                            else:
-                                print(f"⚠️ No pulse data found for device {device_id}")
-
-                        elif sensor_type == "decode_water_sensor":
-                            cur.execute("""
-                                SELECT device_id, water_detected, received_at
-                                FROM WATER_DETECTOR
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            water_row = cur.fetchone()
-                            
-                            if water_row:
-                                data["water_sensors"].append({
-                                    "device_id": water_row[0],
-                                    "water_detected": str(water_row[1]) if water_row[1] is not None else "False",
-                                    "received_at": water_row[2].isoformat() if water_row[2] else None
-                                })
-                                print(f"✅ Added water sensor data: {water_row[1]}")
-                            else:
-                                print(f"⚠️ No water data found for device {device_id}")
-
-                        # Add this debugging and fix to your /api/user/data route
-# Replace the existing door sensor section with this improved version:
-
-                        elif sensor_type == "decode_magnetic_sensor":
-                            print(f"🚪 Processing door sensor for device {device_id}")
-                            cur.execute("""
-                                SELECT device_id, status, received_at
-                                FROM MAGNETIC
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            door_row = cur.fetchone()
-                            
-                            if door_row:
-                                # Debug the actual values
-                                print(f"🚪 Door sensor raw data: device={door_row[0]}, status='{door_row[1]}', time={door_row[2]}")
-                                
-                                # Clean and normalize the status value
-                                raw_status = door_row[1]
-                                if raw_status is not None:
-                                    # Convert to string and clean whitespace
-                                    status_str = str(raw_status).strip().lower()
-                                    # Normalize different possible values
-                                    if status_str in ['open', '1', 'true', 'opened']:
-                                        normalized_status = 'open'
-                                    elif status_str in ['closed', '0', 'false', 'close']:
-                                        normalized_status = 'closed'
-                                    else:
-                                        normalized_status = status_str  # Keep original if unclear
+                for device_id, sensor_type, state in assignments:
+                    received_at = state["received_at"].isoformat() if state and state["received_at"] else None
+
+                    if sensor_type == "decode_PowerTemp":
+                        if state and state["temp_celsius"] is not None:
+                            data["temperature_sensors"].append({
+                                "device_id": device_id,
+                                "temp_celsius": float(state["temp_celsius"]),
+                                "received_at": received_at
+                            })
+
+                    elif sensor_type == "decode_pulsemeter":
+                        if state:
+                            data["pulse_meters"].append({
+                                "device_id": device_id,
+                                "pulse_count": int(state["pulse_count"]) if state["pulse_count"] is not None else 0,
+                                "leak_detected": str(state["leak_detected"]) if state["leak_detected"] is not None else "False",
+                                "received_at": received_at
+                            })
+
+                    elif sensor_type == "decode_water_sensor":
+                        if state:
+                            data["water_sensors"].append({
+                                "device_id": device_id,
+                                "water_detected": str(state["water_detected"]) if state["water_detected"] is not None else "False",
+                                "received_at": received_at
+                            })
+
+                    elif sensor_type == "decode_magnetic_sensor":
+                        if state:
+                            # Clean and normalize the status value
+                            raw_status = state["status"]
+                            if raw_status is not None:
+                                status_str = str(raw_status).strip().lower()
+                                if status_str in ['open', '1', 'true', 'opened']:
+                                    normalized_status = 'open'
+                                elif status_str in ['closed', '0', 'false', 'close']:
+                                    normalized_status = 'closed'
                                 else:
-                                    normalized_status = 'unknown'
-                                
-                                print(f"🚪 Normalized door status: '{normalized_status}'")
-                                
-                                data["door_sensors"].append({
-                                    "device_id": door_row[0],
-                                    "status": normalized_status,
-                                    "received_at": door_row[2].isoformat() if door_row[2] else None
-                                })
-                                print(f"✅ Added door sensor data: {normalized_status}")
+                                    normalized_status = status_str  # Keep original if unclear
                             else:
-                                print(f"⚠️ No door data found for device {device_id}")
-                                # Add a placeholder with unknown status
-                                data["door_sensors"].append({
-                                    "device_id": device_id,
-                                    "status": "no_data",
-                                    "received_at": None
-                                })
-                        
+                                normalized_status = 'unknown'
+
+                            data["door_sensors"].append({
+                                "device_id": device_id,
+                                "status": normalized_status,
+                                "received_at": received_at
+                            })
                         else:
-                            print(f"⚠️ Unknown sensor type: {sensor_type}")
-                            
-                    except Exception as sensor_error:
-                        print(f"❌ Error processing sensor {sensor_type} for device {device_id}: {sensor_error}")
-                        continue
+                            # Add a placeholder with unknown status
+                            data["door_sensors"].append({
+                                "device_id": device_id,
+                                "status": "no_data",
+                                "received_at": None
+                            })
+
+                    else:
+                        print(f"⚠️ Unknown sensor type: {sensor_type}")
 
                 print(f"✅ Returning data with {len(data['temperature_sensors'])} temp, {len(data['pulse_meters'])} pulse, {len(data['water_sensors'])} water, {len(data['door_sensors'])} door sensors")
                 return jsonify(data)
@@ -412,6 +349,7 @@ def api_user_data():
 
 # FIXED: Enhanced devices endpoint with better null handling
 @app_pages.route('/api/user/devices')
+@conditional_view(per_user=True)
 def api_user_devices():
     print("🔍 API /api/user/devices called")
     
@@ -425,18 +363,12 @@ def api_user_devices():
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                # Simplified query to avoid complex CASE statements that might fail
-                cur.execute("""
-                    SELECT device_id, sensor_type
-                    FROM USER_DEVICE
-                    WHERE user_id = %s
-                    ORDER BY sensor_type, device_id
-                """, (user_id,))
-                devices = cur.fetchall()
+                # Assignments and their latest state in one statement
+                devices = fetch_user_latest_state(cur, user_id)
                 
                 result = []
                 
-                for device_id, sensor_type in devices:
+                for device_id, sensor_type, state in devices:
                     device_info = {
                         "device_id": device_id,
                         "sensor_type": sensor_type,
@@ -444,76 +376,39 @@ def api_user_devices():
                         "last_reading": "No Data",
                         "last_updated": None
                     }
+                    last_updated = state["received_at"].isoformat() if state and state["received_at"] else None
                     
-                    try:
-                        # Get data based on sensor type
-                        if sensor_type == "decode_PowerTemp":
-                            cur.execute("""
-                                SELECT temp_celsius, received_at
-                                FROM PWR_TEMP
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            row = cur.fetchone()
-                            if row and row[0] is not None:
-                                device_info.update({
-                                    "last_value": f"{float(row[0]):.1f}°C",
-                                    "last_reading": "Temperature",
-                                    "last_updated": row[1].isoformat() if row[1] else None
-                                })
-                                
-                        elif sensor_type == "decode_pulsemeter":
-                            cur.execute("""
-                                SELECT pulse_count, received_at
-                                FROM PULSE_DETECTOR
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            row = cur.fetchone()
-                            if row:
-                                device_info.update({
-                                    "last_value": str(int(row[0])) if row[0] is not None else "0",
-                                    "last_reading": "Pulse Count",
-                                    "last_updated": row[1].isoformat() if row[1] else None
-                                })
-                                
-                        elif sensor_type == "decode_water_sensor":
-                            cur.execute("""
-                                SELECT water_detected, received_at
-                                FROM WATER_DETECTOR
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            row = cur.fetchone()
-                            if row:
-                                device_info.update({
-                                    "last_value": str(row[0]) if row[0] is not None else "False",
-                                    "last_reading": "Water Detected",
-                                    "last_updated": row[1].isoformat() if row[1] else None
-                                })
-                                
-                        elif sensor_type == "decode_magnetic_sensor":
-                            cur.execute("""
-                                SELECT status, received_at
-                                FROM MAGNETIC
-                                WHERE device_id = %s
-                                ORDER BY received_at DESC
-                                LIMIT 1
-                            """, (device_id,))
-                            row = cur.fetchone()
-                            if row:
-                                device_info.update({
-                                    "last_value": str(row[0]) if row[0] is not None else "Unknown",
-                                    "last_reading": "Door Status",
-                                    "last_updated": row[1].isoformat() if row[1] else None
-                                })
-                    
-                    except Exception as device_error:
-                        print(f"❌ Error fetching data for device {device_id}: {device_error}")
-                        # Keep default values set above
+                    if sensor_type == "decode_PowerTemp":
+                        if state and state["temp_celsius"] is not None:
+                            device_info.update({
+                                "last_value": f"{float(state['temp_celsius']):.1f}°C",
+                                "last_reading": "Temperature",
+                                "last_updated": last_updated
+                            })
+                            
+                    elif sensor_type == "decode_pulsemeter":
+                        if state:
+                            device_info.update({
+                                "last_value": str(int(state["pulse_count"])) if state["pulse_count"] is not None else "0",
+                                "last_reading": "Pulse Count",
+                                "last_updated": last_updated
+                            })
+                            
+                    elif sensor_type == "decode_water_sensor":
+                        if state:
+                            device_info.update({
+                                "last_value": str(state["water_detected"]) if state["water_detected"] is not None else "False",
+                                "last_reading": "Water Detected",
+                                "last_updated": last_updated
+                            })
+                            
+                    elif sensor_type == "decode_magnetic_sensor":
+                        if state:
+                            device_info.update({
+                                "last_value": str(state["status"]) if state["status"] is not None else "Unknown",
+                                "last_reading": "Door Status",
+                                "last_updated": last_updated
+                            })
                     
                     result.append(device_info)
                     
@@ -528,6 +423,10 @@ def api_user_devices():
 
 # FIXED: Chart data endpoint with better error handling
 @app_pages.route('/api/user/usage')
+@conditional_view(per_user=True)
+@cached_view('api_user_chart_data', 'decode_pulsemeter', per_user=True,
+             device=lambda: session.get('device_id'),
+             depends=lambda body: [body['device_id']] if body.get('device_id') else [])
 def api_user_chart_data():
     print("🔍 API /api/user/usage called")
     
@@ -585,15 +484,7 @@ def api_user_chart_data():
         with get_db_connection() as conn:
             with conn.cursor() as cur:
                 # Check if device exists and has data first
-                cur.execute("""
-                    SELECT COUNT(*) as total_records,
-                           MIN(received_at) as earliest,
-                           MAX(received_at) as latest
-                    FROM PULSE_DETECTOR 
-                    WHERE device_id = %s
-                """, (device_id,))
-                
-                stats = cur.fetchone()
+                stats = pulse_usage_stats(cur, device_id)
                 total_records = stats[0] if stats else 0
                 
                 print(f"📊 Device {device_id} has {total_records} total records")
@@ -606,45 +497,16 @@ def api_user_chart_data():
                         "total_records": 0
                     })
                 
-                # Define time configurations
+                # Define time configurations: (rollup bucket, window)
                 time_configs = {
-                    "Daily": {
-                        "trunc": "DATE_TRUNC('hour', received_at)",
-                        "where": "received_at >= NOW() - INTERVAL '1 day'",
-                        "format_key": "hour"
-                    },
-                    "Weekly": {
-                        "trunc": "DATE_TRUNC('day', received_at)",
-                        "where": "received_at >= NOW() - INTERVAL '7 days'",
-                        "format_key": "day"
-                    },
-                    "Monthly": {
-                        "trunc": "DATE_TRUNC('day', received_at)",
-                        "where": "received_at >= NOW() - INTERVAL '30 days'",
-                        "format_key": "day"
-                    },
-                    "All": {
-                        "trunc": "DATE_TRUNC('day', received_at)",
-                        "where": "1=1",
-                        "format_key": "day"
-                    }
+                    "Daily": ("hour", "1 day"),
+                    "Weekly": ("day", "7 days"),
+                    "Monthly": ("day", "30 days"),
+                    "All": ("day", None)
                 }
                 
-                config = time_configs.get(period, time_configs["Weekly"])
-                
-                query = f"""
-                    SELECT {config['trunc']} AS interval, 
-                           COALESCE(SUM(pulse_count), 0) as total_pulses
-                    FROM PULSE_DETECTOR
-                    WHERE device_id = %s AND {config['where']}
-                    GROUP BY interval
-                    ORDER BY interval ASC
-                """
-                
-                print(f"🔍 Executing query: {query}")
-                
-                cur.execute(query, (device_id,))
-                rows = cur.fetchall()
+                unit, interval = time_configs.get(period, time_configs["Weekly"])
+                rows = pulse_usage(cur, device_id, unit, interval)
                 
                 print(f"📊 Query returned {len(rows)} rows")
                 
@@ -699,6 +561,9 @@ def api_user_chart_data():
         }), 500
 
 @app_pages.route('/api/user/temperature')
+@conditional_view(per_user=True)
+@cached_view('api_user_temperature', 'decode_PowerTemp', per_user=True, device=lambda: None,
+             depends=lambda body: body['charts'].keys())
 def api_user_temperature():
     if not is_logged_in() or session.get('role') != 'user':
         return jsonify({"error": "Unauthorized"}), 403
@@ -708,88 +573,44 @@ def api_user_temperature():
 
     time_configs = {
         "Daily": {
-            "trunc": "DATE_TRUNC('hour', received_at)",
-            "where": "received_at >= NOW() - INTERVAL '1 day'",
+            "unit": "hour",
+            "interval": "1 day",
             "format": "%H:%M"
         },
         "Weekly": {
-            "trunc": "DATE_TRUNC('day', received_at)",
-            "where": "received_at >= NOW() - INTERVAL '7 days'",
+            "unit": "day",
+            "interval": "7 days",
             "format": "%m-%d"
         },
         "Monthly": {
-            "trunc": "DATE_TRUNC('day', received_at)",
-            "where": "received_at >= NOW() - INTERVAL '30 days'",
+            "unit": "day",
+            "interval": "30 days",
             "format": "%m-%d"
         },
         "All": {
-            "trunc": "DATE_TRUNC('day', received_at)",
-            "where": "1=1",
+            "unit": "day",
+            "interval": None,
             "format": "%Y-%m-%d"
         }
     }
 
     config = time_configs.get(period, time_configs["Weekly"])
 
+    def rounded(values):
+        return [round(value, 1) if value is not None else None for value in values]
+
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
-                # Get all assigned temperature devices
-                cur.execute("""
-                    SELECT device_id 
-                    FROM USER_DEVICE 
-                    WHERE user_id = %s AND sensor_type = 'decode_PowerTemp'
-                """, (user_id,))
-                devices = cur.fetchall()
-
-                if not devices:
-                    return jsonify({"charts": {}})
-
+                # Series and stats of all assigned temperature devices in one query
                 charts = {}
-
-                for (device_id,) in devices:
-                    # Time series data
-                    cur.execute(f"""
-                        SELECT {config['trunc']} AS interval, 
-                               AVG(temp_celsius) as avg_temp,
-                               MAX(temp_celsius) as max_temp,
-                               MIN(temp_celsius) as min_temp
-                        FROM PWR_TEMP
-                        WHERE device_id = %s AND {config['where']}
-                        GROUP BY interval
-                        ORDER BY interval
-                    """, (device_id,))
-                    rows = cur.fetchall()
-
-                    labels = []
-                    avg_values = []
-                    max_values = []
-                    min_values = []
-
-                    for row in rows:
-                        time_val, avg_temp, max_temp, min_temp = row
-                        labels.append(time_val.strftime(config['format']))
-                        avg_values.append(round(avg_temp, 1) if avg_temp is not None else None)
-                        max_values.append(round(max_temp, 1) if max_temp is not None else None)
-                        min_values.append(round(min_temp, 1) if min_temp is not None else None)
-
-                    # Stats: avg, max, min
-                    cur.execute(f"""
-                        SELECT 
-                            AVG(temp_celsius),
-                            MAX(temp_celsius),
-                            MIN(temp_celsius)
-                        FROM PWR_TEMP
-                        WHERE device_id = %s AND {config['where']}
-                    """, (device_id,))
-                    stat_row = cur.fetchone()
-                    avg_val, max_val, min_val = stat_row
-
+                for device_id, chart in temperature_charts(cur, config['unit'], config['interval'], user_id=user_id).items():
+                    avg_val, max_val, min_val = chart.stats
                     charts[device_id] = {
-                        "labels": labels,
-                        "avg_temperatures": avg_values,
-                        "max_temperatures": max_values,
-                        "min_temperatures": min_values,
+                        "labels": [bucket.strftime(config['format']) for bucket in chart.buckets],
+                        "avg_temperatures": rounded(chart.avg),
+                        "max_temperatures": rounded(chart.max),
+                        "min_temperatures": rounded(chart.min),
                         "avg": round(avg_val, 1) if avg_val is not None else "--",
                         "max": round(max_val, 1) if max_val is not None else "--",
                         "min": round(min_val, 1) if min_val is not None else "--",
@@ -802,3 +623,25 @@ def api_user_temperature():
         import traceback
         traceback.print_exc()
         return jsonify({"error": "Internal Server Error", "details": str(e)}), 500
+
+@app_pages.route('/api/user/stream')
+def api_user_stream():
+    """Server-sent events with each new uplink of the user's devices (see live_updates)"""
+    if not is_logged_in() or session.get('role') != 'user':
+        return jsonify({"error": "Unauthorized"}), 403
+
+    if not can_stream(request.environ):
+        # A single-threaded worker would be held by this stream alone; the dashboard polls instead
+        return jsonify({"error": "Live streams need a threaded or gevent server"}), 503
+
+    devices = user_devices.devices_of(session.get('user_id'))
+    if devices is None:
+        return jsonify({"error": "Device list unavailable"}), 503
+
+    subscriber = live_hub.subscribe(devices)
+    if subscriber is None:
+        # The dashboard falls back to polling
+        return jsonify({"error": "Too many live streams"}), 503
+
+    return Response(event_stream(subscriber), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,236 @@
+"""Monthly range partitioning on received_at, with retention.
+
+convert() turns a plain sensor table (or sigfox_raw) into a table
+partitioned by month on received_at, in one transaction per table: the rows
+are copied into a new partitioned parent, which then takes over the name,
+the id sequence, and the read-path indexes and triggers from schema.py.
+Rows with a NULL or out-of-range received_at live in the <table>_default
+partition.
+
+maintain() keeps SGS_PARTITION_PREMAKE_MONTHS months of partitions ready
+ahead of time and, when SGS_RETENTION_MONTHS is set, drops whole partitions
+older than that (after writing them to SGS_ARCHIVE_DIR as gzipped CSV, if
+set) instead of running huge DELETEs. app.py runs it at startup; run it from
+cron as well. Both take PARTITION_LOCK_KEY for each table's transaction, so
+workers starting together and cron never reshape the same table at once:
+
+    python partitioning.py convert              convert every table (locks each while it copies)
+    python partitioning.py convert --table PWR_TEMP
+    python partitioning.py maintain             pre-create partitions, apply retention
+    python partitioning.py status
+
+Partitioned parents can't have a primary key on a nullable column, so id is
+kept unique together with received_at: UNIQUE (id, received_at).
+
+The dashboard's "received_at >= NOW() - INTERVAL ..." windows are pruned to
+the one or two newest partitions at execution time.
+"""
+
+import argparse
+import gzip
+import os
+from datetime import date, datetime
+
+from db import get_db_connection, sensor_rows
+from schema import READ_PATH_INDEXES, TABLE_TRIGGERS
+
+PARTITION_PREMAKE_MONTHS = int(os.environ.get("SGS_PARTITION_PREMAKE_MONTHS", 3))
+RETENTION_MONTHS = int(os.environ.get("SGS_RETENTION_MONTHS", 0))   # 0 = keep everything
+ARCHIVE_DIR = os.environ.get("SGS_ARCHIVE_DIR")
+
+# Arbitrary key for pg_advisory_xact_lock so concurrent maintain/convert runs take turns
+PARTITION_LOCK_KEY = 0x5165_0002
+
+PARTITIONED_TABLES = [table for table, _, _ in sensor_rows.values()] + ["sigfox_raw"]
+
+# Unique constraints to recreate on the partitioned parent (all include the partition key)
+UNIQUE_KEYS = {table: [("id", "received_at"), ("device_id", "sequence", "received_at")]
+               for table, _, _ in sensor_rows.values()}
+UNIQUE_KEYS["sigfox_raw"] = [("id", "received_at")]
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table.lower()}_p{month:%Y%m}"
+
+
+def default_partition(table):
+    return f"{table.lower()}_default"
+
+
+def is_partitioned(cur, table):
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = %s
+        )
+    """, (table.lower(),))
+    return cur.fetchone()[0]
+
+
+def list_partitions(cur, table):
+    """Month partitions of a table as {month: partition name}."""
+    cur.execute("""
+        SELECT child.relname
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = %s
+    """, (table.lower(),))
+    prefix = f"{table.lower()}_p"
+    partitions = {}
+    for (name,) in cur.fetchall():
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions[date(int(suffix[:4]), int(suffix[4:]), 1)] = name
+    return partitions
+
+
+def create_partition(cur, table, month):
+    """Create the partition for `month`, moving matching rows out of the default partition first."""
+    name = partition_name(table, month)
+    start, end = month, add_months(month, 1)
+    default = default_partition(table)
+
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE received_at >= %s AND received_at < %s)", (start, end))
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", (start, end))
+        return name
+
+    # Postgres refuses a new partition whose range already has rows in the default one.
+    # The rows go straight into the partition so the parent's rollup triggers don't count them twice.
+    cur.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+    cur.execute(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", (start, end))
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {default} WHERE received_at >= %s AND received_at < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    moved = cur.rowcount
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+    print(f"ℹ️ {name}: moved {moved} rows out of {default}")
+    return name
+
+
+def convert(table):
+    """Convert one table to monthly partitions. Returns False if it already was partitioned."""
+    staging = f"{table.lower()}_partitioned"
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_KEY,))
+            if is_partitioned(cur, table):
+                print(f"ℹ️ {table} is already partitioned")
+                return False
+
+            cur.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+            cur.execute(f"SELECT MIN(received_at), COUNT(*) FROM {table}")
+            earliest, count = cur.fetchone()
+
+            cur.execute(f"CREATE TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE (received_at)")
+            cur.execute(f"CREATE TABLE {default_partition(table)} PARTITION OF {staging} DEFAULT")
+            first = month_start(earliest or datetime.now())
+            last = add_months(month_start(datetime.now()), PARTITION_PREMAKE_MONTHS)
+            month = first
+            while month <= last:
+                cur.execute(
+                    f"CREATE TABLE {partition_name(table, month)} PARTITION OF {staging} FOR VALUES FROM (%s) TO (%s)",
+                    (month, add_months(month, 1))
+                )
+                month = add_months(month, 1)
+
+            cur.execute(f"INSERT INTO {staging} SELECT * FROM {table}")
+
+            # The id sequence belongs to the old table; hand it over before dropping that
+            cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table.lower(),))
+            sequence = cur.fetchone()[0]
+            if sequence:
+                cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {staging}.id")
+            cur.execute(f"DROP TABLE {table}")
+            cur.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+
+            for columns in UNIQUE_KEYS[table]:
+                cur.execute(f"ALTER TABLE {table} ADD UNIQUE ({', '.join(columns)})")
+            for owner, statement in READ_PATH_INDEXES + TABLE_TRIGGERS:
+                if owner == table:
+                    cur.execute(statement)
+            conn.commit()
+
+    print(f"✅ {table}: {count} rows moved into monthly partitions from {first:%Y-%m} to {last:%Y-%m}")
+    return True
+
+
+def archive_partition(cur, name, archive_dir=ARCHIVE_DIR):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+    return path
+
+
+def maintain(premake_months=PARTITION_PREMAKE_MONTHS, retention_months=RETENTION_MONTHS, archive_dir=ARCHIVE_DIR):
+    """Pre-create future partitions and drop (optionally archive) expired ones on every partitioned table."""
+    this_month = month_start(datetime.now())
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            for table in PARTITIONED_TABLES:
+                # Another process may have just created or dropped partitions: look only once it's done
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_KEY,))
+                if not is_partitioned(cur, table):
+                    conn.commit()
+                    continue
+                partitions = list_partitions(cur, table)
+
+                for ahead in range(premake_months + 1):
+                    month = add_months(this_month, ahead)
+                    if month not in partitions:
+                        print(f"✅ Created partition {create_partition(cur, table, month)}")
+
+                if retention_months > 0:
+                    cutoff = add_months(this_month, -retention_months)
+                    for month, name in sorted(partitions.items()):
+                        if month >= cutoff:
+                            continue
+                        if archive_dir:
+                            print(f"📦 Archived {name} to {archive_partition(cur, name, archive_dir)}")
+                        cur.execute(f"DROP TABLE {name}")
+                        print(f"🗑️ Dropped expired partition {name}")
+                conn.commit()
+
+
+def print_status():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(cur, table):
+                    print(f"{table:<16} not partitioned")
+                    continue
+                months = sorted(list_partitions(cur, table))
+                span = f"{months[0]:%Y-%m} .. {months[-1]:%Y-%m}" if months else "no month partitions"
+                cur.execute(f"SELECT COUNT(*) FROM {default_partition(table)}")
+                print(f"{table:<16} {len(months):>3} partitions, {span}, {cur.fetchone()[0]} rows in default")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the sensor tables and sigfox_raw")
+    parser.add_argument("command", choices=["convert", "maintain", "status"])
+    parser.add_argument("--table", choices=PARTITIONED_TABLES, help="convert only this table")
+    parser.add_argument("--retention-months", type=int, default=RETENTION_MONTHS, help="drop partitions older than this (0 = never)")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="write expired partitions here as .csv.gz before dropping")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        for table in [args.table] if args.table else PARTITIONED_TABLES:
+            convert(table)
+    elif args.command == "maintain":
+        maintain(retention_months=args.retention_months, archive_dir=args.archive_dir)
+    else:
+        print_status()
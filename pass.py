@@ -1,7 +1,8 @@
 """Utility script to hash plaintext passwords and update Users table.
 
 Purpose:
-- Connects to the local PostgreSQL database (SGS_Database).
+- Connects to the local PostgreSQL database (SGS_Database) through the
+  shared connection pool in db.py.
 - Generates Werkzeug password hashes from plaintext values.
 - Updates the Users.password field for specified emails.
 
@@ -18,9 +19,9 @@ Security notes:
 """
 
 from werkzeug.security import generate_password_hash
-import psycopg2
+from db import get_db_connection
 
-conn = psycopg2.connect(host='127.0.0.1', database='SGS_Database', user='postgres', password='123')
+conn = get_db_connection()
 cur = conn.cursor()
 
 raw = '123'  # change to the raw password you want the user to use
@@ -0,0 +1,244 @@
+"""Re-decode stored uplinks with the current decoders and backfill the sensor tables.
+
+After a decoder fix, historical rows keep the old interpretation. This job
+walks sigfox_raw in id order with keyset pagination (optionally restricted to
+some devices and a received_at range), re-runs the decoders across a process
+pool and, for every row whose decoding changed, rewrites sigfox_raw.decoded
+and upserts the typed row (keyed on device_id, sequence, received_at).
+
+Chunks are written in order, each in one transaction together with its
+checkpoint in reprocess_progress, so an interrupted job resumes after the last
+committed chunk:
+
+    python reprocess.py --job fix-pulse-9byte --device 1fc74ab --since 2025-01-01
+    python reprocess.py --workers 8 --chunk-size 20000
+    python reprocess.py --job fix-pulse-9byte --restart
+
+Rows of devices with no decoder assigned are left untouched. When the job
+has rewritten anything, in this run or an earlier interrupted one, the
+hourly/daily rollups of the same range are rebuilt at the end.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app import get_decoder_by_device
+from db import get_db_connection, sensor_rows
+from decoder_registry import decoder_registry
+from decoders import decode_water_sensor
+from rollups import reconcile
+from psycopg2.extras import execute_values
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_WORKERS = os.cpu_count() or 2
+
+RAW_COLUMNS = "id, device_id, sequence, raw_payload, decoded, sensor_group, received_at"
+
+
+def redecode_rows(rows):
+    """
+    Worker: re-decode one chunk of sigfox_raw rows. Returns
+    (id, device_id, sequence, received_at, sensor_group, decoded) for the rows
+    whose decoding or sensor group changed.
+    """
+    changed = []
+    for raw_id, device_id, sequence, raw_payload, decoded, sensor_group, received_at in rows:
+        decoder = get_decoder_by_device(device_id or "")
+        if decoder is None:
+            continue
+        if decoder is decode_water_sensor:
+            # Keep the decode time recorded at ingest instead of "now"
+            fresh = decoder(raw_payload, (decoded or {}).get('timestamp'))
+        else:
+            fresh = decoder(raw_payload)
+        if fresh != decoded or decoder.__name__ != sensor_group:
+            changed.append((raw_id, device_id, sequence, received_at, decoder.__name__, fresh))
+    return changed
+
+
+def fetch_chunk(cur, after_id, chunk_size, devices=None, since=None, until=None):
+    conditions = ["id > %s"]
+    params = [after_id]
+    if devices:
+        conditions.append("device_id = ANY(%s)")
+        params.append(list(devices))
+    if since:
+        conditions.append("received_at >= %s")
+        params.append(since)
+    if until:
+        conditions.append("received_at < %s")
+        params.append(until)
+    params.append(chunk_size)
+    cur.execute(f"""
+        SELECT {RAW_COLUMNS}
+        FROM sigfox_raw
+        WHERE {' AND '.join(conditions)}
+        ORDER BY id
+        LIMIT %s
+    """, params)
+    return cur.fetchall()
+
+
+def write_changes(cur, changed):
+    """Rewrite sigfox_raw.decoded and upsert the typed rows for one chunk. Returns typed rows written."""
+    if not changed:
+        return 0
+
+    execute_values(cur, """
+        UPDATE sigfox_raw AS r
+        SET decoded = v.decoded::jsonb, sensor_group = v.sensor_group
+        FROM (VALUES %s) AS v (id, decoded, sensor_group)
+        WHERE r.id = v.id
+    """, [(raw_id, json.dumps(decoded), group) for raw_id, _, _, _, group, decoded in changed],
+        page_size=len(changed))
+
+    # ON CONFLICT DO UPDATE may touch a row only once per statement: keep the
+    # newest uplink for each key
+    typed_rows = {}
+    for _, device_id, sequence, received_at, group, decoded in changed:
+        spec = sensor_rows.get(group)
+        if spec and 'error' not in decoded:
+            typed_rows.setdefault(group, {})[(device_id, sequence, received_at)] = spec[2](decoded)
+
+    written = 0
+    for group, rows in typed_rows.items():
+        table, columns, _ = sensor_rows[group]
+        execute_values(cur, f"""
+            INSERT INTO {table} (device_id, sequence, {", ".join(columns)}, received_at)
+            VALUES %s
+            ON CONFLICT (device_id, sequence, received_at) DO UPDATE
+            SET {", ".join(f"{column} = EXCLUDED.{column}" for column in columns)}
+        """, [(device_id, sequence) + values + (received_at,)
+              for (device_id, sequence, received_at), values in rows.items()],
+            page_size=len(rows))
+        written += len(rows)
+    return written
+
+
+def get_progress(job):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT last_id FROM reprocess_progress WHERE job = %s", (job,))
+            row = cur.fetchone()
+            return row[0] if row else 0
+
+
+def get_rewritten(job):
+    """Rows the job has rewritten over all its runs."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT rows_rewritten FROM reprocess_progress WHERE job = %s", (job,))
+            row = cur.fetchone()
+            return row[0] if row else 0
+
+
+def reset_progress(job):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM reprocess_progress WHERE job = %s", (job,))
+            conn.commit()
+
+
+def reprocess(job="reprocess", devices=None, since=None, until=None,
+              chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS, restart=False):
+    if restart:
+        reset_progress(job)
+    last_id = get_progress(job)
+    if last_id:
+        print(f"ℹ️ Resuming job {job} after sigfox_raw id {last_id}")
+
+    # Load the device -> decoder mapping before the pool starts so forked
+    # workers inherit it instead of each querying the database
+    decoder_registry.load()
+
+    started = time.monotonic()
+    scanned = rewritten = typed = 0
+
+    def chunks():
+        # Keyset pagination: each page starts after the last id of the previous one
+        after = last_id
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                while True:
+                    rows = fetch_chunk(cur, after, chunk_size, devices, since, until)
+                    conn.rollback()  # don't sit idle in transaction between pages
+                    if not rows:
+                        return
+                    after = rows[-1][0]
+                    yield rows
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        source = chunks()
+
+        def submit_next():
+            rows = next(source, None)
+            if rows is None:
+                return False
+            in_flight.append((rows[-1][0], len(rows), executor.submit(redecode_rows, rows)))
+            return True
+
+        while len(in_flight) < workers * 2 and submit_next():
+            pass
+
+        # Results are written in submission order so the checkpoint never skips a chunk
+        while in_flight:
+            chunk_last_id, count, future = in_flight.popleft()
+            changed = future.result()
+            submit_next()
+
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    typed += write_changes(cur, changed)
+                    cur.execute("""
+                        INSERT INTO reprocess_progress (job, last_id, rows_scanned, rows_rewritten, updated_at)
+                        VALUES (%s, %s, %s, %s, NOW())
+                        ON CONFLICT (job) DO UPDATE
+                        SET last_id = EXCLUDED.last_id,
+                            rows_scanned = reprocess_progress.rows_scanned + EXCLUDED.rows_scanned,
+                            rows_rewritten = reprocess_progress.rows_rewritten + EXCLUDED.rows_rewritten,
+                            updated_at = NOW()
+                    """, (job, chunk_last_id, count, len(changed)))
+                    conn.commit()
+
+            scanned += count
+            rewritten += len(changed)
+            elapsed = time.monotonic() - started
+            print(f"🔁 {scanned} rows scanned up to id {chunk_last_id} | {rewritten} rewritten, "
+                  f"{typed} typed rows upserted | {scanned / elapsed if elapsed else 0:,.0f} rows/s")
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Job {job}: scanned {scanned} rows, rewrote {rewritten} ({typed} typed rows) in {elapsed:.1f}s "
+          f"({scanned / elapsed if elapsed else 0:,.0f} rows/s)")
+
+    # The rollup triggers only see inserts, not the rows updated above. A run
+    # that crashed before getting here left its rewrites unreconciled too
+    if get_rewritten(job):
+        reconcile(since, until, devices)
+    return scanned, rewritten
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-decode sigfox_raw with the current decoders and backfill sensor tables")
+    parser.add_argument("--job", default="reprocess", help="checkpoint name (use a new one per decoder fix)")
+    parser.add_argument("--device", action="append", dest="devices", help="only this device id (repeatable)")
+    parser.add_argument("--since", help="only rows received at or after this timestamp")
+    parser.add_argument("--until", help="only rows received before this timestamp")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per page and per transaction")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="decoder processes")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    reprocess(
+        job=args.job,
+        devices=[d.lower() for d in args.devices] if args.devices else None,
+        since=args.since,
+        until=args.until,
+        chunk_size=args.chunk_size,
+        workers=args.workers,
+        restart=args.restart,
+    )
@@ -0,0 +1,166 @@
+"""Response cache for the chart and history endpoints.
+
+Dashboards poll the same (endpoint, user, device, period) combinations from
+every open tab, and the answer only changes when an uplink for one of the
+devices involved is written. `cached_view` keeps each 200 response body for
+up to `ttl` seconds in a size-bounded LRU and drops it as soon as the ingest
+path commits data for a device it covers (db.add_write_listener). Responses
+about all devices of a sensor group (device_id=all) are dropped by any write
+to that group; admin assign/unassign clears everything.
+
+Writes from other processes (bulk_load.py, reprocess.py, rollups.py) are
+not seen, so entries are only as fresh as the TTL after those.
+
+Settings (environment):
+    SGS_RESPONSE_CACHE_TTL          seconds an entry is served (default 60)
+    SGS_RESPONSE_CACHE_MAX_ENTRIES  upper bound on cached responses (default 2000)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, session
+
+RESPONSE_CACHE_TTL = float(os.environ.get("SGS_RESPONSE_CACHE_TTL", 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("SGS_RESPONSE_CACHE_MAX_ENTRIES", 2000))
+
+
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (expires, value, devices, groups), least recently used first
+        self._by_device = {}            # device_id -> keys of entries covering it
+        self._by_group = {}             # sensor group -> keys of entries covering the whole group
+        self._clock = 0                 # bumped by every invalidation
+        self._written = {}              # device_id / sensor group -> clock of its last invalidation
+        self._cleared_at = 0            # clock of the last clear()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evicted': 0,
+                       'invalidated': 0, 'stale_skipped': 0, 'clears': 0}
+
+    def clock(self):
+        """Take before computing a response and pass to put(), so a write in between isn't cached over."""
+        return self._clock
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, value, devices=(), groups=(), since=None):
+        devices, groups = tuple(devices), tuple(groups)
+        with self._lock:
+            if since is not None and (since < self._cleared_at
+                                      or any(self._written.get(name, -1) > since for name in devices + groups)):
+                self._stats['stale_skipped'] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, devices, groups)
+            for device_id in devices:
+                self._by_device.setdefault(device_id, set()).add(key)
+            for group in groups:
+                self._by_group.setdefault(group, set()).add(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._stats['evicted'] += 1
+
+    def invalidate(self, pairs):
+        """Drop every entry covering one of the (device_id, sensor_group) pairs just written."""
+        with self._lock:
+            self._clock += 1
+            for device_id, group in set(pairs):
+                self._written[device_id] = self._written[group] = self._clock
+                for key in self._by_device.get(device_id, set()) | self._by_group.get(group, set()):
+                    self._drop(key)
+                    self._stats['invalidated'] += 1
+
+    def invalidate_entries(self, entries):
+        """db write listener."""
+        self.invalidate((entry.get("device_id"), entry.get("sensor_group")) for entry in entries)
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._cleared_at = self._clock
+            self._written = {}
+            self._entries.clear()
+            self._by_device.clear()
+            self._by_group.clear()
+            self._stats['clears'] += 1
+
+    def _drop(self, key):
+        _, _, devices, groups = self._entries.pop(key)
+        for index, names in ((self._by_device, devices), (self._by_group, groups)):
+            for name in names:
+                keys = index.get(name)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[name]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._entries), 'max_entries': self.max_entries, 'ttl': self.ttl})
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 4) if total else None
+        return stats
+
+
+response_cache = ResponseCache()
+
+
+def cached_view(endpoint, group, device=None, depends=None, per_user=False):
+    """
+    Serve a JSON view's 200 responses from response_cache, keyed by
+    (endpoint, user, device, period).
+
+    device():        the device the request is about (default: the device_id
+                     argument; None or 'all' means every device of `group`)
+    depends(body):   devices a response covers, when only the view knows them
+    per_user:        the view is for a logged-in user; other sessions bypass the cache
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = None
+            if per_user:
+                if session.get('logged_in') is not True or session.get('role') != 'user' or not session.get('user_id'):
+                    return view(*args, **kwargs)
+                user_id = session['user_id']
+
+            device_id = device() if device else request.args.get('device_id')
+            if device_id == 'all':
+                device_id = None
+            key = (endpoint, user_id, device_id, request.args.get('period', 'Weekly'))
+
+            cached = response_cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                return current_app.response_class(body, mimetype=mimetype)
+
+            since = response_cache.clock()
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                devices = list(depends(response.get_json()) or ()) if depends else [device_id] if device_id else []
+                response_cache.put(key, (response.get_data(), response.mimetype),
+                                   devices=devices, groups=() if devices else (group,), since=since)
+            return response
+        return wrapper
+    return decorate
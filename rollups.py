@@ -0,0 +1,268 @@
+"""Hourly and daily per-device rollups of the sensor tables.
+
+sensor_rollup_hourly and sensor_rollup_daily hold one row per device and
+bucket with the reading count, temperature count/sum/min/max, pulse
+reading count/sum/min/max and the seconds spent wet/dry (WATER_DETECTOR) and open/closed
+(MAGNETIC). The chart endpoints read these instead of grouping raw rows, so
+their cost follows the number of buckets in the window.
+
+Every sensor table has a statement-level AFTER INSERT trigger that folds the
+inserted rows (its transition table) into both rollups, so a batch insert
+costs one upsert per touched bucket rather than one per row. Time in a state
+is the gap between a reading and the device's previous one, credited to the
+previous state and split over the hours it covers; gaps longer than
+SGS_ROLLUP_MAX_STATE_GAP_HOURS are cut to that length.
+
+The trigger only sees inserts. Rows that arrive out of order (older than the
+device's latest reading), updates (reprocess.py) and deletes leave the
+buckets around them stale until they are rebuilt from the raw tables, one
+day per transaction:
+
+    python rollups.py reconcile                                 rebuild everything
+    python rollups.py reconcile --since 2025-05-01 --until 2025-06-01
+    python rollups.py reconcile --device 1fc74ab
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from db import get_db_connection, sensor_rows
+
+ROLLUP_MAX_STATE_GAP_HOURS = int(os.environ.get("SGS_ROLLUP_MAX_STATE_GAP_HOURS", 24))
+
+ROLLUP_TABLES = {"hour": "sensor_rollup_hourly", "day": "sensor_rollup_daily"}
+
+# rollup column -> (how buckets combine, type). The tables themselves are
+# created by the schema.py migrations: a new column needs a new migration.
+ROLLUP_COLUMNS = {
+    "readings": ("sum", "INTEGER"),
+    "temp_count": ("sum", "INTEGER"),
+    "temp_sum": ("sum", "DOUBLE PRECISION"),
+    "temp_min": ("min", "DOUBLE PRECISION"),
+    "temp_max": ("max", "DOUBLE PRECISION"),
+    "pulse_readings": ("sum", "INTEGER"),
+    "pulse_sum": ("sum", "BIGINT"),
+    "pulse_min": ("min", "INTEGER"),
+    "pulse_max": ("max", "INTEGER"),
+    "wet_seconds": ("sum", "DOUBLE PRECISION"),
+    "dry_seconds": ("sum", "DOUBLE PRECISION"),
+    "open_seconds": ("sum", "DOUBLE PRECISION"),
+    "closed_seconds": ("sum", "DOUBLE PRECISION"),
+}
+
+# Per-reading metrics: rollup column -> expression over the sensor row
+POINT_METRICS = {
+    "PWR_TEMP": {
+        "temp_count": "(temp_celsius IS NOT NULL)::int",
+        "temp_sum": "temp_celsius",
+        "temp_min": "temp_celsius",
+        "temp_max": "temp_celsius",
+    },
+    "PULSE_DETECTOR": {
+        "pulse_readings": "1",
+        "pulse_sum": "pulse_count",
+        "pulse_min": "pulse_count",
+        "pulse_max": "pulse_count",
+    },
+}
+
+# Time-in-state metrics: (state column, {rollup column: condition on the state})
+STATE_METRICS = {
+    "WATER_DETECTOR": ("water_detected", {"wet_seconds": "water_detected = 'True'",
+                                          "dry_seconds": "water_detected = 'False'"}),
+    "MAGNETIC": ("status", {"open_seconds": "status = 'open'",
+                            "closed_seconds": "status = 'closed'"}),
+}
+
+ROLLUP_SOURCES = [table for table, _, _ in sensor_rows.values()]
+
+AGGREGATES = {"sum": "COALESCE(SUM({0}), 0)", "min": "MIN({0})", "max": "MAX({0})"}
+MERGES = {"sum": "r.{0} + EXCLUDED.{0}", "min": "LEAST(r.{0}, EXCLUDED.{0})", "max": "GREATEST(r.{0}, EXCLUDED.{0})"}
+
+
+def _zero(column):
+    kind, sql_type = ROLLUP_COLUMNS[column]
+    return f"0::{sql_type}" if kind == "sum" else f"NULL::{sql_type}"
+
+
+def contributions_sql(table, source, rollup_columns=ROLLUP_COLUMNS):
+    """
+    SELECT of (device_id, at, <rollup columns>) for the rows of `source`, a
+    relation shaped like `table`. `rollup_columns` are the columns to fill,
+    in order: schema.py passes the set as of the migration it builds.
+    """
+    point = POINT_METRICS.get(table, {})
+    columns = ", ".join(f"{point.get(column, _zero(column))} AS {column}"
+                        for column in rollup_columns if column != "readings")
+    parts = [f"""
+        SELECT device_id, received_at AS at, 1 AS readings, {columns}
+        FROM {source} n
+        WHERE received_at IS NOT NULL
+    """]
+
+    if table in STATE_METRICS:
+        state, conditions = STATE_METRICS[table]
+        columns = ", ".join(
+            f"CASE WHEN {conditions[column]} THEN seconds ELSE 0 END AS {column}" if column in conditions
+            else f"{_zero(column)} AS {column}"
+            for column in rollup_columns
+        )
+        # The gap before each reading belongs to the previous reading's state,
+        # split at hour boundaries (which are also day boundaries)
+        parts.append(f"""
+        SELECT device_id, at, {columns}
+        FROM (
+            SELECT n.device_id, p.{state}, GREATEST(p.started, h) AS at,
+                   EXTRACT(EPOCH FROM LEAST(n.received_at, h + INTERVAL '1 hour') - GREATEST(p.started, h)) AS seconds
+            FROM {source} n
+            CROSS JOIN LATERAL (
+                SELECT {state}, GREATEST(received_at, n.received_at - INTERVAL '{ROLLUP_MAX_STATE_GAP_HOURS} hours') AS started
+                FROM {table}
+                WHERE device_id = n.device_id AND received_at < n.received_at
+                ORDER BY received_at DESC
+                LIMIT 1
+            ) p
+            CROSS JOIN LATERAL generate_series(date_trunc('hour', p.started), n.received_at, INTERVAL '1 hour') AS h
+            WHERE h < n.received_at
+        ) pieces
+        """)
+    return "UNION ALL".join(parts)
+
+
+def upsert_sql(table, source, unit, where="", rollup_columns=ROLLUP_COLUMNS):
+    """Aggregate the contributions of `source` into `unit` buckets and add them to the rollup."""
+    columns = ", ".join(rollup_columns)
+    aggregates = ", ".join(AGGREGATES[ROLLUP_COLUMNS[column][0]].format(column) for column in rollup_columns)
+    merges = ", ".join(f"{column} = {MERGES[ROLLUP_COLUMNS[column][0]].format(column)}" for column in rollup_columns)
+    return f"""
+        INSERT INTO {ROLLUP_TABLES[unit]} AS r (device_id, bucket, {columns}, updated_at)
+        SELECT device_id, date_trunc('{unit}', at) AS bucket, {aggregates}, NOW()
+        FROM ({contributions_sql(table, source, rollup_columns)}) c
+        {where}
+        GROUP BY device_id, bucket
+        ON CONFLICT (device_id, bucket) DO UPDATE
+        SET {merges}, updated_at = NOW()
+    """
+
+
+def trigger_function_sql(table, rollup_columns=ROLLUP_COLUMNS):
+    return f"""
+        CREATE OR REPLACE FUNCTION {table.lower()}_rollup() RETURNS trigger AS $$
+        BEGIN
+            {upsert_sql(table, "new_rows", "hour", rollup_columns=rollup_columns)};
+            {upsert_sql(table, "new_rows", "day", rollup_columns=rollup_columns)};
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """
+
+
+# (table, statement); re-run by partitioning.py after it replaces a table
+ROLLUP_TRIGGERS = [
+    (table, statement)
+    for table in ROLLUP_SOURCES
+    for statement in (
+        f"DROP TRIGGER IF EXISTS {table.lower()}_rollup ON {table}",
+        f"""
+        CREATE TRIGGER {table.lower()}_rollup
+        AFTER INSERT ON {table}
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION {table.lower()}_rollup()
+        """,
+    )
+]
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _history_bounds(cur, devices=None):
+    """(earliest, latest) reading or daily bucket, over the sensor tables and the daily rollup."""
+    where = "WHERE device_id = ANY(%(devices)s)" if devices else ""
+    spans = [f"SELECT MIN(received_at) AS earliest, MAX(received_at) AS latest FROM {table} {where}"
+             for table in ROLLUP_SOURCES]
+    # Buckets without rows left behind them must go too
+    spans.append(f"SELECT MIN(bucket), MAX(bucket) FROM {ROLLUP_TABLES['day']} {where}")
+    cur.execute(f"SELECT MIN(earliest), MAX(latest) FROM ({' UNION ALL '.join(spans)}) s",
+                {"devices": list(devices) if devices else None})
+    return cur.fetchone()
+
+
+def _rebuild_day(cur, day, devices=None):
+    """Rebuild the hourly and daily buckets of one day. Returns {unit: buckets written}."""
+    params = {"since": day, "until": day + timedelta(days=1), "devices": list(devices) if devices else None,
+              "gap": timedelta(hours=ROLLUP_MAX_STATE_GAP_HOURS)}
+    bucket_filter = ["bucket >= %(since)s", "bucket < %(until)s"]
+    at_filter = ["at >= %(since)s", "at < %(until)s"]
+    # Readings up to one gap later still credit state time to the day
+    source_filter = ["received_at >= %(since)s", "received_at < %(until)s + %(gap)s"]
+    if devices:
+        bucket_filter.append("device_id = ANY(%(devices)s)")
+        source_filter.append("device_id = ANY(%(devices)s)")
+
+    written = {}
+    cur.execute(f"LOCK TABLE {', '.join(ROLLUP_TABLES.values())} IN SHARE ROW EXCLUSIVE MODE")
+    for unit, rollup in ROLLUP_TABLES.items():
+        cur.execute(f"DELETE FROM {rollup} WHERE {' AND '.join(bucket_filter)}", params)
+        written[unit] = 0
+        for table in ROLLUP_SOURCES:
+            source = f"(SELECT * FROM {table} WHERE {' AND '.join(source_filter)})"
+            cur.execute(upsert_sql(table, source, unit, f"WHERE {' AND '.join(at_filter)}"), params)
+            written[unit] += cur.rowcount
+    return written
+
+
+def reconcile(since=None, until=None, devices=None):
+    """
+    Rebuild the buckets of [since, until), widened to whole days, from the
+    sensor tables (default: the whole history). Each day is rebuilt in its
+    own transaction, so ingest waits on the rollup lock for one day's
+    rebuild at a time, not the whole range. Returns the number of (hourly,
+    daily) buckets written.
+    """
+    since = _as_datetime(since)
+    until = _as_datetime(until)
+    if since is None or until is None:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                earliest, latest = _history_bounds(cur, devices)
+                conn.rollback()
+        if earliest is None:
+            print("ℹ️ No readings or buckets to rebuild")
+            return 0, 0
+        since = since or earliest
+        until = until or latest + timedelta(days=1)
+    since = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    if until != until.replace(hour=0, minute=0, second=0, microsecond=0):
+        until = until.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    written = {unit: 0 for unit in ROLLUP_TABLES}
+    day = since
+    while day < until:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                for unit, count in _rebuild_day(cur, day, devices).items():
+                    written[unit] += count
+                conn.commit()
+        day += timedelta(days=1)
+
+    print(f"✅ Rebuilt {written['hour']} hourly and {written['day']} daily buckets "
+          f"from {since:%Y-%m-%d} to {until:%Y-%m-%d}")
+    return written["hour"], written["day"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the hourly/daily sensor rollups")
+    parser.add_argument("command", choices=["reconcile"])
+    parser.add_argument("--since", help="first day to rebuild (default: all history)")
+    parser.add_argument("--until", help="rebuild up to this timestamp, rounded up to a whole day")
+    parser.add_argument("--device", action="append", dest="devices", help="only this device id (repeatable)")
+    args = parser.parse_args()
+
+    reconcile(
+        since=args.since,
+        until=args.until,
+        devices=[d.lower() for d in args.devices] if args.devices else None,
+    )
@@ -0,0 +1,373 @@
+"""Versioned schema bootstrap for SGS_Database.
+
+All tables and indexes are owned here. Each migration is a numbered list of
+statements applied once, in order, in its own transaction; applied versions
+are recorded in `schema_version`. The ingest path only ever issues DML.
+
+Run it once at startup (app.py does) or from the command line:
+    python schema.py            apply pending migrations
+    python schema.py status     show applied / pending versions
+
+Migrations must be idempotent (IF NOT EXISTS etc.) so drop_and_recreate_tables()
+in db.py can replay them after dropping tables. An applied migration must
+keep creating exactly what it did: its DDL is written out literally rather
+than built from definitions that later changes would edit, and new columns
+go in new migrations.
+"""
+
+import argparse
+
+from db import get_db_connection, sensor_rows
+from decoder_registry import STATIC_DEVICE_DECODERS
+from latest_state import LATEST_STATE_DDL, LATEST_STATE_TRIGGERS, upsert_sql as latest_state_upsert_sql
+from rollups import ROLLUP_SOURCES, ROLLUP_TABLES, ROLLUP_TRIGGERS, upsert_sql, trigger_function_sql
+
+# Arbitrary key for pg_advisory_lock so concurrent workers don't migrate twice
+MIGRATION_LOCK_KEY = 0x5165_0001
+
+# Rollup columns as of the migrations that built the trigger functions and backfills
+ROLLUP_COLUMNS_V6 = ["readings", "temp_count", "temp_sum", "temp_min", "temp_max", "pulse_sum", "pulse_min",
+                     "pulse_max", "wet_seconds", "dry_seconds", "open_seconds", "closed_seconds"]
+ROLLUP_COLUMNS_V8 = ["readings", "temp_count", "temp_sum", "temp_min", "temp_max", "pulse_readings", "pulse_sum",
+                     "pulse_min", "pulse_max", "wet_seconds", "dry_seconds", "open_seconds", "closed_seconds"]
+
+# Updated sensor tables to support historical data (multiple records per device)
+sensor_tables = {
+    "PWR_TEMP": """
+        CREATE TABLE IF NOT EXISTS PWR_TEMP (
+            id SERIAL PRIMARY KEY,
+            device_id TEXT NOT NULL,
+            sequence INTEGER,
+            temp_celsius FLOAT,
+            received_at TIMESTAMP,
+            UNIQUE(device_id, sequence, received_at)
+        )
+    """,
+    "WATER_DETECTOR": """
+        CREATE TABLE IF NOT EXISTS WATER_DETECTOR (
+            id SERIAL PRIMARY KEY,
+            device_id TEXT NOT NULL,
+            sequence INTEGER,
+            water_detected TEXT,
+            received_at TIMESTAMP,
+            UNIQUE(device_id, sequence, received_at)
+        )
+    """,
+    "PULSE_DETECTOR": """
+        CREATE TABLE IF NOT EXISTS PULSE_DETECTOR (
+            id SERIAL PRIMARY KEY,
+            device_id TEXT NOT NULL,
+            sequence INTEGER,
+            pulse_count INTEGER,
+            leak_detected TEXT,
+            received_at TIMESTAMP,
+            UNIQUE(device_id, sequence, received_at)
+        )
+    """,
+    "MAGNETIC": """
+        CREATE TABLE IF NOT EXISTS MAGNETIC (
+            id SERIAL PRIMARY KEY,
+            device_id TEXT NOT NULL,
+            sequence INTEGER,
+            status TEXT,
+            received_at TIMESTAMP,
+            UNIQUE(device_id, sequence, received_at)
+        )
+    """,
+    "TANK_LEVEL": """
+        CREATE TABLE IF NOT EXISTS TANK_LEVEL (
+            id SERIAL PRIMARY KEY,
+            device_id TEXT NOT NULL,
+            sequence INTEGER,
+            level_percentage INTEGER,
+            battery_volts FLOAT,
+            received_at TIMESTAMP,
+            UNIQUE(device_id, sequence, received_at)
+        )
+    """
+}
+
+users_table = """
+    CREATE TABLE IF NOT EXISTS Users (
+        user_ID SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        surname TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        location VARCHAR NOT NULL,
+        password TEXT NOT NULL
+    )
+"""
+
+user_device_table = """
+    CREATE TABLE IF NOT EXISTS USER_DEVICE (
+        device_id TEXT NOT NULL,
+        user_id INTEGER REFERENCES Users(user_ID) ON DELETE SET NULL,
+        sensor_type TEXT NOT NULL,
+        PRIMARY KEY (device_id),
+        UNIQUE (device_id, sensor_type)
+    )
+"""
+
+sigfox_raw_table = """
+    CREATE TABLE IF NOT EXISTS sigfox_raw (
+        id SERIAL PRIMARY KEY,
+        timestamp TIMESTAMP,
+        device_id TEXT,
+        device_type TEXT,
+        sequence INTEGER,
+        raw_payload TEXT,
+        decoded JSONB,
+        sensor_group TEXT,
+        received_at TIMESTAMP
+    )
+"""
+
+# (table, statement) for the secondary indexes of the read paths. Kept apart
+# from the migration so partitioning.py can rebuild them on converted tables.
+READ_PATH_INDEXES = [
+    # Latest reading / per-device history: (device_id, received_at DESC) serves
+    # ORDER BY received_at DESC LIMIT 1 and range scans, and INCLUDE makes them index-only
+    *(
+        (table, f"CREATE INDEX IF NOT EXISTS {table.lower()}_device_received_idx "
+                f"ON {table} (device_id, received_at DESC) INCLUDE ({', '.join(columns)})")
+        for table, columns, _ in sensor_rows.values()
+    ),
+    # Fleet-wide "received_at >= NOW() - INTERVAL ..." charts
+    *(
+        (table, f"CREATE INDEX IF NOT EXISTS {table.lower()}_received_idx ON {table} (received_at)")
+        for table, _, _ in sensor_rows.values()
+    ),
+    ("sigfox_raw", "CREATE INDEX IF NOT EXISTS sigfox_raw_device_received_idx ON sigfox_raw (device_id, received_at DESC)"),
+    ("sigfox_raw", "CREATE INDEX IF NOT EXISTS sigfox_raw_received_idx ON sigfox_raw (received_at)"),
+    ("sigfox_raw", "CREATE INDEX IF NOT EXISTS sigfox_raw_sensor_group_idx ON sigfox_raw (sensor_group, id)"),
+]
+
+# (table, statement) for the triggers on tables that partitioning.py may replace
+TABLE_TRIGGERS = ROLLUP_TRIGGERS + LATEST_STATE_TRIGGERS
+
+# (version, description, statements)
+MIGRATIONS = [
+    (1, "base tables", [
+        users_table,
+        user_device_table,
+        *sensor_tables.values(),
+        sigfox_raw_table,
+        "CREATE INDEX IF NOT EXISTS user_device_user_id_idx ON USER_DEVICE (user_id)",
+    ]),
+    (2, "bulk loader checkpoints", [
+        """
+        CREATE TABLE IF NOT EXISTS bulk_load_progress (
+            source TEXT PRIMARY KEY,
+            entries_loaded BIGINT NOT NULL DEFAULT 0,
+            rows_loaded BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    (3, "reprocess checkpoints", [
+        """
+        CREATE TABLE IF NOT EXISTS reprocess_progress (
+            job TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            rows_scanned BIGINT NOT NULL DEFAULT 0,
+            rows_rewritten BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+    ]),
+    (4, "device decoder registry", [
+        "CREATE SEQUENCE IF NOT EXISTS device_decoders_version_seq",
+        """
+        CREATE TABLE IF NOT EXISTS device_decoders (
+            device_id TEXT PRIMARY KEY,
+            decoder TEXT NOT NULL,
+            active BOOLEAN NOT NULL DEFAULT TRUE,
+            version BIGINT NOT NULL DEFAULT nextval('device_decoders_version_seq'),
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS device_decoders_version_idx ON device_decoders (version)",
+        """
+        CREATE OR REPLACE FUNCTION device_decoders_bump_version() RETURNS trigger AS $$
+        BEGIN
+            NEW.version := nextval('device_decoders_version_seq');
+            NEW.updated_at := NOW();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS device_decoders_version ON device_decoders",
+        """
+        CREATE TRIGGER device_decoders_version
+        BEFORE INSERT OR UPDATE ON device_decoders
+        FOR EACH ROW EXECUTE FUNCTION device_decoders_bump_version()
+        """,
+        # Seed with the device sets that used to be hardcoded in app.py
+        "INSERT INTO device_decoders (device_id, decoder) VALUES "
+        + ", ".join(f"('{device_id}', '{decoder.__name__}')" for device_id, decoder in sorted(STATIC_DEVICE_DECODERS.items()))
+        + " ON CONFLICT (device_id) DO NOTHING",
+    ]),
+    (5, "read path indexes", [statement for _, statement in READ_PATH_INDEXES]),
+    (6, "hourly and daily rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS sensor_rollup_hourly (
+            device_id TEXT NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0,
+            temp_count INTEGER NOT NULL DEFAULT 0,
+            temp_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            temp_min DOUBLE PRECISION,
+            temp_max DOUBLE PRECISION,
+            pulse_sum BIGINT NOT NULL DEFAULT 0,
+            pulse_min INTEGER,
+            pulse_max INTEGER,
+            wet_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            dry_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            open_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            closed_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (device_id, bucket)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS sensor_rollup_daily (
+            device_id TEXT NOT NULL,
+            bucket TIMESTAMP NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0,
+            temp_count INTEGER NOT NULL DEFAULT 0,
+            temp_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            temp_min DOUBLE PRECISION,
+            temp_max DOUBLE PRECISION,
+            pulse_sum BIGINT NOT NULL DEFAULT 0,
+            pulse_min INTEGER,
+            pulse_max INTEGER,
+            wet_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            dry_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            open_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            closed_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (device_id, bucket)
+        )
+        """,
+        # Fleet-wide charts select on the bucket alone
+        "CREATE INDEX IF NOT EXISTS sensor_rollup_hourly_bucket_idx ON sensor_rollup_hourly (bucket)",
+        "CREATE INDEX IF NOT EXISTS sensor_rollup_daily_bucket_idx ON sensor_rollup_daily (bucket)",
+        *(trigger_function_sql(table, ROLLUP_COLUMNS_V6) for table in ROLLUP_SOURCES),
+        *(statement for _, statement in ROLLUP_TRIGGERS),
+        # Backfill from the existing rows; the triggers keep them current from here on
+        *(upsert_sql(table, table, unit, rollup_columns=ROLLUP_COLUMNS_V6)
+          for unit in ROLLUP_TABLES for table in ROLLUP_SOURCES),
+    ]),
+    (7, "device latest state", [
+        *LATEST_STATE_DDL,
+        latest_state_upsert_sql("sigfox_raw"),
+    ]),
+    (8, "rollup pulse reading counts", [
+        *(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS pulse_readings INTEGER NOT NULL DEFAULT 0"
+          for table in ROLLUP_TABLES.values()),
+        # The trigger functions list every rollup column
+        *(trigger_function_sql(table, ROLLUP_COLUMNS_V8) for table in ROLLUP_SOURCES),
+        *(f"""
+        UPDATE {table} r SET pulse_readings = c.readings
+        FROM (
+            SELECT device_id, date_trunc('{unit}', received_at) AS bucket, COUNT(*) AS readings
+            FROM PULSE_DETECTOR
+            WHERE received_at IS NOT NULL
+            GROUP BY 1, 2
+        ) c
+        WHERE r.device_id = c.device_id AND r.bucket = c.bucket
+        """ for unit, table in ROLLUP_TABLES.items()),
+    ]),
+]
+
+
+def _ensure_version_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+def applied_versions():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            _ensure_version_table(cur)
+            cur.execute("SELECT version FROM schema_version")
+            return {row[0] for row in cur.fetchall()}
+
+
+def current_version():
+    versions = applied_versions()
+    return max(versions) if versions else 0
+
+
+def migrate(verbose=True):
+    """Apply every pending migration. Returns the list of versions applied."""
+    applied = []
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+            try:
+                _ensure_version_table(cur)
+                cur.execute("SELECT version FROM schema_version")
+                done = {row[0] for row in cur.fetchall()}
+                conn.commit()
+
+                for version, description, statements in MIGRATIONS:
+                    if version in done:
+                        continue
+                    try:
+                        for statement in statements:
+                            cur.execute(statement)
+                        cur.execute(
+                            "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                            (version, description)
+                        )
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        print(f"❌ Migration {version} ({description}) failed")
+                        raise
+                    applied.append(version)
+                    if verbose:
+                        print(f"✅ Applied migration {version}: {description}")
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+                conn.commit()
+
+    if verbose and not applied:
+        print("ℹ️ Schema is up to date.")
+    return applied
+
+
+def reset_versions(versions=None):
+    """Forget applied versions so migrate() replays them (all by default)."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            _ensure_version_table(cur)
+            if versions is None:
+                cur.execute("DELETE FROM schema_version")
+            else:
+                cur.execute("DELETE FROM schema_version WHERE version = ANY(%s)", (list(versions),))
+            conn.commit()
+
+
+def print_status():
+    done = applied_versions()
+    for version, description, _ in MIGRATIONS:
+        state = "applied" if version in done else "pending"
+        print(f"{version:>4}  {state:<8} {description}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the SGS_Database schema")
+    parser.add_argument("command", nargs="?", default="migrate", choices=["migrate", "status"])
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print_status()
+    else:
+        migrate()
@@ -0,0 +1,475 @@
+"""Crash-safe append-only spool for uplinks that could not (yet) reach PostgreSQL.
+
+Entries are appended to segment files in the spool directory as checksummed
+records:
+
+    [4-byte payload length][4-byte CRC32 of payload][payload: JSON entry]
+
+Appends are group-committed: with SGS_SPOOL_FSYNC_INTERVAL=0 (the default)
+append() returns only after an fsync covering the record, but concurrent
+appenders share one fsync. A positive interval instead fsyncs in the
+background at that period, trading a bounded loss window for latency.
+
+A SpoolReplayer thread drains the spool into the database in arrival order
+(so per-device ordering is kept) with db.save_entries, persists its read
+position in `checkpoint` after every committed batch and deletes segments
+once they are fully replayed. Entries the database rejects for what they
+contain are moved to the dead-letter log (`dead-letter.log`, same record
+format, with the error) so replay moves past them; only connection trouble
+makes it wait and retry. After a crash a torn record at the tail of the
+last segment is truncated on open; the bytes of a corrupt record and
+everything after it in its segment are copied to `corrupt-*.bin` and
+skipped.
+
+A spool directory belongs to one process: opening it takes an exclusive
+flock on its `lock` file. When another process (e.g. another gunicorn
+worker) already holds SGS_SPOOL_DIR, this one claims the first free
+`worker-N` subdirectory instead, and replays only that. The lock goes with
+the process, so a restarted worker claims a slot left by a dead one and
+replays what it left behind; entries in a slot no running process claims
+(after scaling down) wait there until one does.
+
+Settings (environment):
+    SGS_SPOOL_DIR             spool directory (default ./spool next to this file)
+    SGS_SPOOL_SEGMENT_BYTES   segment rotation size (default 16 MiB)
+    SGS_SPOOL_FSYNC_INTERVAL  0 = fsync before acknowledging, >0 = background fsync period
+    SGS_SPOOL_REPLAY_BATCH    records per replayed batch (default 500)
+"""
+
+import fcntl
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from db import save_entries
+
+SPOOL_DIR = os.environ.get("SGS_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_SEGMENT_BYTES = int(os.environ.get("SGS_SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_FSYNC_INTERVAL = float(os.environ.get("SGS_SPOOL_FSYNC_INTERVAL", 0))
+SPOOL_REPLAY_BATCH = int(os.environ.get("SGS_SPOOL_REPLAY_BATCH", 500))
+
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_NAME = re.compile(r"^segment-(\d{12})\.log$")
+CHECKPOINT_NAME = "checkpoint"
+DEAD_LETTER_NAME = "dead-letter.log"
+LOCK_NAME = "lock"
+WORKER_DIR = re.compile(r"^worker-\d+$")
+
+_claims = {}   # requested directory -> (claimed directory, open lock file)
+_claims_lock = threading.Lock()
+
+
+def claim_directory(directory=SPOOL_DIR):
+    """
+    Return the spool directory this process owns under `directory`: the
+    directory itself, or the first worker-N below it no other process has
+    locked. Claimed once per process; the lock is held until it exits.
+    """
+    with _claims_lock:
+        for claimed, _ in _claims.values():
+            if claimed == directory:
+                return claimed
+        if directory not in _claims:
+            slot = 0
+            while True:
+                path = directory if slot == 0 else os.path.join(directory, f"worker-{slot}")
+                os.makedirs(path, exist_ok=True)
+                lock = open(os.path.join(path, LOCK_NAME), "a")
+                try:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock.close()
+                    slot += 1
+                    continue
+                if slot:
+                    print(f"⚠️ Spool directory {directory} is in use by another process, using {path}")
+                _claims[directory] = (path, lock)
+                break
+        return _claims[directory][0]
+
+
+def encode_record(entry):
+    payload = json.dumps(entry, separators=(",", ":"), default=str).encode("utf-8")
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path, start, end):
+    """
+    Yield (entry, next_offset) for the valid records of a segment between two
+    offsets. Stops at the first torn or corrupt record.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        while offset + RECORD_HEADER.size <= end:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            length, crc = RECORD_HEADER.unpack(header)
+            if offset + RECORD_HEADER.size + length > end:
+                return
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            offset += RECORD_HEADER.size + length
+            yield json.loads(payload), offset
+
+
+class Spool:
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, fsync_interval=SPOOL_FSYNC_INTERVAL):
+        self.directory = claim_directory(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+
+        # Lock order: _sync_lock before _write_lock
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.data_available = threading.Event()
+
+        self._stats = {
+            'records_appended': 0,
+            'bytes_appended': 0,
+            'fsyncs': 0,
+            'segments_rotated': 0,
+            'segments_deleted': 0,
+            'corrupt_segments': 0,
+            'torn_bytes_truncated': 0,
+        }
+
+        segments = self._segments()
+        self._segment_id = segments[-1] if segments else 1
+        self._offset = self._recover_tail(self._segment_id)
+        self._file = open(self._path(self._segment_id), "ab", buffering=0)
+        self._written = 0   # append tickets handed out
+        self._synced = 0    # tickets covered by an fsync
+
+        self._read_pos = self._load_checkpoint() or ((segments[0] if segments else self._segment_id), 0)
+        if self.has_backlog():
+            self.data_available.set()
+
+        if fsync_interval > 0:
+            threading.Thread(target=self._fsync_loop, name="spool-fsync", daemon=True).start()
+
+    # -- files --------------------------------------------------------------
+
+    @staticmethod
+    def has_segments(directory=SPOOL_DIR):
+        """True if a spool directory or its worker-N slots hold segment files (possibly left by a previous run)."""
+        if not os.path.isdir(directory):
+            return False
+        for name in os.listdir(directory):
+            if SEGMENT_NAME.match(name):
+                return True
+            if WORKER_DIR.match(name) and Spool.has_segments(os.path.join(directory, name)):
+                return True
+        return False
+
+    def _path(self, segment_id):
+        return os.path.join(self.directory, f"segment-{segment_id:012d}.log")
+
+    def _segments(self):
+        ids = []
+        for name in os.listdir(self.directory):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                ids.append(int(match.group(1)))
+        return sorted(ids)
+
+    def _recover_tail(self, segment_id):
+        """Truncate a torn record left by a crash; return the segment's valid length."""
+        path = self._path(segment_id)
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        valid = 0
+        for _, valid in read_records(path, 0, size):
+            pass
+        if valid < size:
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+                os.fsync(f.fileno())
+            self._stats['torn_bytes_truncated'] += size - valid
+            print(f"⚠️ Spool segment {segment_id}: truncated {size - valid} torn bytes")
+        return valid
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_NAME)) as f:
+                data = json.load(f)
+            return int(data["segment"]), int(data["offset"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_checkpoint(self, position):
+        path = os.path.join(self.directory, CHECKPOINT_NAME)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    # -- writing ------------------------------------------------------------
+
+    def append(self, entry):
+        """Durably append one entry (see the fsync settings above)."""
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        records = b"".join(encode_record(entry) for entry in entries)
+
+        with self._write_lock:
+            rotate = self._needs_rotation(len(records))
+        if rotate:
+            self._rotate(len(records))
+
+        with self._write_lock:
+            self._file.write(records)
+            self._offset += len(records)
+            self._written += 1
+            ticket = self._written
+            self._stats['records_appended'] += len(entries)
+            self._stats['bytes_appended'] += len(records)
+
+        if self.fsync_interval == 0:
+            self._sync(ticket)
+        self.data_available.set()
+
+    def _sync(self, ticket):
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return  # another appender's fsync already covered this record
+            with self._write_lock:
+                target = self._written
+                fileno = self._file.fileno()
+            os.fsync(fileno)
+            self._synced = target
+            self._stats['fsyncs'] += 1
+
+    def _fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._write_lock:
+                ticket = self._written
+            if ticket > self._synced:
+                self._sync(ticket)
+
+    def _needs_rotation(self, size):
+        return self._offset > 0 and self._offset + size > self.segment_bytes
+
+    def _rotate(self, size):
+        with self._sync_lock:
+            with self._write_lock:
+                if not self._needs_rotation(size):
+                    return  # another appender rotated already
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._synced = self._written
+                self._segment_id += 1
+                self._offset = 0
+                self._file = open(self._path(self._segment_id), "ab", buffering=0)
+                self._stats['segments_rotated'] += 1
+
+    # -- reading ------------------------------------------------------------
+
+    def _write_position(self):
+        with self._write_lock:
+            return self._segment_id, self._offset
+
+    @property
+    def read_position(self):
+        return self._read_pos
+
+    def has_backlog(self):
+        return self._read_pos < self._write_position()
+
+    def read_batch(self, max_records):
+        """
+        Return (records, position_after) starting at the replay checkpoint, where
+        records are (entry, position after the entry). Nothing is consumed until
+        commit() is called with one of those positions.
+        """
+        segment_id, offset = self._read_pos
+        active_id, active_end = self._write_position()
+
+        while segment_id < active_id:
+            path = self._path(segment_id)
+            if not os.path.exists(path):
+                segment_id, offset = segment_id + 1, 0
+                continue
+            end = os.path.getsize(path)
+            records, position = self._read_segment(segment_id, offset, end, max_records)
+            if records:
+                return records, position
+            if position[1] < end:
+                self._quarantine(segment_id, position[1], end)
+            # Sealed segment fully read: move on to the next one
+            return [], (segment_id + 1, 0)
+
+        records, position = self._read_segment(segment_id, offset, active_end, max_records)
+        if not records and position[1] < active_end:
+            # Only whole appends are below the write position, so this record is corrupt, not torn
+            self._quarantine(segment_id, position[1], active_end)
+            return [], (segment_id, active_end)
+        return records, position
+
+    def _read_segment(self, segment_id, offset, end, max_records):
+        records = []
+        for entry, offset_after in read_records(self._path(segment_id), offset, end):
+            offset = offset_after
+            records.append((entry, (segment_id, offset)))
+            if len(records) >= max_records:
+                break
+        return records, (segment_id, offset)
+
+    def _quarantine(self, segment_id, start, end):
+        """Keep the unreadable bytes of a segment for inspection before replay skips them."""
+        path = os.path.join(self.directory, f"corrupt-{segment_id:012d}-{start}.bin")
+        with open(self._path(segment_id), "rb") as src, open(path, "wb") as dst:
+            src.seek(start)
+            dst.write(src.read(end - start))
+            os.fsync(dst.fileno())
+        self._stats['corrupt_segments'] += 1
+        print(f"❌ Spool segment {segment_id} is corrupt at offset {start}; "
+              f"skipping {end - start} bytes (copied to {path})")
+
+    def commit(self, position):
+        """Mark everything before `position` as replayed; delete finished segments."""
+        previous = self._read_pos
+        self._save_checkpoint(position)
+        self._read_pos = position
+        for segment_id in range(previous[0], position[0]):
+            try:
+                os.remove(self._path(segment_id))
+                self._stats['segments_deleted'] += 1
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        segment_id, offset = self._write_position()
+        stats = dict(self._stats)
+        stats.update({
+            'directory': self.directory,
+            'write_position': [segment_id, offset],
+            'replay_position': list(self._read_pos),
+            'backlog': self.has_backlog(),
+        })
+        return stats
+
+
+class DeadLetterLog:
+    """Entries the database rejected, with the error, kept for inspection and manual replay."""
+
+    def __init__(self, directory=SPOOL_DIR):
+        self.path = os.path.join(claim_directory(directory), DEAD_LETTER_NAME)
+        self._lock = threading.Lock()
+        self._stats = {'records_appended': 0, 'last_error': None}
+        if os.path.exists(self.path):
+            # A torn record from a crash would hide every record appended after it
+            size = os.path.getsize(self.path)
+            valid = 0
+            for _, valid in read_records(self.path, 0, size):
+                pass
+            if valid < size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(valid)
+
+    def append(self, rejected):
+        """Durably append [(entry, error)]."""
+        rejected_at = datetime.utcnow().isoformat()
+        records = b"".join(
+            encode_record({"rejected_at": rejected_at, "error": error, "entry": entry})
+            for entry, error in rejected
+        )
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(records)
+                f.flush()
+                os.fsync(f.fileno())
+            self._stats['records_appended'] += len(rejected)
+            self._stats['last_error'] = rejected[-1][1]
+
+    def read(self):
+        """Yield the dead-lettered {"rejected_at", "error", "entry"} records."""
+        if os.path.exists(self.path):
+            for record, _ in read_records(self.path, 0, os.path.getsize(self.path)):
+                yield record
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['path'] = self.path
+        return stats
+
+
+class SpoolReplayer:
+    """Background thread that drains a Spool into the database in arrival order."""
+
+    def __init__(self, spool, write_batch=save_entries, dead_letters=None, batch_size=SPOOL_REPLAY_BATCH,
+                 idle_wait=1.0, max_backoff=30.0):
+        self.spool = spool
+        self.write_batch = write_batch
+        self.dead_letters = dead_letters or DeadLetterLog(spool.directory)
+        self.batch_size = batch_size
+        self.idle_wait = idle_wait
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'batches_replayed': 0, 'records_replayed': 0, 'records_dead_lettered': 0,
+                       'replay_failures': 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self.spool.data_available.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        backoff = self.idle_wait
+        while not self._stop.is_set():
+            self.spool.data_available.clear()
+            records, position = self.spool.read_batch(self.batch_size)
+
+            if not records:
+                if position != self.spool.read_position:
+                    self.spool.commit(position)
+                    continue
+                self.spool.data_available.wait(self.idle_wait)
+                continue
+
+            entries = [entry for entry, _ in records]
+            outcomes = self.write_batch(entries)
+            rejected = [(entry, error) for entry, (outcome, error) in zip(entries, outcomes) if outcome == "rejected"]
+            if rejected:
+                # Retrying can't help these; park them so replay moves on
+                self.dead_letters.append(rejected)
+                self._stats['records_dead_lettered'] += len(rejected)
+
+            # Failed entries are a suffix (see save_entries): everything before them is done
+            done = sum(outcome != "failed" for outcome, _ in outcomes)
+            if done:
+                self.spool.commit(records[done - 1][1])
+                self._stats['records_replayed'] += done - len(rejected)
+            if done == len(records):
+                self._stats['batches_replayed'] += 1
+                backoff = self.idle_wait
+            else:
+                # Database unavailable: keep the remaining records and retry later
+                self._stats['replay_failures'] += 1
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['running'] = self._thread is not None
+        return stats